@@ -0,0 +1,106 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from langchain.embeddings import OpenAIEmbeddings
+
+# The retrieval modules are shared by all the apps in LLMApps
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from embedding_cache import CachedEmbeddings
+from lexical_index import DEFAULT_EMBED_TIMEOUT, SEARCH_MODES
+from pdf_ingestion import FAILED, LiveVectorIndex, start_pdf_ingestion
+
+# Benchmark of the retrieval modes of retrieve_relevant_context (v4 to v7) on a PDF
+# and labeled questions: each question comes with the pages that answer it.
+# Reports, for each mode (hybrid, vector, lexical), recall@k, the share of the
+# questions with a chunk of one of their pages in the top k, and the p50/p99
+# latency of single queries. The PDF is indexed once, or loaded from the document
+# store. The queries are embedded without the embedding cache, so the vector and
+# hybrid latencies include the embeddings round trip; --embed-delay makes the
+# embeddings service slower, to measure the lexical fast path of the hybrid mode.
+#
+# The questions file is a CSV with the columns question and pages (e.g. "12" or "12;13"),
+# or a JSON list of {"question": ..., "pages": [...]}. Pages start at 1.
+#
+# Usage:
+#   python benchmark_retrieval.py manual.pdf questions.csv
+#   python benchmark_retrieval.py manual.pdf questions.json --k 1 4 10 --embed-delay 3
+
+# LangChain embeddings wrapper that delays the queries, like a slow embeddings service
+class SlowEmbeddings:
+    # - embeddings_model: LangChain embeddings model
+    # - delay: seconds added to each query embedding
+    def __init__(self, embeddings_model, delay):
+        self.embeddings_model = embeddings_model
+        self.model = getattr(embeddings_model, 'model', type(embeddings_model).__name__)
+        self.delay = delay
+
+    def embed_documents(self, texts):
+        return self.embeddings_model.embed_documents(texts)
+
+    def embed_query(self, text):
+        time.sleep(self.delay)
+        return self.embeddings_model.embed_query(text)
+
+# Function to load the labeled questions, [(question, set of pages)]
+def load_questions(path):
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.json'):
+            rows = json.load(f)
+        else:
+            rows = [{'question': row['question'], 'pages': row['pages'].split(';')} for row in csv.DictReader(f)]
+    return [(row['question'], {int(page) for page in row['pages']}) for row in rows]
+
+# Function to index the PDF, or load its index from the document store. Returns the LiveVectorIndex.
+def index_pdf(path, embeddings_model):
+    with open(path, 'rb') as f:
+        ingestion = start_pdf_ingestion(f.read(), embeddings_model, name=os.path.basename(path))
+    while not ingestion.done:
+        time.sleep(0.5)
+    if ingestion.status == FAILED:
+        raise RuntimeError(ingestion.describe())
+    print(f"{ingestion.name}: {ingestion.describe()}")
+    return ingestion.index
+
+def run_benchmark(index, questions, modes, ks, embed_timeout):
+    max_k = max(ks)
+    print(f"{len(index)} chunks, {len(questions)} questions, embed timeout {embed_timeout} s")
+    print(f"{'mode':>8} " + ' '.join(f"{f'recall@{k}':>9}" for k in ks) + f" {'p50 ms':>8} {'p99 ms':>8}")
+    for mode in modes:
+        # One query at a time, like the apps
+        latencies = np.empty(len(questions))
+        hits = np.zeros((len(questions), len(ks)), dtype=bool)
+        for i, (question, pages) in enumerate(questions):
+            start_time = time.perf_counter()
+            docs = index.search(question, k=max_k, mode=mode, embed_timeout=embed_timeout)
+            latencies[i] = time.perf_counter() - start_time
+            ranks = [rank for rank, doc in enumerate(docs) if doc.metadata.get('page') in pages]
+            hits[i] = [bool(ranks) and ranks[0] < k for k in ks]
+
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        print(f"{mode:>8} " + ' '.join(f"{recall:9.3f}" for recall in hits.mean(axis=0)) + f" {p50:8.1f} {p99:8.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hybrid, vector and lexical retrieval on a PDF")
+    parser.add_argument('pdf', help="Path to the PDF")
+    parser.add_argument('questions', help="CSV or JSON file of questions and the pages that answer them")
+    parser.add_argument('--modes', nargs='+', default=SEARCH_MODES, choices=SEARCH_MODES)
+    parser.add_argument('--k', nargs='+', type=int, default=[1, 4, 10])
+    parser.add_argument('--embed-timeout', type=float, default=DEFAULT_EMBED_TIMEOUT,
+                        help="Seconds a hybrid search waits for the query embedding")
+    parser.add_argument('--embed-delay', type=float, default=0.0, help="Seconds added to each query embedding")
+    args = parser.parse_args()
+
+    embeddings_model = OpenAIEmbeddings(chunk_size=1000)
+    index = index_pdf(args.pdf, CachedEmbeddings(embeddings_model))
+    # Same chunks, queries embedded without the cache
+    query_model = SlowEmbeddings(embeddings_model, args.embed_delay) if args.embed_delay else embeddings_model
+    index = LiveVectorIndex(query_model, index.vec_db, index.lexical)
+    run_benchmark(index, load_questions(args.questions), args.modes, args.k, args.embed_timeout)
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,28 @@
 import os
 import openai
 import streamlit as st
-from PyPDF2 import PdfReader
 from langchain.vectorstores import FAISS
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+import sys
+# The embedding cache is shared by all the apps in LLMApps
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from embedding_cache import get_embedding_cache
+from pdf_ingestion import extract_text
 
 # Initialize the OpenAI client
 client = openai.OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
 
 
 def extract_text_from_pdf(pdf_file):
-    reader = PdfReader(pdf_file)
-    raw_text = ""
-    for i, page in enumerate(reader.pages):
-        text = page.extract_text()
-        if text:
-            raw_text += text
-    return raw_text
+    # The pages are extracted in a process pool and joined once, see pdf_ingestion.py
+    return extract_text(pdf_file.getvalue())
 
 
 def generate_embeddings(text, model="text-embedding-ada-002"):
     text = text.replace("\n", " ")
-    return client.embeddings.create(input=[text], model=model).data[0].embedding
+    # Only cache misses are sent to the API
+    return get_embedding_cache(model).get_or_embed(
+        [text], lambda texts: [v.embedding for v in client.embeddings.create(input=texts, model=model).data])[0]
 
 def create_vector_database(raw_text):
     # Chunk the text
@@ -1,45 +1,38 @@
 import os
+import time
 import openai
 import streamlit as st
-from PyPDF2 import PdfReader
-from langchain.vectorstores import FAISS
 from langchain.embeddings import OpenAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import sys
+# The embedding cache is shared by all the apps in LLMApps
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from embedding_cache import CachedEmbeddings
+from pdf_ingestion import FAILED, start_pdf_ingestion
 
 # Initialize the OpenAI client
 client = openai.OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
 
-
-def extract_text_from_pdf(pdf_file):
-    reader = PdfReader(pdf_file)
-    raw_text = ""
-    for i, page in enumerate(reader.pages):
-        text = page.extract_text()
-        if text:
-            raw_text += text
-    return raw_text
+INGESTION_POLL_INTERVAL = 0.5   # Seconds between two updates of the indexing progress
 
 
 def generate_embeddings():
-    embeddings_model = OpenAIEmbeddings(chunk_size=1000)
+    # Identical chunks are embedded once and reused across sessions
+    embeddings_model = CachedEmbeddings(OpenAIEmbeddings(chunk_size=1000))
     return embeddings_model
 
-def create_vector_database(raw_text):
-    # Chunk the text
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000, chunk_overlap=100
-    )
-    texts = text_splitter.split_text(raw_text)
-
-    vec_db = FAISS.from_texts(texts, generate_embeddings())
-    return vec_db
+def create_vector_database(pdf_file):
+    # The pages are extracted, chunked and embedded in the background, into an index that
+    # answers from the pages indexed so far. A PDF already in the document store is loaded instead.
+    return start_pdf_ingestion(pdf_file.getvalue(), generate_embeddings(), name=pdf_file.name)
 
 
 def retrieve_relevant_context(query, vec_db, k=4):
     if vec_db != None:
-        # This function runs Approximate Nearest Neighbors (ANN) search on the vector database
-        docs = vec_db.similarity_search(query, k=k)
-        return docs
+        # Hybrid search: the BM25 ranking of the chunks fused with the Approximate Nearest Neighbors (ANN)
+        # ranking, so exact identifiers are found too. Lexical only if the query embedding is slow.
+        docs = vec_db.search(query, k=k)
+        # Empty in the first seconds of the indexing
+        return docs if docs else None
     else:
         return None
     
@@ -69,10 +62,24 @@ def stream_chat_response(user_message,
 def clear_chat():
     st.session_state.chat_history = []
 
+# Function to show the indexing progress in the sidebar until the whole PDF is indexed.
+# A new message interrupts it, and is answered from the pages indexed so far.
+def display_ingestion_progress(placeholder, ingestion):
+    if ingestion is None:
+        return
+    while not ingestion.done:
+        placeholder.progress(ingestion.progress, text=f"Indexing PDF: {ingestion.describe()}")
+        time.sleep(INGESTION_POLL_INTERVAL)
+    if ingestion.status == FAILED:
+        placeholder.error(ingestion.describe())
+    else:
+        placeholder.text(f"PDF processed and vector database created.\n{ingestion.describe()}")
+
 def format_context(context):
     formatted_context = ""
     for i, doc in enumerate(context):
-        formatted_context += f"**Context {i+1}:** {doc.page_content}\n\n"
+        # Each chunk cites its source page
+        formatted_context += f"**Context {i+1} (page {doc.metadata.get('page', '?')}):** {doc.page_content}\n\n"
     return formatted_context
 
 def main():
@@ -88,14 +95,15 @@ def main():
     uploaded_file = st.sidebar.file_uploader("Upload a PDF", type="pdf")
     if 'vec_db' not in st.session_state:
         st.session_state.vec_db = None
+        st.session_state.ingestion = None
 
     if st.sidebar.button("Create Vector Database") and uploaded_file:
-        with st.spinner("Reading file..."):
-            text = extract_text_from_pdf(uploaded_file)
-            st.session_state.vec_db = create_vector_database(text)
-            st.sidebar.text("PDF processed and vector database created.")
-    if st.sidebar.button("Delete Vector Database") and st.session_state.vec_db:
+        st.session_state.ingestion = create_vector_database(uploaded_file)
+        st.session_state.vec_db = st.session_state.ingestion.index
+    progress_placeholder = st.sidebar.empty()
+    if st.sidebar.button("Delete Vector Database") and st.session_state.vec_db is not None:
         st.session_state.vec_db = None
+        st.session_state.ingestion = None
         st.sidebar.text("Vector database deleted.")
 
     if st.sidebar.button("Clear Chat"):
@@ -145,5 +153,7 @@ def main():
                     st.sidebar.text_area("Last query relevant context:", value=formatted_context, height=300)
                     st.session_state.last_context = None
 
+    display_ingestion_progress(progress_placeholder, st.session_state.ingestion)
+
 if __name__ == "__main__":
     main()
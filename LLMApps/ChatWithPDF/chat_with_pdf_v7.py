@@ -0,0 +1,178 @@
+import os
+import time
+import openai
+import streamlit as st
+from langchain.embeddings import OpenAIEmbeddings
+import sys
+# The embedding cache is shared by all the apps in LLMApps
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from embedding_cache import CachedEmbeddings
+from corpus_index import get_corpus_index
+from pdf_ingestion import FAILED
+from lexical_index import HYBRID, SEARCH_MODES
+
+# Initialize the OpenAI client
+client = openai.OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+
+INGESTION_POLL_INTERVAL = 0.5   # Seconds between two updates of the indexing progress
+
+
+def generate_embeddings():
+    # Identical chunks are embedded once and reused across sessions
+    embeddings_model = CachedEmbeddings(OpenAIEmbeddings(chunk_size=1000))
+    return embeddings_model
+
+def get_corpus():
+    # One corpus per process, shared by all the sessions: the PDFs and videos added by the
+    # others, or in previous runs, are in the document store and searchable here too
+    return get_corpus_index(generate_embeddings()).refresh()
+
+
+def retrieve_relevant_context(query, corpus, doc_ids=None, k=4, mode=HYBRID):
+    if len(corpus) > 0:
+        # Only the indexes of the selected documents are searched, by BM25 and ANN ('hybrid'),
+        # or only one of them. A hybrid search answers from BM25 alone if the query embedding is slow.
+        docs = corpus.search(query, k=k, doc_ids=doc_ids, mode=mode)
+        # Empty in the first seconds of the indexing
+        return docs if docs else None
+    else:
+        return None
+
+def stream_chat_response(message, chat_history, system_msg_content, model_name, temperature, max_history_length):
+    system_msg = [{"role": "system", "content": system_msg_content}]
+    chat_history.append({"role": "user", "content": message})
+    if len(chat_history) > max_history_length:
+        chat_history = chat_history[-max_history_length:]
+    messages = system_msg + chat_history
+
+    stream = client.chat.completions.create(
+        messages=messages,
+        model=model_name,
+        temperature=temperature,
+        stream=True
+    )
+
+    for chunk in stream:
+        if chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def clear_chat():
+    st.session_state.chat_history = []
+
+# Function to show the indexing progress in the sidebar until all the added documents are indexed.
+# A new message interrupts it, and is answered from the pages indexed so far.
+def display_ingestion_progress(placeholder, corpus):
+    ingestions = corpus.ingestions()
+    if not ingestions:
+        return
+    while not all(ingestion.done for ingestion in ingestions):
+        with placeholder.container():
+            for ingestion in ingestions:
+                st.progress(ingestion.progress, text=f"Indexing {ingestion.name}: {ingestion.describe()}")
+        time.sleep(INGESTION_POLL_INTERVAL)
+    with placeholder.container():
+        for ingestion in ingestions:
+            if ingestion.status == FAILED:
+                st.error(f"{ingestion.name}: {ingestion.describe()}")
+            else:
+                st.text(f"{ingestion.name} indexed.\n{ingestion.describe()}")
+
+# Function to cite the source of a chunk: the PDF page, or the time in the video
+def format_source(metadata):
+    if 'timestamp' in metadata:
+        minutes, seconds = divmod(int(metadata['timestamp']), 60)
+        return f"{metadata.get('name')} at {minutes}:{seconds:02d}"
+    return f"{metadata.get('name')}, page {metadata.get('page', '?')}"
+
+def format_context(context):
+    formatted_context = ""
+    for i, doc in enumerate(context):
+        formatted_context += f"**Context {i+1} ({format_source(doc.metadata)}):** {doc.page_content}\n\n"
+    return formatted_context
+
+def main():
+    st.title("💬 Chat with AI - Multi-document RAG")
+
+
+    # Sidebar controls
+    model_name = st.sidebar.selectbox("Choose the Model", ["text-davinci-003", "gpt-3.5-turbo", "gpt-4"], index=1)
+    temperature = st.sidebar.slider("Set Temperature", min_value=0.0, max_value=1.0, value=0.7, step=0.1)
+    max_history_length = int(st.sidebar.number_input("Max History Length", min_value=1, max_value=10, value=3))
+
+    system_msg = st.sidebar.text_area("System Message (Persona)", value="", height=100)
+    search_mode = st.sidebar.radio("Retrieval", SEARCH_MODES, index=SEARCH_MODES.index(HYBRID), horizontal=True)
+
+    corpus = get_corpus()
+    uploaded_files = st.sidebar.file_uploader("Upload PDFs", type="pdf", accept_multiple_files=True)
+    url = st.sidebar.text_input("Or enter a YouTube URL")
+
+    if st.sidebar.button("Add to Corpus"):
+        # Each document is indexed in its own namespace, the others are not rebuilt
+        for uploaded_file in uploaded_files or []:
+            corpus.add_pdf(uploaded_file.getvalue(), name=uploaded_file.name)
+        if url:
+            corpus.add_youtube(url)
+    progress_placeholder = st.sidebar.empty()
+
+    documents = corpus.documents()
+    names = {doc_id: name for doc_id, name, _ in documents}
+    selected = st.sidebar.multiselect("Search in", options=list(names), default=list(names),
+                                      format_func=lambda doc_id: names[doc_id])
+    if st.sidebar.button("Remove Selected Documents") and selected:
+        for doc_id in selected:
+            corpus.remove(doc_id, delete=True)
+        st.sidebar.text(f"{len(selected)} documents removed.")
+        selected = []
+
+    if st.sidebar.button("Clear Chat"):
+        clear_chat()
+
+
+
+    # Session state to store chat history
+    if 'chat_history' not in st.session_state:
+        st.session_state.chat_history = []
+
+    for msg in st.session_state.chat_history:
+        st.chat_message(msg["role"]).write(msg["content"])
+
+    user_input = st.chat_input("Enter your message:", key="user_input")
+
+    if user_input:
+        st.chat_message("user").write(user_input)
+        with st.spinner("Thinking..."):
+            accumulated_response = ""
+            placeholder = st.chat_message("AI").empty()
+
+
+            system_msg += "\nUse the following extra context, cite its sources :\n{context}"
+            context = retrieve_relevant_context(query=user_input, corpus=corpus, doc_ids=selected,
+                                                mode=search_mode)
+            if context != None:
+                system_msg = system_msg.format(context=format_context(context))
+                st.session_state.last_context = context
+            else:
+                system_msg = system_msg.format(context="No context found")
+                st.session_state.last_context = None
+
+            for response_chunk in stream_chat_response(user_input,
+                                                       st.session_state.chat_history,
+                                                       system_msg,
+                                                       model_name,
+                                                       temperature,
+                                                       max_history_length):
+                accumulated_response += response_chunk
+                placeholder.markdown(accumulated_response)
+            st.session_state.chat_history.append({"role": "assistant", "content": accumulated_response})
+
+            # Dispaly the last query relevant context in side bar
+            if 'last_context' in st.session_state:
+                if st.session_state.last_context != None:
+                    formatted_context = format_context(st.session_state.last_context)
+                    st.sidebar.text_area("Last query relevant context:", value=formatted_context, height=300)
+                    st.session_state.last_context = None
+
+    display_ingestion_progress(progress_placeholder, corpus)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from popularity import get_simple_recommendations
+from similarity import l2_normalize_rows, top_k_per_row
+from title_index import build_title_index
+from user_profiles import gather_user_profiles
+
+# Offline batch recommendations for a whole user base, e.g. a nightly job.
+# Same logic as the v3 apps (user profile = mean of the watched movies
+# embeddings, cosine similarity to the catalog, watched movies excluded,
+# popularity fallback), but for many users at once:
+# - the user histories are streamed from JSONL or Parquet, in chunks
+# - the profiles of a chunk are one sparse matmul (user_profiles.gather_user_profiles)
+# - the scores are blocked matmuls of users x catalog, spread over a process
+#   pool that memory-maps the normalized catalog embeddings
+# - the per-user top-k are streamed to a Parquet file, one row group per chunk
+#
+# Input rows: {"user_id": ..., "watched_movies": [titles, oldest first], "ratings": [optional weights]}
+# Usage:
+#   python batch_recommend.py --users users.jsonl --output recommendations.parquet --data-dir ./imdb.data \
+#       [--embeddings movie_embeddings.npy] [--k 10] [--workers 4]
+
+DEFAULT_K = 10
+DEFAULT_CHUNK_USERS = 20000    # Users read, profiled and written at once
+DEFAULT_BLOCK_USERS = 256      # Users scored per task: the score block is block x n_movies float32
+CATALOG_FILE = 'catalog_embeddings.npy'
+
+OUTPUT_SCHEMA = pa.schema([
+    ('user_id', pa.string()),
+    ('rank', pa.int16()),
+    ('title', pa.string()),
+    ('movie_id', pa.string()),
+    ('score', pa.float32()),
+    ('source', pa.string()),   # 'embeddings', or 'popularity' when no watched movie was found
+])
+
+# Catalog embeddings memory-mapped by each worker process
+_catalog = None
+
+def init_worker(catalog_path):
+    global _catalog
+    _catalog = np.load(catalog_path, mmap_mode='r')
+
+# Function to score a block of user profiles against the whole catalog. Runs in a worker process.
+# Returns the (indices, scores) of the top-k movies of each user, watched movies excluded.
+def score_block(args):
+    user_profiles, watched_rows, k = args
+    scores = user_profiles @ _catalog.T
+    for user, rows in enumerate(watched_rows):
+        scores[user, rows] = -np.inf
+    return top_k_per_row(scores, k)
+
+# Function to read the user histories in chunks of DataFrames, from a JSONL or a Parquet file
+def read_user_chunks(path, chunk_users=DEFAULT_CHUNK_USERS):
+    if path.endswith('.parquet'):
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_users):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_json(path, lines=True, chunksize=chunk_users, dtype={'user_id': str})
+
+# Function to get the catalog embeddings: from a .npy file aligned with the metadata rows, or
+# embedded like in v3.2 (overviews, embedding pipeline and cache), then saved to embeddings_path
+def load_catalog_embeddings(metadata, embeddings_path=None, model="text-embedding-ada-002"):
+    if embeddings_path and os.path.exists(embeddings_path):
+        embeddings = np.load(embeddings_path, mmap_mode='r')
+        if len(embeddings) != len(metadata):
+            raise ValueError(f"{embeddings_path} has {len(embeddings)} rows, the catalog has {len(metadata)} movies")
+        return embeddings
+
+    from openai import AsyncOpenAI
+    # The embedding cache is shared by all the apps in LLMApps
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from embedding_cache import get_embedding_cache
+    from embedding_pipeline import embed_texts, format_stats
+
+    overviews = [text.replace("\n", " ") for text in metadata['overview'].fillna('Invalid').tolist()]
+    embeddings, stats = embed_texts(overviews, AsyncOpenAI(), model=model, cache=get_embedding_cache(model))
+    print("Catalog embeddings:", format_stats(stats))
+    # The zero rows of failed batches are not saved, the next run embeds them again
+    if embeddings_path and not stats['n_failed']:
+        np.save(embeddings_path, embeddings)
+    return embeddings
+
+# Function to get the peak resident memory in MB of this process and of its finished workers, None if unknown
+def peak_memory_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in KB on Linux, in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return own / 2**20, children / 2**20
+
+# Function to recommend k movies to every user of users_path, written to output_path.
+# Returns the stats of the run: users, recommendations, elapsed seconds and users per second.
+def batch_recommend(users_path, output_path, metadata, embeddings, k=DEFAULT_K, n_workers=None,
+                    chunk_users=DEFAULT_CHUNK_USERS, block_users=DEFAULT_BLOCK_USERS, work_dir=None):
+    start_time = time.perf_counter()
+    n_workers = n_workers or os.cpu_count() or 1
+    titles = metadata['title'].fillna('').astype(str).to_numpy(dtype=object)
+    movie_ids = metadata['id'].astype(str).to_numpy(dtype=object)
+    title_index = build_title_index(metadata)
+    # Rows of the duplicated titles: like in v3, a watched title excludes all its movies
+    duplicated = pd.Series(np.arange(len(titles)))[pd.Series(titles).duplicated(keep=False).to_numpy()]
+    same_title = {row: group.to_numpy() for _, group in duplicated.groupby(titles[duplicated.to_numpy()])
+                  for row in group}
+
+    # The catalog is normalized once, the profiles per chunk: the dot products of the workers are cosine similarities
+    work_dir = work_dir or os.path.dirname(os.path.abspath(output_path))
+    catalog_path = os.path.join(work_dir, f"{CATALOG_FILE}.{os.getpid()}.npy")
+    catalog = l2_normalize_rows(np.asarray(embeddings, dtype=np.float32)).astype(np.float32)
+    np.save(catalog_path, catalog)
+
+    # Fallback of the users without any known movie, like the v3 apps
+    popular = get_simple_recommendations(metadata.assign(
+        vote_count=pd.to_numeric(metadata['vote_count'], errors='coerce'),
+        vote_average=pd.to_numeric(metadata['vote_average'], errors='coerce')), k=k)
+
+    stats = {'n_users': 0, 'n_fallback': 0, 'n_recommendations': 0,
+             'catalog_mb': catalog.nbytes / 2**20, 'block_mb': block_users * len(catalog) * 4 / 2**20}
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=(catalog_path,)) as executor, \
+                pq.ParquetWriter(tmp_path, OUTPUT_SCHEMA) as writer:
+            for users in read_user_chunks(users_path, chunk_users):
+                histories = users['watched_movies'].tolist()
+                # Profiles from the raw embeddings like v3, then normalized for the cosine
+                ratings = users['ratings'].tolist() if 'ratings' in users.columns else None
+                user_profiles, weights, status = gather_user_profiles(histories, title_index, embeddings, ratings)
+                user_profiles = l2_normalize_rows(user_profiles).astype(np.float32)
+
+                blocks = []
+                for start in range(0, len(users), block_users):
+                    end = min(start + block_users, len(users))
+                    watched_rows = []
+                    for user in range(start, end):
+                        rows = weights.indices[weights.indptr[user]:weights.indptr[user + 1]]
+                        if same_title:
+                            rows = np.concatenate([rows] + [same_title[row] for row in rows if row in same_title])
+                        watched_rows.append(rows)
+                    blocks.append((user_profiles[start:end], watched_rows, k))
+                results = list(executor.map(score_block, blocks))
+                indices = np.concatenate([result[0] for result in results])
+                scores = np.concatenate([result[1] for result in results])
+
+                # Fewer than k movies can be left after excluding the watched ones
+                valid = np.isfinite(scores) & status[:, None]
+                user_ids = np.repeat(users['user_id'].astype(str).to_numpy(dtype=object), k).reshape(-1, k)
+                ranks = np.tile(np.arange(1, k + 1, dtype=np.int16), (len(users), 1))
+                chunk = pd.DataFrame({
+                    'user_id': user_ids[valid],
+                    'rank': ranks[valid],
+                    'title': titles[indices[valid]],
+                    'movie_id': movie_ids[indices[valid]],
+                    'score': scores[valid].astype(np.float32),
+                    'source': 'embeddings',
+                })
+                n_fallback = int((~status).sum())
+                if n_fallback:
+                    fallback_ids = users['user_id'].astype(str).to_numpy(dtype=object)[~status]
+                    fallback = pd.DataFrame({
+                        'user_id': np.repeat(fallback_ids, len(popular)),
+                        'rank': np.tile(np.arange(1, len(popular) + 1, dtype=np.int16), n_fallback),
+                        'title': np.tile(popular['title'].to_numpy(dtype=object), n_fallback),
+                        'movie_id': np.tile(movie_ids[popular.index.to_numpy()], n_fallback),
+                        'score': np.tile(popular['score'].to_numpy(dtype=np.float32), n_fallback),
+                        'source': 'popularity',
+                    })
+                    chunk = pd.concat([chunk, fallback], ignore_index=True)
+                writer.write_table(pa.Table.from_pandas(chunk, schema=OUTPUT_SCHEMA, preserve_index=False))
+
+                stats['n_users'] += len(users)
+                stats['n_fallback'] += n_fallback
+                stats['n_recommendations'] += len(chunk)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        os.remove(catalog_path)
+
+    stats['elapsed'] = time.perf_counter() - start_time
+    stats['users_per_second'] = stats['n_users'] / stats['elapsed'] if stats['elapsed'] > 0 else float('inf')
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Recommend movies to many users offline, from their watch histories")
+    parser.add_argument('--users', required=True, help="JSONL or .parquet file with user_id, watched_movies[, ratings]")
+    parser.add_argument('--output', default='recommendations.parquet')
+    parser.add_argument('--data-dir', default=os.path.join('.', 'imdb.data'), help="Folder with movies_metadata.csv")
+    parser.add_argument('--embeddings', default=None,
+                        help=".npy catalog embeddings aligned with movies_metadata.csv, created if missing")
+    parser.add_argument('--model', default="text-embedding-ada-002")
+    parser.add_argument('--k', type=int, default=DEFAULT_K)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-users', type=int, default=DEFAULT_CHUNK_USERS)
+    parser.add_argument('--block-users', type=int, default=DEFAULT_BLOCK_USERS)
+    args = parser.parse_args()
+
+    metadata = pd.read_csv(os.path.join(args.data_dir, 'movies_metadata.csv'), low_memory=False)
+    embeddings = load_catalog_embeddings(metadata, args.embeddings, args.model)
+    stats = batch_recommend(args.users, args.output, metadata, embeddings, k=args.k, n_workers=args.workers,
+                            chunk_users=args.chunk_users, block_users=args.block_users)
+
+    print(f"{stats['n_users']} users ({stats['n_fallback']} popularity fallbacks), "
+          f"{stats['n_recommendations']} recommendations written to {args.output}")
+    print(f"{stats['elapsed']:.1f} s: {stats['users_per_second']:.0f} users/s")
+    memory = peak_memory_mb()
+    print(f"Catalog {stats['catalog_mb']:.0f} MB, score block {stats['block_mb']:.0f} MB per worker"
+          + ("" if memory is None else f", peak RSS {memory[0]:.0f} MB main, {memory[1]:.0f} MB largest worker"))
+
+if __name__ == "__main__":
+    main()
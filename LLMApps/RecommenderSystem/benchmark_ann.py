@@ -0,0 +1,95 @@
+import argparse
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+# The ANN index factory is shared by all the apps in LLMApps
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ann_index import INDEX_TYPES, DEFAULT_EF_SEARCH, DEFAULT_NPROBE, build_index, index_memory_bytes
+
+# Benchmark of the FAISS index types for the movie search of v4 and v5.4.
+# Reports, for each index type, the build time, the index memory, recall@k
+# against the exact (flat) index and the p50/p99 latency of single queries.
+# Queries mimic the v4 user profiles: the mean of a few random movie vectors.
+#
+# Usage:
+#   python benchmark_ann.py
+#   python benchmark_ann.py --index ~/.cache/practical_llms/faiss/movie_overviews/<version>/index.faiss
+
+# Function to generate synthetic unit-norm embeddings, clustered like the movie genres
+def make_synthetic_vectors(n_vectors, dim, n_clusters=100, seed=42):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, n_clusters, n_vectors)]
+    vectors += 0.5 * rng.standard_normal((n_vectors, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+# Function to load the catalog vectors from a .npy matrix or a saved FAISS index
+def load_vectors(args):
+    if args.vectors:
+        return np.load(args.vectors).astype(np.float32)
+    if args.index:
+        index = faiss.read_index(args.index)
+        return index.reconstruct_n(0, index.ntotal)
+    return make_synthetic_vectors(args.n_vectors, args.dim)
+
+# Function to make user-profile-like queries: the mean of 1 to 5 random catalog vectors
+def make_queries(vectors, n_queries, seed=0):
+    rng = np.random.default_rng(seed)
+    queries = np.empty((n_queries, vectors.shape[1]), dtype=np.float32)
+    for i in range(n_queries):
+        queries[i] = vectors[rng.integers(0, len(vectors), rng.integers(1, 6))].mean(axis=0)
+    return queries
+
+# Function to compute recall@k: the share of the exact top-k found by the approximate search
+def recall_at_k(exact_ids, approx_ids):
+    hits = [len(np.intersect1d(exact, approx)) for exact, approx in zip(exact_ids, approx_ids)]
+    return np.sum(hits) / exact_ids.size
+
+def run_benchmark(vectors, queries, index_types, k, nprobe, ef_search):
+    exact_index = build_index(vectors, 'flat')
+    _, exact_ids = exact_index.search(queries, k)
+
+    print(f"{len(vectors)} vectors of dim {vectors.shape[1]}, {len(queries)} queries, k={k}")
+    print(f"{'index':>10} {'build s':>9} {'memory MB':>10} {'B/vector':>9} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for index_type in index_types:
+        start_time = time.perf_counter()
+        index = build_index(vectors, index_type, nprobe=nprobe, ef_search=ef_search)
+        build_time = time.perf_counter() - start_time
+
+        # One query at a time, like the apps
+        latencies = np.empty(len(queries))
+        approx_ids = np.empty((len(queries), k), dtype=np.int64)
+        for i in range(len(queries)):
+            start_time = time.perf_counter()
+            _, ids = index.search(queries[i:i + 1], k)
+            latencies[i] = time.perf_counter() - start_time
+            approx_ids[i] = ids[0]
+
+        memory = index_memory_bytes(index)
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        print(f"{index_type:>10} {build_time:9.2f} {memory / 2**20:10.1f} {memory / len(vectors):9.0f} "
+              f"{recall_at_k(exact_ids, approx_ids):9.3f} {p50:8.3f} {p99:8.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the FAISS index types for the movie search")
+    parser.add_argument('--vectors', help="Path to a .npy matrix of the catalog embeddings")
+    parser.add_argument('--index', help="Path to a saved index.faiss, e.g. from the movie vector stores")
+    parser.add_argument('--n-vectors', type=int, default=45000, help="Synthetic catalog size")
+    parser.add_argument('--dim', type=int, default=1536, help="Synthetic embeddings size")
+    parser.add_argument('--index-types', nargs='+', default=list(INDEX_TYPES))
+    parser.add_argument('--n-queries', type=int, default=1000)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nprobe', type=int, default=DEFAULT_NPROBE)
+    parser.add_argument('--ef-search', type=int, default=DEFAULT_EF_SEARCH)
+    args = parser.parse_args()
+
+    vectors = load_vectors(args)
+    queries = make_queries(vectors, args.n_queries)
+    run_benchmark(vectors, queries, args.index_types, args.k, args.nprobe, args.ef_search)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import tiktoken
+
+from candidates import PROMPT_ENCODING, build_candidate_retriever
+from popularity_index import get_popular_titles, load_popularity_index
+from recommendation_prompt import build_recommendation_messages
+
+# Benchmark of the candidate lists given to the LLM recommenders:
+# - all: every title of the catalog (v5.1)
+# - random: 1000 random titles (v5.2)
+# - popular: the 1000 most popular titles (v5.3, v6)
+# - retrieval: the candidate pre-filtering stage (candidates.py)
+# For each mode it reports the prompt tokens of the LLM request, the time to
+# select the candidates, and the hit rate: how often the next movie a user
+# rated (4+ stars, MovieLens ratings) is in the candidate list, so the LLM
+# could recommend it at all.
+#
+# Usage:
+#   python benchmark_candidates.py --data-dir ./imdb.data
+
+# Function to get leave-one-out test users from the MovieLens ratings: (history titles, next movie title)
+def load_test_users(data_dir, metadata, n_users, history_length, seed=42):
+    ratings = pd.read_csv(os.path.join(data_dir, 'ratings_small.csv'))
+    links = pd.read_csv(os.path.join(data_dir, 'links_small.csv'))
+    tmdb_titles = dict(zip(pd.to_numeric(metadata['id'], errors='coerce'), metadata['title']))
+    movie_titles = {movie_id: tmdb_titles.get(tmdb_id) for movie_id, tmdb_id in zip(links['movieId'], links['tmdbId'])}
+    ratings['title'] = ratings['movieId'].map(movie_titles)
+    ratings = ratings.dropna(subset=['title']).sort_values(['userId', 'timestamp'])
+
+    test_users = []
+    for _, user_ratings in ratings.groupby('userId'):
+        liked = np.flatnonzero(user_ratings['rating'].to_numpy() >= 4)
+        if len(liked) == 0 or liked[-1] == 0:
+            continue
+        titles = user_ratings['title'].tolist()
+        held_out = liked[-1]
+        test_users.append((titles[max(0, held_out - history_length):held_out], titles[held_out]))
+    rng = np.random.default_rng(seed)
+    rng.shuffle(test_users)
+    return test_users[:n_users]
+
+def run_benchmark(modes, test_users, encoding):
+    print(f"{len(test_users)} test users")
+    print(f"{'mode':>10} {'candidates':>11} {'prompt tokens':>14} {'select p50 ms':>14} {'select p99 ms':>14} {'hit rate':>9}")
+    for name, select in modes.items():
+        n_candidates, n_tokens, latencies, hits = [], [], [], 0
+        for history, next_movie in test_users:
+            start_time = time.perf_counter()
+            candidates = select(history)
+            latencies.append(time.perf_counter() - start_time)
+            messages, _ = build_recommendation_messages(history, candidates)
+            n_tokens.append(sum(len(encoding.encode(message['content'], disallowed_special=())) for message in messages))
+            n_candidates.append(len(candidates))
+            hits += next_movie in set(candidates)
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        print(f"{name:>10} {np.mean(n_candidates):11.0f} {np.mean(n_tokens):14.0f} {p50:14.3f} {p99:14.3f} "
+              f"{hits / len(test_users):9.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the candidate lists of the LLM recommenders")
+    parser.add_argument('--data-dir', default=os.path.join('.', 'imdb.data'),
+                        help="Folder with movies_metadata.csv, ratings_small.csv and links_small.csv")
+    parser.add_argument('--n-users', type=int, default=200)
+    parser.add_argument('--history-length', type=int, default=10)
+    parser.add_argument('--token-budget', type=int, default=None, help="Candidate token budget of the retrieval mode")
+    args = parser.parse_args()
+
+    metadata = pd.read_csv(os.path.join(args.data_dir, 'movies_metadata.csv'), low_memory=False)
+    encoding = tiktoken.get_encoding(PROMPT_ENCODING)
+    retriever = build_candidate_retriever(metadata, encoding=encoding)
+    popularity_index, _ = load_popularity_index(os.path.join(args.data_dir, 'movies_metadata.csv'))
+    test_users = load_test_users(args.data_dir, metadata, args.n_users, args.history_length)
+
+    all_titles = metadata['title'].dropna().tolist()
+    rng = np.random.default_rng(0)
+    retrieval_kwargs = {} if args.token_budget is None else {'token_budget': args.token_budget}
+    modes = {
+        'all': lambda history: all_titles,
+        'random': lambda history: rng.choice(all_titles, 1000, replace=False).tolist(),
+        'popular': lambda history: get_popular_titles(popularity_index, k=1000),
+        'retrieval': lambda history: retriever.get_candidates(history, **retrieval_kwargs),
+    }
+    run_benchmark(modes, test_users, encoding)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.model_selection import train_test_split
+
+from matrix_factorization import DEFAULT_N_FACTORS, MatrixFactorization
+from rating_matrix import read_ratings
+
+# Benchmark of the NumPy/SciPy ALS matrix factorization against the Keras
+# Embedding + Dot + bias model of outline.py, on the same 90/10 split of the
+# MovieLens ratings: training time, test RMSE, and the latency of a top-k
+# query (all the movies scored for one user). The Keras model is skipped if
+# TensorFlow is not installed.
+#
+# Usage:
+#   python benchmark_mf.py --ratings ./imdb.data/ratings_small.csv [--threads 1 4] [--keras-epochs 5]
+
+# Function to get the latency percentiles in ms of a query function over some users
+def query_latency(query, users):
+    latencies = []
+    for user in users:
+        start_time = time.perf_counter()
+        query(user)
+        latencies.append(time.perf_counter() - start_time)
+    return np.percentile(latencies, [50, 99]) * 1000
+
+# Function to train and evaluate the Keras model of outline.py (Chapter 4, with biases)
+def run_keras(X_train, y_train, X_test, y_test, n_users, n_movies, epochs, query_users):
+    from tensorflow.keras import layers, metrics, models, optimizers, regularizers
+
+    min_rating, max_rating = float(min(y_train.min(), y_test.min())), float(max(y_train.max(), y_test.max()))
+    emb_sz = DEFAULT_N_FACTORS
+    user = layers.Input(shape=(1,))
+    user_emb = layers.Reshape((emb_sz,))(layers.Embedding(n_users, emb_sz, embeddings_regularizer=regularizers.l2(1e-6))(user))
+    user_bias = layers.Reshape((1,))(layers.Embedding(n_users, 1, embeddings_regularizer=regularizers.l2(1e-6))(user))
+    movie = layers.Input(shape=(1,))
+    movie_emb = layers.Reshape((emb_sz,))(layers.Embedding(n_movies, emb_sz, embeddings_regularizer=regularizers.l2(1e-6))(movie))
+    movie_bias = layers.Reshape((1,))(layers.Embedding(n_movies, 1, embeddings_regularizer=regularizers.l2(1e-6))(movie))
+    rating = layers.Add()([layers.Dot(axes=1)([user_emb, movie_emb]), user_bias, movie_bias])
+    rating = layers.Activation('sigmoid')(rating)
+    rating = layers.Lambda(lambda x: x * (max_rating - min_rating) + min_rating)(rating)
+    model = models.Model([user, movie], rating)
+    model.compile(loss='mse', metrics=metrics.RootMeanSquaredError(), optimizer=optimizers.Adam(learning_rate=0.001))
+
+    start_time = time.perf_counter()
+    model.fit(x=[X_train[:, 0], X_train[:, 1]], y=y_train, batch_size=64, epochs=epochs, verbose=0)
+    train_time = time.perf_counter() - start_time
+    predicted = model.predict([X_test[:, 0], X_test[:, 1]], batch_size=4096, verbose=0).ravel()
+    rmse = float(np.sqrt(np.mean((predicted - y_test) ** 2)))
+
+    all_movies = np.arange(n_movies)
+    latency = query_latency(lambda u: model.predict([np.full(n_movies, u), all_movies], batch_size=n_movies, verbose=0),
+                            query_users)
+    return train_time, rmse, latency
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ALS matrix factorization against the Keras model")
+    parser.add_argument('--ratings', default=os.path.join('imdb.data', 'ratings_small.csv'))
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, os.cpu_count() or 1])
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--keras-epochs', type=int, default=5)
+    parser.add_argument('--n-queries', type=int, default=200)
+    args = parser.parse_args()
+
+    # Same codes and split as outline.py: all the ratings are encoded, then 10% are held out
+    ratings = read_ratings(args.ratings)
+    users, user_ids = pd.factorize(ratings['userId'])
+    movies, movie_ids = pd.factorize(ratings['movieId'])
+    X = np.column_stack([users, movies])
+    y = ratings['rating'].to_numpy(dtype=np.float32)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.1, random_state=42)
+    train_matrix = sp.csr_matrix((y_train, (X_train[:, 0], X_train[:, 1])), shape=(len(user_ids), len(movie_ids)))
+    query_users = np.random.default_rng(0).choice(len(user_ids), min(args.n_queries, len(user_ids)), replace=False)
+    print(f"{len(user_ids)} users, {len(movie_ids)} movies, {len(y_train)} train / {len(y_test)} test ratings")
+
+    print(f"{'model':>22} {'train s':>9} {'test RMSE':>10} {'query p50 ms':>13} {'query p99 ms':>13}")
+    for n_threads in sorted(set(args.threads)):
+        model = MatrixFactorization(n_iterations=args.iterations, n_threads=n_threads)
+        start_time = time.perf_counter()
+        model.fit(train_matrix, user_ids, movie_ids)
+        train_time = time.perf_counter() - start_time
+        rmse = model.rmse(X_test[:, 0], X_test[:, 1], y_test)
+        p50, p99 = query_latency(lambda u: model.recommend(u, k=10), query_users)
+        print(f"{f'ALS, {n_threads} threads':>22} {train_time:9.2f} {rmse:10.4f} {p50:13.3f} {p99:13.3f}")
+
+    try:
+        import tensorflow  # noqa: F401
+    except ImportError:
+        print(f"{'Keras':>22} skipped, TensorFlow is not installed")
+        return
+    train_time, rmse, (p50, p99) = run_keras(X_train, y_train, X_test, y_test, len(user_ids), len(movie_ids),
+                                             args.keras_epochs, query_users[:20])
+    print(f"{f'Keras, {args.keras_epochs} epochs':>22} {train_time:9.2f} {rmse:10.4f} {p50:13.3f} {p99:13.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import os
+import time
+
+import numpy as np
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from movie_data import load_movie_features
+from recommendation_pipeline import DEFAULT_BUDGETS, OK, build_pipeline
+
+# Benchmark of the hybrid recommendation pipeline (recommendation_pipeline.py).
+# For random watch histories it reports, per stage, the candidates in and out,
+# the p50/p99 latency and how often the stage missed its budget, and the
+# end-to-end latency. The LLM stage needs an API key and is not benchmarked:
+# the stages before it bound the candidate set it gets.
+# Without --embeddings, a 128-d SVD of the overviews TF-IDF stands in for the
+# movie embeddings of v3.
+#
+# Usage:
+#   python benchmark_pipeline.py --data-dir ./imdb.data [--embeddings movie_embeddings.npy]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the hybrid recommendation pipeline")
+    parser.add_argument('--data-dir', default=os.path.join('.', 'imdb.data'),
+                        help="Folder with movies_metadata.csv, credits.csv and keywords.csv")
+    parser.add_argument('--embeddings', default=None,
+                        help=".npy matrix of movie embeddings, aligned with the movie_data.py snapshot rows")
+    parser.add_argument('--n-users', type=int, default=200)
+    parser.add_argument('--history-length', type=int, default=5)
+    parser.add_argument('--content-budget', type=float, default=DEFAULT_BUDGETS['content'])
+    parser.add_argument('--embedding-budget', type=float, default=DEFAULT_BUDGETS['embedding'])
+    args = parser.parse_args()
+
+    metadata = load_movie_features(args.data_dir)
+    if args.embeddings:
+        embeddings = np.load(args.embeddings, mmap_mode='r')
+    else:
+        overviews = TfidfVectorizer(stop_words='english').fit_transform(metadata['overview'])
+        n_components = max(1, min(128, overviews.shape[1] - 1))
+        embeddings = TruncatedSVD(n_components=n_components, random_state=0).fit_transform(overviews).astype(np.float32)
+
+    start_time = time.perf_counter()
+    pipeline = build_pipeline(metadata, embeddings=embeddings,
+                              budgets={'content': args.content_budget, 'embedding': args.embedding_budget})
+    print(f"{len(metadata)} movies, pipeline built in {time.perf_counter() - start_time:.2f} s")
+
+    rng = np.random.default_rng(42)
+    titles = metadata['title'][metadata['title'] != ''].tolist()
+    histories = [rng.choice(titles, args.history_length, replace=False).tolist() for _ in range(args.n_users)]
+
+    reports, totals = {stage.name: [] for stage in pipeline.stages}, []
+    for history in histories:
+        start_time = time.perf_counter()
+        result = pipeline.recommend(history)
+        totals.append(time.perf_counter() - start_time)
+        for report in result.reports:
+            reports[report['stage']].append(report)
+
+    print(f"{len(histories)} watch histories of {args.history_length} movies")
+    print(f"{'stage':>12} {'budget s':>9} {'in':>7} {'out':>6} {'p50 ms':>9} {'p99 ms':>9} {'missed':>7}")
+    for name, stage_reports in reports.items():
+        completed = [report for report in stage_reports if report['status'] == OK]
+        budget = stage_reports[0]['budget']
+        n_in = np.mean([report['n_in'] for report in completed]) if completed else 0
+        n_out = np.mean([report['n_out'] for report in completed]) if completed else 0
+        p50, p99 = np.percentile([report['elapsed'] for report in stage_reports], [50, 99]) * 1000
+        print(f"{name:>12} {'-' if budget is None else f'{budget:.2f}':>9} {n_in:7.0f} {n_out:6.0f} "
+              f"{p50:9.3f} {p99:9.3f} {len(stage_reports) - len(completed):7d}")
+    p50, p99 = np.percentile(totals, [50, 99]) * 1000
+    print(f"{'total':>12} {'':>9} {'':>7} {'':>6} {p50:9.3f} {p99:9.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import html
+import re
+import string
+import time
+import unicodedata
+
+from nltk.corpus import stopwords
+from nltk.stem import WordNetLemmatizer
+from nltk.tokenize import word_tokenize
+
+from imdb_corpus import load_packed_corpus
+from text_normalizer import TextNormalizer, normalize_corpus
+
+# Benchmark of the text normalization of the aclImdb reviews (50k, train and test):
+# - outline: normalize_text of outline.py, one document at a time (on a sample, it is slow)
+# - normalizer: text_normalizer.TextNormalizer, one process
+# - pool: text_normalizer.normalize_corpus, over a process pool
+# It reports the documents per second, and how many of the sample documents
+# get the same words as with outline.py.
+#
+# Usage:
+#   python benchmark_text_normalizer.py --data-dir ./aclImdb [--sample 2000] [--workers 4]
+
+# Function to read the reviews of the aclImdb train and test folders, from their packed cache
+def read_reviews(data_dir):
+    return [text for split in ['train', 'test'] for text in load_packed_corpus(data_dir, split).texts()]
+
+# normalize_text of outline.py, as it is there
+def outline_normalize_text(text):
+    re1 = re.compile(r'  +')
+    x1 = text.lower().replace('#39;', "'").replace('amp;', '&').replace('#146;', "'").replace(
+        'nbsp;', ' ').replace('#36;', '$').replace('\\n', "\n").replace('quot;', "'").replace(
+        '<br />', "\n").replace('\\"', '"').replace('<unk>', 'u_n').replace(' @.@ ', '.').replace(
+        ' @-@ ', '-').replace('\\', ' \\ ')
+    text = re1.sub(' ', html.unescape(x1))
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('utf-8', 'ignore')
+    text = text.translate(str.maketrans('', '', string.punctuation))
+    text = text.lower()
+    text = re.sub(r'\d+', '', text)
+    words = word_tokenize(text)
+    stop_words = stopwords.words('english')
+    words = [word for word in words if word not in stop_words]
+    lemmatizer = WordNetLemmatizer()
+    words = [lemmatizer.lemmatize(word) for word in words]
+    lemmatizer = WordNetLemmatizer()
+    return ' '.join([lemmatizer.lemmatize(word, pos='v') for word in words])
+
+def timed(function, *args):
+    start_time = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start_time
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the text normalization of the aclImdb reviews")
+    parser.add_argument('--data-dir', default='aclImdb')
+    parser.add_argument('--sample', type=int, default=2000, help="Documents normalized with the outline.py version")
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    texts = read_reviews(args.data_dir)
+    sample = texts[:args.sample]
+    print(f"{len(texts)} reviews, outline.py version on the first {len(sample)}")
+
+    expected, outline_time = timed(lambda: [outline_normalize_text(text) for text in sample])
+    normalized, normalizer_time = timed(TextNormalizer().normalize_many, texts)
+    pooled, pool_time = timed(normalize_corpus, texts, args.workers)
+    assert pooled == normalized
+
+    print(f"{'version':>12} {'docs':>7} {'seconds':>9} {'docs/s':>9}")
+    for name, n_docs, elapsed in [('outline', len(sample), outline_time), ('normalizer', len(texts), normalizer_time),
+                                  ('pool', len(texts), pool_time)]:
+        print(f"{name:>12} {n_docs:7d} {elapsed:9.2f} {n_docs / elapsed:9.0f}")
+    same = sum(a.split() == b.split() for a, b in zip(expected, normalized))
+    print(f"Same words as outline.py: {same}/{len(sample)} documents")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import hashlib
+import json
+import os
+import threading
+
+# Small helpers shared by the on-disk caches/indexes of the recommender apps.
+
+# Function to hash a file in chunks, so big CSVs are never fully loaded in memory
+def file_sha256(path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+# Function to get a cheap signature (size, mtime) of a file, used to skip re-hashing unchanged files
+def file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+# Function to read a JSON metadata file, returns None if missing or corrupted
+def read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# Function to write a JSON file atomically (write to temp file, then rename).
+# The temp file is unique per thread, Streamlit sessions run in threads of the same process.
+def write_json_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import tiktoken
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from popularity import rating_priors, weighted_rating
+from similarity import l2_normalize_rows, top_k_similar
+from title_index import build_title_index, lookup_titles
+
+# Candidate pre-filtering stage in front of the LLM recommender prompt.
+# Instead of the whole catalog (v5.1), a random limit (v5.2) or the 1000 most
+# popular titles (v5.3, v6), the prompt gets the movies most similar to the
+# user's history, retrieved locally from the catalog features (no API call),
+# merged with the most popular movies. They are ranked by a blend of
+# similarity and popularity, and cut to a prompt token budget.
+#
+# Benchmark: python benchmark_candidates.py --data-dir ./imdb.data
+
+DEFAULT_N_SIMILAR = 200           # Movies retrieved by similarity to the watch history
+DEFAULT_N_POPULAR = 50            # Most popular movies merged with them
+DEFAULT_TOKEN_BUDGET = 1500       # Prompt tokens for the candidate titles
+DEFAULT_POPULARITY_WEIGHT = 0.3   # Blend: (1 - w) * similarity + w * popularity
+TOKENS_PER_TITLE_LINE = 3         # "id|" prefix and line break of each title in the prompt
+PROMPT_ENCODING = 'cl100k_base'   # gpt-3.5-turbo and gpt-4 tokenizer
+
+
+class CandidateRetriever:
+    # - titles: movie titles, one per row of item_matrix
+    # - item_matrix: (n_movies x n_features) sparse or dense catalog features, e.g. TF-IDF or embeddings
+    # - popularity: popularity prior of each movie in [0, 1]
+    # - token_counts: prompt tokens of each title
+    def __init__(self, titles, item_matrix, title_index, popularity, token_counts):
+        self.titles = np.asarray(titles, dtype=object)
+        self.item_matrix = l2_normalize_rows(item_matrix)
+        self.title_index = title_index
+        self.popularity = np.asarray(popularity, dtype=np.float64)
+        self.token_counts = np.asarray(token_counts, dtype=np.int64)
+        self.popular_rows = np.argsort(-self.popularity, kind='stable')
+
+    def __len__(self):
+        return len(self.titles)
+
+    # Function to get the candidate titles for a watch history, best first, within the token budget
+    def get_candidates(self, watched_movies, n_similar=DEFAULT_N_SIMILAR, n_popular=DEFAULT_N_POPULAR,
+                       token_budget=DEFAULT_TOKEN_BUDGET, popularity_weight=DEFAULT_POPULARITY_WEIGHT):
+        watched_rows = lookup_titles(self.title_index, watched_movies)
+        # Exclude the watched movies, and their duplicated titles
+        exclude = np.isin(self.titles, self.titles[watched_rows])
+
+        popular = self.popular_rows[~exclude[self.popular_rows]][:n_popular]
+        if len(watched_rows) == 0:
+            # Unknown history: popularity only
+            pool, similarity = self.popular_rows[~exclude[self.popular_rows]], None
+        else:
+            # Sparse means are (1 x n) matrices, dense ones 1-D arrays
+            profile = l2_normalize_rows(np.atleast_2d(np.asarray(self.item_matrix[watched_rows].mean(axis=0))))
+            similar, scores = top_k_similar(profile, self.item_matrix, k=n_similar, exclude=exclude)
+            pool = np.union1d(similar[0][np.isfinite(scores[0])], popular)
+            similarity = np.asarray(self.item_matrix[pool] @ profile.T).ravel()
+            if similarity.max() > 0:
+                similarity = similarity / similarity.max()
+
+        if similarity is None:
+            ranked = pool
+        else:
+            blended = (1 - popularity_weight) * similarity + popularity_weight * self.popularity[pool]
+            ranked = pool[np.argsort(-blended, kind='stable')]
+
+        # Keep the first row of each title, then the best candidates that fit in the budget
+        _, first = np.unique(self.titles[ranked], return_index=True)
+        ranked = ranked[np.sort(first)]
+        ranked = ranked[np.cumsum(self.token_counts[ranked]) <= token_budget]
+        return self.titles[ranked].tolist()
+
+
+# Function to get the popularity prior of all movies: the percentile of their IMDB weighted rating
+def popularity_prior(metadata):
+    vote_count = pd.to_numeric(metadata['vote_count'], errors='coerce').fillna(0)
+    vote_average = pd.to_numeric(metadata['vote_average'], errors='coerce').fillna(0)
+    C, M = rating_priors(pd.DataFrame({'vote_count': vote_count, 'vote_average': vote_average}))
+    return pd.Series(weighted_rating(vote_count, vote_average, M, C)).rank(pct=True).to_numpy()
+
+# Function to count the prompt tokens of each title
+def title_token_counts(titles, encoding=None):
+    encoding = encoding or tiktoken.get_encoding(PROMPT_ENCODING)
+    return np.array([len(tokens) + TOKENS_PER_TITLE_LINE for tokens in encoding.encode_batch(list(titles))])
+
+# Function to build the candidate retriever of a catalog, with TF-IDF features of the overviews.
+# Pass item_matrix to use other features, e.g. the v3 movie embeddings, aligned with the metadata rows.
+def build_candidate_retriever(metadata, item_matrix=None, encoding=None):
+    has_title = metadata['title'].notna().to_numpy()
+    metadata = metadata[has_title].reset_index(drop=True)
+    if item_matrix is None:
+        item_matrix = TfidfVectorizer(stop_words='english').fit_transform(metadata['overview'].fillna(''))
+    else:
+        item_matrix = item_matrix[np.flatnonzero(has_title)]
+    titles = metadata['title'].astype(str).tolist()
+    return CandidateRetriever(titles, item_matrix, build_title_index(metadata),
+                              popularity_prior(metadata), title_token_counts(titles, encoding))
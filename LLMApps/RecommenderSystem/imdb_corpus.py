@@ -0,0 +1,140 @@
+import argparse
+import os
+
+import numpy as np
+import scipy.sparse as sp
+
+from cache_utils import read_json, write_json_atomic
+
+# Streaming reader of the aclImdb reviews (one small file per review).
+# get_texts in outline.py opened all the files of a split, never closed them,
+# and kept all the texts in lists. Here:
+# - iter_reviews yields (texts, labels) batches, closing each file, so a
+#   HashingVectorizer or the Keras Tokenizer can be fed chunk by chunk
+# - the first read of a split also writes a packed cache: all the reviews as
+#   concatenated UTF-8 bytes in one file, their offsets and labels as .npy.
+#   PackedCorpus memory-maps it, so later epochs skip the 25k file opens per split.
+#
+# Offline build:
+#   python imdb_corpus.py --data-dir ./aclImdb
+
+CACHE_VERSION = 1
+CLASSES = ['neg', 'pos']    # Label of each class folder is its position, 'unsup' is left out
+DEFAULT_BATCH_SIZE = 1000
+
+# Function to list the review files of a split, in a stable order. Returns [(path, label)].
+def review_files(data_dir, split, classes=CLASSES):
+    files = []
+    for label, name in enumerate(classes):
+        folder = os.path.join(data_dir, split, name)
+        files.extend((os.path.join(folder, fname), label) for fname in sorted(os.listdir(folder)))
+    return files
+
+# Function to read the reviews of a split from their files, in (texts, labels) batches
+def iter_reviews(data_dir, split='train', batch_size=DEFAULT_BATCH_SIZE, classes=CLASSES):
+    files = review_files(data_dir, split, classes)
+    for start in range(0, len(files), batch_size):
+        texts, labels = [], []
+        for path, label in files[start:start + batch_size]:
+            with open(path, 'r', encoding='utf-8') as f:
+                texts.append(f.read())
+            labels.append(label)
+        yield texts, labels
+
+# Function to get the cheap signature of a split: the class folders change when files are added or removed
+def split_signature(data_dir, split, classes=CLASSES):
+    return [os.stat(os.path.join(data_dir, split, name)).st_mtime_ns for name in classes]
+
+
+class PackedCorpus:
+    # - data: memory-mapped uint8 array of the concatenated UTF-8 reviews
+    # - offsets: int64 array, review i is data[offsets[i]:offsets[i + 1]]
+    # - labels: int8 array of the review labels
+    def __init__(self, data, offsets, labels):
+        self.data = data
+        self.offsets = offsets
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    # Function to get all the texts as a list, like get_texts in outline.py
+    def texts(self):
+        return [self[i] for i in range(len(self))]
+
+    # Function to iterate over the reviews in (texts, labels) batches, in order or shuffled (one epoch)
+    def iter_batches(self, batch_size=DEFAULT_BATCH_SIZE, shuffle=False, seed=None):
+        order = np.random.default_rng(seed).permutation(len(self)) if shuffle else np.arange(len(self))
+        for start in range(0, len(self), batch_size):
+            batch = order[start:start + batch_size]
+            yield [self[i] for i in batch], self.labels[batch]
+
+
+def cache_paths(cache_dir, split):
+    return {name: os.path.join(cache_dir, f"{split}{suffix}")
+            for name, suffix in [('data', '.bin'), ('offsets', '_offsets.npy'), ('labels', '_labels.npy'),
+                                 ('meta', '_meta.json')]}
+
+# Function to read the reviews of a split from their files once, and write the packed cache
+def build_packed_corpus(data_dir, split, cache_dir, classes=CLASSES):
+    os.makedirs(cache_dir, exist_ok=True)
+    paths = cache_paths(cache_dir, split)
+    signature = split_signature(data_dir, split, classes)
+    offsets, labels = [0], []
+    tmp_path = f"{paths['data']}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as out:
+        for texts, batch_labels in iter_reviews(data_dir, split, classes=classes):
+            for text in texts:
+                encoded = text.encode('utf-8')
+                out.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+            labels.extend(batch_labels)
+    os.replace(tmp_path, paths['data'])
+    np.save(paths['offsets'], np.array(offsets, dtype=np.int64))
+    np.save(paths['labels'], np.array(labels, dtype=np.int8))
+    meta = {'version': CACHE_VERSION, 'classes': list(classes), 'signature': signature, 'n_reviews': len(labels)}
+    write_json_atomic(paths['meta'], meta)
+    return meta
+
+# Function to memory-map the packed reviews of a split, building the cache only if the split folders changed
+def load_packed_corpus(data_dir, split='train', cache_dir=None, classes=CLASSES):
+    cache_dir = cache_dir or os.path.join(data_dir, 'packed')
+    paths = cache_paths(cache_dir, split)
+    meta = read_json(paths['meta'])
+    if (meta is None or meta.get('version') != CACHE_VERSION or meta.get('classes') != list(classes)
+            or meta.get('signature') != split_signature(data_dir, split, classes)):
+        meta = build_packed_corpus(data_dir, split, cache_dir, classes)
+    offsets = np.load(paths['offsets'])
+    if offsets[-1] == 0:
+        # np.memmap cannot map an empty file
+        data = np.zeros(0, dtype=np.uint8)
+    else:
+        data = np.memmap(paths['data'], dtype=np.uint8, mode='r')
+    return PackedCorpus(data, offsets, np.load(paths['labels']))
+
+# Function to vectorize (texts, labels) batches with a stateless vectorizer, e.g. sklearn's HashingVectorizer.
+# Returns (features, labels), the sparse features of all batches stacked.
+def vectorize_batches(batches, vectorizer):
+    features, labels = [], []
+    for texts, batch_labels in batches:
+        features.append(vectorizer.transform(texts))
+        labels.append(np.asarray(batch_labels))
+    return sp.vstack(features).tocsr(), np.concatenate(labels)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the packed cache of the aclImdb reviews")
+    parser.add_argument('--data-dir', default='aclImdb')
+    parser.add_argument('--cache-dir', default=None)
+    args = parser.parse_args()
+
+    cache_dir = args.cache_dir or os.path.join(args.data_dir, 'packed')
+    for split in ['train', 'test']:
+        meta = build_packed_corpus(args.data_dir, split, cache_dir)
+        size_mb = os.path.getsize(cache_paths(cache_dir, split)['data']) / 2**20
+        print(f"{split}: {meta['n_reviews']} reviews, {size_mb:.1f} MB packed in {cache_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from cache_utils import read_json, write_json_atomic
+from popularity import top_k_indices
+from rating_matrix import load_or_build_rating_matrix
+
+# Matrix-factorization collaborative filter of the MovieLens ratings, in NumPy/SciPy.
+# Same model as the Keras Embedding + Dot + bias model of outline.py (Chapter 4):
+#   rating(u, i) = mean + user_bias[u] + item_bias[i] + user_factors[u] . item_factors[i]
+# but trained with biased ALS (alternating least squares) on the scipy.sparse
+# user x item matrix of rating_matrix.py, without TensorFlow. Each half step solves one small
+# regularized least squares per user (or item), split over a thread pool: the
+# BLAS/LAPACK calls release the GIL. The factors and biases are saved as .npy,
+# and the top-k of a user is a single matrix-vector product.
+#
+# Offline training:
+#   python matrix_factorization.py --ratings ./imdb.data/ratings_small.csv --model-dir ./imdb.data/mf_model
+# Benchmark against the Keras model: python benchmark_mf.py --ratings ./imdb.data/ratings_small.csv
+
+MODEL_VERSION = 1
+META_FILE = 'mf_meta.json'
+FACTOR_FILES = ['user_factors', 'item_factors', 'user_bias', 'item_bias', 'user_ids', 'item_ids']
+
+DEFAULT_N_FACTORS = 50      # emb_sz of the Keras model
+DEFAULT_REG = 0.05          # L2 regularization, scaled by the number of ratings of each user/item
+DEFAULT_N_ITERATIONS = 10
+
+# Function to solve the factors and bias of some rows of the ratings matrix, the other side being fixed.
+# Row u solves (Y_u^T Y_u + reg * n_u * I) x_u = Y_u^T (r_u - mean - other_bias), with Y = [other_factors, 1].
+def solve_rows(matrix, rows, other, other_bias, global_mean, reg):
+    solved = np.zeros((len(rows), other.shape[1]), dtype=np.float64)
+    eye = np.eye(other.shape[1])
+    for out_row, row in enumerate(rows):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        if start == end:
+            continue
+        cols = matrix.indices[start:end]
+        Y = other[cols]
+        target = matrix.data[start:end] - global_mean - other_bias[cols]
+        solved[out_row] = np.linalg.solve(Y.T @ Y + reg * (end - start) * eye, Y.T @ target)
+    return solved
+
+
+class MatrixFactorization:
+    def __init__(self, n_factors=DEFAULT_N_FACTORS, reg=DEFAULT_REG, n_iterations=DEFAULT_N_ITERATIONS,
+                 n_threads=None, seed=42):
+        self.n_factors = n_factors
+        self.reg = reg
+        self.n_iterations = n_iterations
+        self.n_threads = n_threads or os.cpu_count() or 1
+        self.seed = seed
+        self.user_factors = self.item_factors = self.user_bias = self.item_bias = None
+        self.user_ids = self.item_ids = None
+        self.global_mean, self.min_rating, self.max_rating = 0.0, None, None
+        self._user_index = None
+
+    # One ALS half step: all the rows of matrix, split in slices over the thread pool
+    def _half_step(self, executor, matrix, other_factors, other_bias):
+        other = np.hstack([other_factors, np.ones((len(other_factors), 1))])
+        slices = np.array_split(np.arange(matrix.shape[0]), self.n_threads * 4)
+        results = executor.map(lambda rows: solve_rows(matrix, rows, other, other_bias, self.global_mean, self.reg),
+                               slices)
+        solved = np.vstack(list(results))
+        return solved[:, :-1], solved[:, -1]
+
+    # Function to train the model on a ratings matrix (see rating_matrix.build_rating_matrix).
+    # progress(iteration, seconds) is called after each iteration if given.
+    def fit(self, matrix, user_ids, item_ids, progress=None):
+        matrix = sp.csr_matrix(matrix, dtype=np.float64)
+        matrix_t = matrix.T.tocsr()
+        self.user_ids, self.item_ids = np.asarray(user_ids), np.asarray(item_ids)
+        self._user_index = None
+        self.global_mean = float(matrix.data.mean())
+        self.min_rating, self.max_rating = float(matrix.data.min()), float(matrix.data.max())
+
+        rng = np.random.default_rng(self.seed)
+        n_users, n_items = matrix.shape
+        self.user_factors = rng.normal(0, 0.1, (n_users, self.n_factors))
+        self.item_factors = rng.normal(0, 0.1, (n_items, self.n_factors))
+        self.user_bias, self.item_bias = np.zeros(n_users), np.zeros(n_items)
+
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            for iteration in range(self.n_iterations):
+                start_time = time.perf_counter()
+                self.user_factors, self.user_bias = self._half_step(executor, matrix, self.item_factors, self.item_bias)
+                self.item_factors, self.item_bias = self._half_step(executor, matrix_t, self.user_factors, self.user_bias)
+                if progress is not None:
+                    progress(iteration, time.perf_counter() - start_time)
+        return self
+
+    # Function to predict the ratings of (user, item) code pairs, within the rating range like the Keras model
+    def predict(self, users, items):
+        users, items = np.asarray(users), np.asarray(items)
+        ratings = (self.global_mean + self.user_bias[users] + self.item_bias[items]
+                   + np.einsum('ij,ij->i', self.user_factors[users], self.item_factors[items]))
+        return np.clip(ratings, self.min_rating, self.max_rating)
+
+    # Function to get the root mean squared error on (user, item, rating) code triplets
+    def rmse(self, users, items, ratings):
+        return float(np.sqrt(np.mean((self.predict(users, items) - np.asarray(ratings)) ** 2)))
+
+    # Function to get the row code of a user id, None if the user is unknown
+    def user_code(self, user_id):
+        if self._user_index is None:
+            self._user_index = {user: code for code, user in enumerate(self.user_ids.tolist())}
+        return self._user_index.get(user_id)
+
+    # Function to get the top-k items of a user code: one matrix-vector product over all items.
+    # exclude: item codes to skip, e.g. the items the user already rated.
+    # Returns (item_ids, predicted ratings), best first.
+    def recommend(self, user, k=10, exclude=None):
+        # The global mean and user bias do not change the ranking, they are added for the predicted ratings
+        scores = np.asarray(self.item_factors @ self.user_factors[user], dtype=np.float64) + self.item_bias
+        if exclude is not None and len(exclude) > 0:
+            scores[np.asarray(exclude)] = -np.inf
+        items = top_k_indices(scores, k)
+        items = items[np.isfinite(scores[items])]
+        ratings = np.clip(scores[items] + self.global_mean + self.user_bias[user], self.min_rating, self.max_rating)
+        return self.item_ids[items], ratings
+
+    # Function to save the factors, biases and ids as .npy, and the scalars in a JSON meta file
+    def save(self, model_dir):
+        os.makedirs(model_dir, exist_ok=True)
+        for name in FACTOR_FILES:
+            array = getattr(self, name)
+            if name.endswith('factors') or name.endswith('bias'):
+                array = array.astype(np.float32)
+            tmp_path = os.path.join(model_dir, f"{name}.{os.getpid()}.tmp.npy")
+            np.save(tmp_path, array)
+            os.replace(tmp_path, os.path.join(model_dir, f"{name}.npy"))
+        meta = {
+            'version': MODEL_VERSION,
+            'n_factors': self.n_factors,
+            'reg': self.reg,
+            'n_iterations': self.n_iterations,
+            'global_mean': self.global_mean,
+            'min_rating': self.min_rating,
+            'max_rating': self.max_rating,
+        }
+        write_json_atomic(os.path.join(model_dir, META_FILE), meta)
+        return meta
+
+
+# Function to load a saved model, the factors are memory-mapped. Returns None if missing or outdated.
+def load_matrix_factorization(model_dir):
+    meta = read_json(os.path.join(model_dir, META_FILE))
+    if meta is None or meta.get('version') != MODEL_VERSION:
+        return None
+    model = MatrixFactorization(meta['n_factors'], meta['reg'], meta['n_iterations'])
+    model.global_mean, model.min_rating, model.max_rating = meta['global_mean'], meta['min_rating'], meta['max_rating']
+    for name in FACTOR_FILES:
+        setattr(model, name, np.load(os.path.join(model_dir, f"{name}.npy"), mmap_mode='r'))
+    return model
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the matrix-factorization collaborative filter with ALS")
+    parser.add_argument('--ratings', default=os.path.join('imdb.data', 'ratings_small.csv'))
+    parser.add_argument('--model-dir', default=os.path.join('imdb.data', 'mf_model'))
+    parser.add_argument('--factors', type=int, default=DEFAULT_N_FACTORS)
+    parser.add_argument('--reg', type=float, default=DEFAULT_REG)
+    parser.add_argument('--iterations', type=int, default=DEFAULT_N_ITERATIONS)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--user', type=int, default=None, help="Show the top-10 movieIds of this userId")
+    args = parser.parse_args()
+
+    matrix, user_ids, item_ids = load_or_build_rating_matrix(args.ratings)
+    print(f"{len(user_ids)} users, {len(item_ids)} movies, {matrix.nnz} ratings")
+
+    model = MatrixFactorization(args.factors, args.reg, args.iterations, args.threads)
+    start_time = time.perf_counter()
+    model.fit(matrix, user_ids, item_ids,
+              progress=lambda iteration, seconds: print(f"Iteration {iteration + 1}: {seconds:.2f} s"))
+    train = matrix.tocoo()
+    print(f"Trained in {time.perf_counter() - start_time:.1f} s, train RMSE {model.rmse(train.row, train.col, train.data):.4f}")
+    model.save(args.model_dir)
+    print(f"Model saved to {args.model_dir}")
+
+    if args.user is not None:
+        user = model.user_code(args.user)
+        if user is None:
+            print(f"Unknown userId {args.user}")
+        else:
+            rated = matrix.indices[matrix.indptr[user]:matrix.indptr[user + 1]]
+            movie_ids, predicted = model.recommend(user, k=10, exclude=rated)
+            print(pd.DataFrame({'movieId': movie_ids, 'predicted_rating': predicted}))
+
+if __name__ == "__main__":
+    main()
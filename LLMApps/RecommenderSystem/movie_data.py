@@ -0,0 +1,196 @@
+import argparse
+import os
+from ast import literal_eval
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from cache_utils import file_sha256, file_signature, read_json, write_json_atomic
+
+# Columnar, typed loader for movies_metadata.csv, credits.csv and keywords.csv.
+# The stringified cast/crew/keywords/genres columns are parsed once, in
+# parallel across cores, and the normalized features (director, top-3 cast,
+# keywords, genres and the soup) are stored as a typed Parquet snapshot.
+# Later starts only read the snapshot.
+#
+# Offline build:
+#   python movie_data.py --data-dir ./imdb.data
+
+SNAPSHOT_VERSION = 2
+SNAPSHOT_FILE = 'movie_features.parquet'
+META_FILE = 'movie_features_meta.json'
+SOURCE_FILES = ['movies_metadata.csv', 'credits.csv', 'keywords.csv']
+LIST_FEATURES = ['cast', 'keywords', 'genres']
+
+# Function to convert all strings to lower case and strip names of spaces
+def normalize_data(x):
+    if isinstance(x, list):
+        return [str.lower(i.replace(" ", "")) for i in x]
+    else:
+        #Check if director exists. If not, return empty string
+        if isinstance(x, str):
+            return str.lower(x.replace(" ", ""))
+        else:
+            return ''
+
+# Get the director's name from the crew feature. If director is not listed, return NaN
+def get_director(x):
+    for i in x:
+        if i['job'] == 'Director':
+            return i['name']
+    return np.nan
+
+# Returns the list top 3 elements or entire list; whichever is more.
+def get_list(x):
+    if isinstance(x, list):
+        names = [i['name'] for i in x]
+        #Check if more than 3 elements exist. If yes, return only first three. If no, return entire list.
+        if len(names) > 3:
+            names = names[:3]
+        return names
+
+    #Return empty list in case of missing/malformed data
+    return []
+
+# Function to parse a stringified feature, returns an empty list on missing/malformed data
+def parse_feature(x):
+    if not isinstance(x, str):
+        return []
+    try:
+        return literal_eval(x)
+    except (ValueError, SyntaxError):
+        return []
+
+# Function to parse and normalize one chunk of rows. Runs in a worker process.
+def parse_chunk(chunk):
+    cast, crew, keywords, genres = chunk
+    features = {
+        'cast': [normalize_data(get_list(parse_feature(x))) for x in cast],
+        'keywords': [normalize_data(get_list(parse_feature(x))) for x in keywords],
+        'genres': [normalize_data(get_list(parse_feature(x))) for x in genres],
+        'director': [normalize_data(get_director(parse_feature(x))) for x in crew],
+    }
+    return features
+
+# Function to parse the stringified columns, split in chunks across a process pool
+def parse_features(metadata, n_workers=None, min_rows_per_chunk=2000):
+    n_workers = n_workers or os.cpu_count() or 1
+    columns = [metadata[c].tolist() for c in ['cast', 'crew', 'keywords', 'genres']]
+    n_rows = len(metadata)
+    n_chunks = max(1, min(n_workers * 4, n_rows // min_rows_per_chunk))
+    bounds = np.linspace(0, n_rows, n_chunks + 1).astype(int)
+    chunks = [tuple(col[start:end] for col in columns) for start, end in zip(bounds[:-1], bounds[1:])]
+
+    if n_workers == 1 or n_chunks == 1:
+        results = [parse_chunk(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(parse_chunk, chunks))
+
+    features = {}
+    for name in LIST_FEATURES + ['director']:
+        features[name] = [value for result in results for value in result[name]]
+    return features
+
+# Function to create a 'soup' of features
+def create_soup(features):
+    return ' '.join(features['keywords']) + ' ' + ' '.join(features['cast']) + ' ' + features['director'] + ' ' + ' '.join(features['genres'])
+
+# Function to read the three CSVs, merge them and build the normalized features
+def build_movie_features(data_dir, n_workers=None):
+    # Load Movies Metadata
+    metadata = pd.read_csv(os.path.join(data_dir, 'movies_metadata.csv'),
+                           usecols=['id', 'title', 'release_date', 'overview', 'genres', 'vote_count', 'vote_average'],
+                           low_memory=False)
+    # Load keywords and credits
+    credits = pd.read_csv(os.path.join(data_dir, 'credits.csv'))
+    keywords = pd.read_csv(os.path.join(data_dir, 'keywords.csv'))
+
+    # Remove rows with bad IDs, and convert IDs to int. Required for merging
+    metadata['id'] = pd.to_numeric(metadata['id'], errors='coerce')
+    metadata = metadata.dropna(subset=['id'])
+    metadata['id'] = metadata['id'].astype('int64')
+    keywords['id'] = keywords['id'].astype('int64')
+    credits['id'] = credits['id'].astype('int64')
+
+    # Merge keywords and credits into the main metadata dataframe
+    metadata = metadata.merge(credits, on='id')
+    metadata = metadata.merge(keywords, on='id')
+
+    features = parse_features(metadata, n_workers=n_workers)
+    movies = pd.DataFrame({
+        'id': metadata['id'].to_numpy(dtype=np.int64),
+        'title': metadata['title'].fillna('').astype(str).to_numpy(),
+        'release_date': metadata['release_date'].fillna('').astype(str).to_numpy(),
+        'overview': metadata['overview'].fillna('').astype(str).to_numpy(),
+        'vote_count': pd.to_numeric(metadata['vote_count'], errors='coerce').to_numpy(dtype=np.float64),
+        'vote_average': pd.to_numeric(metadata['vote_average'], errors='coerce').to_numpy(dtype=np.float64),
+        'director': features['director'],
+        'cast': features['cast'],
+        'keywords': features['keywords'],
+        'genres': features['genres'],
+    })
+    movies['soup'] = [create_soup(row) for row in movies[['keywords', 'cast', 'director', 'genres']].to_dict('records')]
+    return movies
+
+# Function to get the hashes of the source CSVs, reusing the stored ones for unchanged files
+def source_hashes(data_dir, meta=None):
+    stored = (meta or {}).get('sources', {})
+    sources = {}
+    for name in SOURCE_FILES:
+        path = os.path.join(data_dir, name)
+        signature = file_signature(path)
+        if name in stored and stored[name]['signature'] == signature:
+            sources[name] = stored[name]
+        else:
+            sources[name] = {'signature': signature, 'sha256': file_sha256(path)}
+    return sources
+
+# Function to write the typed Parquet snapshot of the movie features
+def save_movie_features(movies, data_dir, snapshot_dir=None, sources=None):
+    snapshot_dir = snapshot_dir or data_dir
+    os.makedirs(snapshot_dir, exist_ok=True)
+    snapshot_path = os.path.join(snapshot_dir, SNAPSHOT_FILE)
+    tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+    movies.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, snapshot_path)
+    meta = {
+        'version': SNAPSHOT_VERSION,
+        'sources': sources or source_hashes(data_dir),
+        'n_movies': int(len(movies)),
+    }
+    write_json_atomic(os.path.join(snapshot_dir, META_FILE), meta)
+    return meta
+
+# Function to load the movie features, rebuilding the snapshot only if a source CSV changed
+def load_movie_features(data_dir, snapshot_dir=None, n_workers=None):
+    snapshot_dir = snapshot_dir or data_dir
+    snapshot_path = os.path.join(snapshot_dir, SNAPSHOT_FILE)
+    meta = read_json(os.path.join(snapshot_dir, META_FILE))
+    if meta is not None and meta.get('version') == SNAPSHOT_VERSION and os.path.exists(snapshot_path):
+        sources = source_hashes(data_dir, meta)
+        if [sources[n]['sha256'] for n in SOURCE_FILES] == [meta['sources'][n]['sha256'] for n in SOURCE_FILES]:
+            if sources != meta['sources']:
+                # Content unchanged (e.g. files were only touched), remember the new signatures
+                meta['sources'] = sources
+                write_json_atomic(os.path.join(snapshot_dir, META_FILE), meta)
+            return pd.read_parquet(snapshot_path)
+
+    movies = build_movie_features(data_dir, n_workers=n_workers)
+    save_movie_features(movies, data_dir, snapshot_dir)
+    return movies
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the Parquet snapshot of the movie features")
+    parser.add_argument('--data-dir', default='imdb.data')
+    parser.add_argument('--snapshot-dir', default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    movies = build_movie_features(args.data_dir, n_workers=args.workers)
+    meta = save_movie_features(movies, args.data_dir, args.snapshot_dir)
+    print(f"Movie features snapshot built: {meta['n_movies']} movies")
+
+if __name__ == "__main__":
+    main()
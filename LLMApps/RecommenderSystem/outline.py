@@ -563,15 +563,14 @@ import numpy as np
 CLASSES = ['neg', 'pos']#, 'unsup']
 PATH=Path('./aclImdb/')
 
+# The reviews are read once into a packed, memory-mapped cache (see imdb_corpus.py),
+# the next runs skip the 25k small file opens per split
+from imdb_corpus import load_packed_corpus
+
 def get_texts(path):
-    texts,labels = [],[]
-    for idx,label in enumerate(CLASSES):
-        for fname in (path/label).glob('*.*'):
-            #texts.append(fixup(fname.open('r', encoding='utf-8').read()))
-            texts.append(fname.open('r', encoding='utf-8').read())
-            labels.append(idx)
+    corpus = load_packed_corpus(str(path.parent), path.name, classes=CLASSES)
     #return np.array(texts),np.array(labels)
-    return texts, labels
+    return corpus.texts(), corpus.labels.tolist()
 
 trn_texts,trn_labels = get_texts(PATH/'train')
 tst_texts,tst_labels = get_texts(PATH/'test')
@@ -662,8 +661,12 @@ def normalize_text( text):
 
     return ''.join(words)
 
+import text_normalizer
+
 def normalize_corpus(corpus):
-  return [normalize_text(t) for t in corpus]
+  # Same steps as normalize_text, with precompiled regexes, a stopwords set and memoized lemmas,
+  # over a process pool (see text_normalizer.py)
+  return text_normalizer.normalize_corpus(corpus)
 
 trn_texts = normalize_corpus(trn_texts)
 tst_texts = normalize_corpus(tst_texts)
@@ -1300,21 +1303,17 @@ movies.head()
 ratings = pd.read_csv('ml-latest-small/ratings.csv')
 ratings.head()
 
-pd.crosstab(ratings.userId, ratings.movieId).head()
+# Sparse user x movie matrix (see rating_matrix.py), a dense pd.crosstab does not fit in memory at ml-25m scale
+from rating_matrix import load_or_build_rating_matrix, top_k_slice
+rating_matrix, user_ids, movie_ids = load_or_build_rating_matrix('ml-latest-small/ratings.csv')
+rating_matrix.shape, rating_matrix.nnz
 
 """## Answer"""
 
 k = 15
-g = ratings.groupby('userId')['rating'].count()
-top_users = g.sort_values(ascending=False)[:k]
-
-g = ratings.groupby('movieId')['rating'].count()
-top_movies = g.sort_values(ascending=False)[:k]
-
-top_r = ratings.join(top_users, rsuffix='_r', how='inner', on='userId')
-top_r = top_r.join(top_movies, rsuffix='_r', how='inner', on='movieId')
-
-pd.crosstab(top_r.userId, top_r.movieId, top_r.rating, aggfunc=np.sum)
+# Only the k x k slice of the most active users and most rated movies is densified
+top_matrix, top_users, top_movies = top_k_slice(rating_matrix, user_ids, movie_ids, n_users=k, n_items=k)
+pd.DataFrame(top_matrix.toarray(), index=pd.Index(top_users, name='userId'), columns=pd.Index(top_movies, name='movieId'))
 
 """## Excercise
 
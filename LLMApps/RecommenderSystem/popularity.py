@@ -0,0 +1,47 @@
+import numpy as np
+
+# Shared popularity ranking for the simple recommender and its fallbacks.
+# The IMDB weighted rating is computed column-wise with NumPy instead of a
+# row-wise DataFrame.apply, and only the top-k movies are sorted.
+
+# Function to compute the C and M priors of the weighted rating
+def rating_priors(metadata, quantile=0.90):
+    C = metadata['vote_average'].mean()
+    M = metadata['vote_count'].quantile(quantile)
+    return C, M
+
+# Function to compute the weighted rating of all movies at once
+def weighted_rating(vote_count, vote_average, M, C):
+    v = np.asarray(vote_count, dtype=np.float64)
+    R = np.asarray(vote_average, dtype=np.float64)
+    return (v/(v+M) * R) + (M/(M+v) * C)
+
+# Function to get the indices of the k highest scores, best first.
+# argpartition selects the top-k in O(n), then only those k are sorted.
+def top_k_indices(scores, k):
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    if k < n:
+        indices = np.argpartition(-scores, k - 1)[:k]
+    else:
+        indices = np.arange(n)
+    return indices[np.argsort(-scores[indices], kind='stable')]
+
+# Function to get the top-k movie recommendations
+def get_simple_recommendations(metadata, k=5, C=None, M=None):
+    if C is None or M is None:
+        C, M = rating_priors(metadata)
+
+    vote_count = metadata['vote_count'].to_numpy(dtype=np.float64)
+    vote_average = metadata['vote_average'].to_numpy(dtype=np.float64)
+
+    # Only qualified movies (enough votes) are ranked
+    qualified = np.flatnonzero(vote_count >= M)
+    scores = weighted_rating(vote_count[qualified], vote_average[qualified], M, C)
+    rows = qualified[top_k_indices(scores, k)]
+
+    q_movies = metadata.iloc[rows][['title', 'vote_count', 'vote_average']].copy()
+    q_movies['score'] = weighted_rating(vote_count[rows], vote_average[rows], M, C)
+    return q_movies
@@ -0,0 +1,111 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from cache_utils import file_sha256, file_signature, read_json, write_json_atomic
+from popularity import get_simple_recommendations, rating_priors
+
+# Precomputed popularity index for the LLM recommenders' candidate list.
+# The ranked qualified movies are written once to a .npy structured array,
+# along with C, M and the hash of the source CSV. The apps memory-map it at
+# startup, instead of parsing the CSV and re-ranking on every click.
+#
+# Offline build:
+#   python popularity_index.py --csv ./imdb.data/movies_metadata.csv
+
+INDEX_VERSION = 1
+INDEX_FILE = 'popularity.npy'
+META_FILE = 'popularity_meta.json'
+
+# Function to get the default index directory, next to the source CSV
+def default_index_dir(csv_path):
+    return os.path.join(os.path.dirname(os.path.abspath(csv_path)), 'popularity_index')
+
+# Function to rank all qualified movies of the CSV and persist them to disk
+def build_popularity_index(csv_path, index_dir=None):
+    index_dir = index_dir or default_index_dir(csv_path)
+    os.makedirs(index_dir, exist_ok=True)
+
+    metadata = pd.read_csv(csv_path, usecols=['title', 'vote_count', 'vote_average'], low_memory=False)
+    metadata['vote_count'] = pd.to_numeric(metadata['vote_count'], errors='coerce')
+    metadata['vote_average'] = pd.to_numeric(metadata['vote_average'], errors='coerce')
+    metadata['title'] = metadata['title'].fillna('').astype(str)
+
+    C, M = rating_priors(metadata)
+    ranked = get_simple_recommendations(metadata, k=len(metadata), C=C, M=M)
+
+    title_len = max(1, ranked['title'].str.len().max())
+    index = np.empty(len(ranked), dtype=[('title', f'U{title_len}'),
+                                         ('vote_count', 'f8'),
+                                         ('vote_average', 'f8'),
+                                         ('score', 'f8')])
+    for column in index.dtype.names:
+        index[column] = ranked[column].to_numpy()
+
+    tmp_path = os.path.join(index_dir, f"{INDEX_FILE}.{os.getpid()}.tmp.npy")
+    np.save(tmp_path, index)
+    os.replace(tmp_path, os.path.join(index_dir, INDEX_FILE))
+
+    meta = {
+        'version': INDEX_VERSION,
+        'csv_sha256': file_sha256(csv_path),
+        'csv_signature': file_signature(csv_path),
+        'C': float(C),
+        'M': float(M),
+        'n_movies': int(len(index)),
+    }
+    write_json_atomic(os.path.join(index_dir, META_FILE), meta)
+    return meta
+
+# Function to check if the index on disk was built from the current CSV
+def popularity_index_is_fresh(csv_path, index_dir=None):
+    index_dir = index_dir or default_index_dir(csv_path)
+    meta = read_json(os.path.join(index_dir, META_FILE))
+    if meta is None or meta.get('version') != INDEX_VERSION:
+        return False
+    if not os.path.exists(os.path.join(index_dir, INDEX_FILE)):
+        return False
+    # Same size and mtime: skip hashing the CSV
+    if meta.get('csv_signature') == file_signature(csv_path):
+        return True
+    if meta.get('csv_sha256') != file_sha256(csv_path):
+        return False
+    # Content unchanged (e.g. the file was only touched), remember the new signature
+    meta['csv_signature'] = file_signature(csv_path)
+    write_json_atomic(os.path.join(index_dir, META_FILE), meta)
+    return True
+
+# Function to memory-map the popularity index, rebuilding it only if the CSV changed
+def load_popularity_index(csv_path, index_dir=None):
+    index_dir = index_dir or default_index_dir(csv_path)
+    if not popularity_index_is_fresh(csv_path, index_dir):
+        build_popularity_index(csv_path, index_dir)
+    index = np.load(os.path.join(index_dir, INDEX_FILE), mmap_mode='r')
+    meta = read_json(os.path.join(index_dir, META_FILE))
+    return index, meta
+
+# Function to get the top-k popular movies from the index, same columns as get_simple_recommendations
+def get_popular_movies(index, k=5):
+    return pd.DataFrame(np.asarray(index[:k]))
+
+# Function to get the top-k popular titles from the index, used as LLM candidates
+def get_popular_titles(index, k=1000):
+    return index['title'][:k].tolist()
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the popularity index of the movies metadata")
+    parser.add_argument('--csv', default=os.path.join('imdb.data', 'movies_metadata.csv'))
+    parser.add_argument('--index-dir', default=None)
+    parser.add_argument('--force', action='store_true', help="Rebuild even if the CSV did not change")
+    args = parser.parse_args()
+
+    if not args.force and popularity_index_is_fresh(args.csv, args.index_dir):
+        print("Popularity index is up to date")
+        return
+    meta = build_popularity_index(args.csv, args.index_dir)
+    print(f"Popularity index built: {meta['n_movies']} movies, C={meta['C']:.3f}, M={meta['M']:.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from cache_utils import file_sha256, file_signature
+from popularity import top_k_indices
+
+# Sparse user x movie ratings matrix of the MovieLens ratings.
+# outline.py builds it with pd.crosstab(ratings.userId, ratings.movieId): a
+# dense DataFrame of n_users x n_movies cells, unusable at ml-25m scale
+# (162k users x 59k movies). Here the ids are encoded with vectorized
+# pd.factorize (hashing), the CSV can be read in chunks, and the CSR
+# matrix is built directly from the (user, movie, rating) triplets. The
+# matrix and the id maps are persisted in one .npz, rebuilt only if the CSV
+# changed. The top-k slices and training batches never densify the matrix.
+#
+# Offline build:
+#   python rating_matrix.py --csv ./imdb.data/ratings_small.csv
+
+MATRIX_VERSION = 1
+DEFAULT_CHUNKSIZE = 5000000   # CSV rows per chunk, ~60 MB of encoded triplets
+RATING_COLUMNS = ['userId', 'movieId', 'rating']
+RATING_DTYPES = {'userId': np.int64, 'movieId': np.int64, 'rating': np.float32}
+
+# Function to read a MovieLens ratings CSV (userId, movieId, rating), only the needed columns
+def read_ratings(path):
+    return pd.read_csv(path, usecols=RATING_COLUMNS, dtype=RATING_DTYPES)
+
+# Function to read a ratings CSV in chunks, for files bigger than the memory
+def read_ratings_chunks(path, chunksize=DEFAULT_CHUNKSIZE):
+    yield from pd.read_csv(path, usecols=RATING_COLUMNS, dtype=RATING_DTYPES, chunksize=chunksize)
+
+# Function to encode ids as codes, extending the ids seen in the previous chunks.
+# Codes are in order of first appearance, the same as pd.factorize on the whole column.
+# Returns (codes, ids), ids is the updated pd.Index of the ids of each code.
+def encode_ids(values, ids):
+    if len(ids) == 0:
+        codes, uniques = pd.factorize(values)
+        return codes, pd.Index(uniques)
+    codes = ids.get_indexer(values)
+    new = codes < 0
+    if new.any():
+        ids = ids.append(pd.Index(pd.unique(values[new])))
+        codes[new] = ids.get_indexer(values[new])
+    return codes, ids
+
+# Function to build the sparse ratings matrix from a ratings DataFrame or a CSV path, read in chunks.
+# Returns (matrix, user_ids, item_ids): the matrix (format 'csr' by user rows, or 'csc' by movie columns)
+# holds the rating of row user_ids[u] for column item_ids[i]. Duplicated (user, movie) ratings are summed,
+# MovieLens has none.
+def build_rating_matrix(source, chunksize=DEFAULT_CHUNKSIZE, format='csr'):
+    chunks = read_ratings_chunks(source, chunksize) if isinstance(source, str) else [source]
+    user_ids = pd.Index([], dtype=np.int64)
+    item_ids = pd.Index([], dtype=np.int64)
+    users, items, ratings = [], [], []
+    for chunk in chunks:
+        user_codes, user_ids = encode_ids(chunk['userId'].to_numpy(), user_ids)
+        item_codes, item_ids = encode_ids(chunk['movieId'].to_numpy(), item_ids)
+        users.append(user_codes.astype(np.int32))
+        items.append(item_codes.astype(np.int32))
+        ratings.append(chunk['rating'].to_numpy(dtype=np.float32))
+
+    data = np.concatenate(ratings) if ratings else np.zeros(0, dtype=np.float32)
+    rows = np.concatenate(users) if users else np.zeros(0, dtype=np.int32)
+    cols = np.concatenate(items) if items else np.zeros(0, dtype=np.int32)
+    matrix = sp.coo_matrix((data, (rows, cols)), shape=(len(user_ids), len(item_ids))).asformat(format)
+    return matrix, user_ids.to_numpy(), item_ids.to_numpy()
+
+# Function to save the matrix and its id maps in one .npz
+def save_rating_matrix(path, matrix, user_ids, item_ids, source_path=None):
+    matrix = matrix.tocsr()
+    extra = {}
+    if source_path is not None:
+        extra = {'source_sha256': np.array(file_sha256(source_path)),
+                 'source_signature': np.array(file_signature(source_path), dtype=np.int64)}
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, version=np.array(MATRIX_VERSION), data=matrix.data, indices=matrix.indices,
+             indptr=matrix.indptr, shape=np.array(matrix.shape), user_ids=user_ids, item_ids=item_ids, **extra)
+    os.replace(tmp_path, path)
+
+# Function to load a saved matrix. Returns (matrix, user_ids, item_ids), like build_rating_matrix.
+def load_rating_matrix(path, format='csr'):
+    with np.load(path) as saved:
+        matrix = sp.csr_matrix((saved['data'], saved['indices'], saved['indptr']), shape=tuple(saved['shape']))
+        return matrix.asformat(format), saved['user_ids'], saved['item_ids']
+
+# Function to get the default .npz path, next to the source CSV
+def default_matrix_path(csv_path):
+    return f"{os.path.splitext(csv_path)[0]}_matrix.npz"
+
+# Function to check if the saved matrix was built from the current CSV
+def rating_matrix_is_fresh(csv_path, npz_path):
+    if not os.path.exists(npz_path):
+        return False
+    try:
+        with np.load(npz_path) as saved:
+            if 'source_sha256' not in saved or int(saved['version']) != MATRIX_VERSION:
+                return False
+            if saved['source_signature'].tolist() == file_signature(csv_path):
+                return True
+            return str(saved['source_sha256']) == file_sha256(csv_path)
+    except (OSError, ValueError):
+        return False
+
+# Function to load the matrix of a ratings CSV, building and saving it only if the CSV changed
+def load_or_build_rating_matrix(csv_path, npz_path=None, chunksize=DEFAULT_CHUNKSIZE, format='csr'):
+    npz_path = npz_path or default_matrix_path(csv_path)
+    if rating_matrix_is_fresh(csv_path, npz_path):
+        return load_rating_matrix(npz_path, format)
+    matrix, user_ids, item_ids = build_rating_matrix(csv_path, chunksize)
+    save_rating_matrix(npz_path, matrix, user_ids, item_ids, source_path=csv_path)
+    return matrix.asformat(format), user_ids, item_ids
+
+# Function to get the submatrix of the n_users users with most ratings and the n_items most rated movies.
+# Replaces the groupby counts, joins and crosstab of outline.py. Returns (submatrix, user_ids, item_ids).
+def top_k_slice(matrix, user_ids, item_ids, n_users=15, n_items=15):
+    matrix = matrix.tocsr()
+    top_users = top_k_indices(np.diff(matrix.indptr), n_users)
+    top_items = top_k_indices(np.bincount(matrix.indices, minlength=matrix.shape[1]), n_items)
+    return matrix[top_users][:, top_items], np.asarray(user_ids)[top_users], np.asarray(item_ids)[top_items]
+
+# Function to iterate over the ratings in (users, items, ratings) code batches, e.g. for Keras or SGD training
+def iter_training_batches(matrix, batch_size=64, shuffle=True, seed=42):
+    triplets = matrix.tocoo()
+    order = np.random.default_rng(seed).permutation(triplets.nnz) if shuffle else np.arange(triplets.nnz)
+    for start in range(0, triplets.nnz, batch_size):
+        batch = order[start:start + batch_size]
+        yield triplets.row[batch], triplets.col[batch], triplets.data[batch]
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the sparse ratings matrix of a MovieLens ratings CSV")
+    parser.add_argument('--csv', default=os.path.join('imdb.data', 'ratings_small.csv'))
+    parser.add_argument('--npz', default=None)
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    matrix, user_ids, item_ids = build_rating_matrix(args.csv, args.chunksize)
+    npz_path = args.npz or default_matrix_path(args.csv)
+    save_rating_matrix(npz_path, matrix, user_ids, item_ids, source_path=args.csv)
+    n_users, n_items = matrix.shape
+    sparse_mb = (matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes) / 2**20
+    print(f"{n_users} users x {n_items} movies, {matrix.nnz} ratings ({matrix.nnz / max(1, n_users * n_items):.4%} dense), "
+          f"built in {time.perf_counter() - start_time:.1f} s")
+    print(f"CSR {sparse_mb:.1f} MB, dense crosstab would be {n_users * n_items * 8 / 2**20:.0f} MB, saved to {npz_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import time
+
+from cache_utils import read_json, write_json_atomic
+from title_index import normalize_title
+
+# Per-user cache of the LLM recommendations, shared by the Streamlit sessions.
+# Entries are keyed by the hash of the sorted watch history, the model, the
+# candidate set and the prompt mode, and stored as one JSON file per key,
+# written atomically. Reads are stale-while-revalidate: an entry older than
+# the TTL is still returned (status 'stale') so the app can show it instantly
+# while it refreshes it. The least recently used entries are evicted beyond
+# max_entries (each hit touches its file).
+
+DEFAULT_CACHE_DIR = 'recommendations_cache'
+DEFAULT_TTL = 2 * 60                 # seconds an entry is fresh
+DEFAULT_MAX_STALE = 24 * 60 * 60     # seconds a stale entry can still be served while refreshing
+DEFAULT_MAX_ENTRIES = 10000
+
+FRESH, STALE, MISS = 'fresh', 'stale', 'miss'
+
+# Function to get the version of a candidate set, any change in the candidates gives a new cache key
+def candidate_set_version(all_movies):
+    return hashlib.sha256("\n".join(all_movies).encode('utf-8')).hexdigest()[:16]
+
+# Function to get the cache key of a request: the same movies in any order, case or spacing share the key
+def recommendation_key(watched_movies, model_name, all_movies, justify=False):
+    request = {
+        'watched_movies': sorted(normalize_title(movie) for movie in watched_movies),
+        'model': model_name,
+        'candidates': candidate_set_version(all_movies),
+        'justify': justify,
+    }
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class RecommendationCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL, max_stale=DEFAULT_MAX_STALE,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    # Function to read an entry. Returns (recommendations, status), status is FRESH, STALE or MISS.
+    def get(self, key):
+        path = self._path(key)
+        entry = read_json(path)
+        if not isinstance(entry, dict) or 'created' not in entry:
+            return None, MISS
+        age = time.time() - entry['created']
+        if age > self.ttl + self.max_stale:
+            return None, MISS
+        try:
+            # The file modification time is the LRU access time
+            os.utime(path)
+        except OSError:
+            pass
+        return entry['recommendations'], FRESH if age <= self.ttl else STALE
+
+    # Function to store the recommendations of a key, evicting the least recently used entries beyond max_entries
+    def put(self, key, recommendations):
+        write_json_atomic(self._path(key), {'created': time.time(), 'recommendations': recommendations})
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json'):
+                try:
+                    entries.append((os.path.getmtime(os.path.join(self.cache_dir, name)), name))
+                except OSError:
+                    continue
+        n_evict = len(entries) - self.max_entries
+        if n_evict <= 0:
+            return
+        for _, name in sorted(entries)[:n_evict]:
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
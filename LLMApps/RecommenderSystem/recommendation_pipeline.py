@@ -0,0 +1,223 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from candidates import popularity_prior
+from recommendation_prompt import build_recommendation_messages, max_response_tokens, parse_response
+from similarity import l2_normalize_rows
+from title_index import build_title_index, lookup_titles
+
+# Hybrid multi-stage recommendation pipeline.
+# The v1 to v5 recommenders each use one strategy on the whole catalog. Here
+# they are chained from cheap to expensive, each stage re-ranking the
+# candidates of the previous one and keeping its k best:
+#   popularity (45k -> 2000) -> content TF-IDF (-> 200) -> embeddings (-> 20) -> LLM re-rank
+# Each stage has a latency budget. A stage that misses it, or fails, is
+# abandoned and the pipeline returns the ranking of the previous stage, so the
+# answer time stays bounded. The on_stage callback gets every intermediate
+# ranking: an app can show the cheap ones within milliseconds while the LLM
+# runs on a small candidate set.
+#
+# Benchmark: python benchmark_pipeline.py --data-dir ./imdb.data
+
+DEFAULT_STAGE_SIZES = {'popularity': 2000, 'content': 200, 'embedding': 20, 'llm': 20}
+DEFAULT_BUDGETS = {'popularity': None, 'content': 0.2, 'embedding': 3.0, 'llm': 15.0}  # seconds, None: no timeout
+DEFAULT_MAX_WORKERS = 4   # Stages running at the same time, across requests
+
+OK, TIMEOUT, ERROR, SKIPPED = 'ok', 'timeout', 'error', 'skipped'
+
+
+class Stage:
+    # - name: shown in the stage reports
+    # - k: candidates kept for the next stage, None keeps them all
+    # - budget: latency budget in seconds, None runs the stage without timeout
+    def __init__(self, name, k=None, budget=None):
+        self.name = name
+        self.k = k
+        self.budget = budget
+
+    # Function to score the candidate rows of a request, higher is better. Implemented by each stage.
+    def score(self, rows, watched_rows, watched_movies):
+        raise NotImplementedError
+
+    # Function to re-rank the candidate rows and keep the k best. Ties keep the previous order.
+    def run(self, rows, watched_rows, watched_movies):
+        scores = np.asarray(self.score(rows, watched_rows, watched_movies), dtype=np.float64)
+        order = np.argsort(-scores, kind='stable')[:self.k]
+        return rows[order], scores[order]
+
+
+# Stage ranking by a popularity prior of the movies (v1)
+class PopularityStage(Stage):
+    def __init__(self, popularity, k=DEFAULT_STAGE_SIZES['popularity'], budget=DEFAULT_BUDGETS['popularity']):
+        super().__init__('popularity', k, budget)
+        self.popularity = np.asarray(popularity, dtype=np.float64)
+
+    def score(self, rows, watched_rows, watched_movies):
+        return self.popularity[rows]
+
+
+# Stage ranking by the cosine similarity of sparse content features, e.g. TF-IDF of the soup (v2)
+class ContentStage(Stage):
+    def __init__(self, item_matrix, k=DEFAULT_STAGE_SIZES['content'], budget=DEFAULT_BUDGETS['content']):
+        super().__init__('content', k, budget)
+        self.item_matrix = l2_normalize_rows(item_matrix)
+
+    def score(self, rows, watched_rows, watched_movies):
+        if len(watched_rows) == 0:
+            return np.zeros(len(rows))
+        profile = l2_normalize_rows(np.asarray(self.item_matrix[watched_rows].mean(axis=0)))
+        return np.asarray(self.item_matrix[rows] @ profile.T).ravel()
+
+
+# Stage ranking by the cosine similarity of dense embeddings (v3, v4).
+# embeddings is a matrix aligned with the catalog rows, or a function embed(rows) -> matrix,
+# e.g. to embed only the candidates, through the embedding cache.
+class EmbeddingStage(Stage):
+    def __init__(self, embeddings, k=DEFAULT_STAGE_SIZES['embedding'], budget=DEFAULT_BUDGETS['embedding']):
+        super().__init__('embedding', k, budget)
+        self.embeddings = embeddings
+
+    def _embed(self, rows):
+        if callable(self.embeddings):
+            return np.asarray(self.embeddings(rows), dtype=np.float32)
+        return np.asarray(self.embeddings[rows], dtype=np.float32)
+
+    def score(self, rows, watched_rows, watched_movies):
+        if len(watched_rows) == 0:
+            return np.zeros(len(rows))
+        # One lookup (or embedding call) for the history and the candidates
+        vectors = l2_normalize_rows(self._embed(np.concatenate([watched_rows, rows])))
+        profile = l2_normalize_rows(vectors[:len(watched_rows)].mean(axis=0, keepdims=True))
+        return vectors[len(watched_rows):] @ profile.ravel()
+
+
+# Stage re-ranking the candidates with the LLM (v5), in the compact prompt format.
+# The movies the LLM recommends come first, by score, then the others (score 0) in the previous order.
+# A response without any valid recommendation raises, the stage fails and the previous ranking is kept.
+class LLMStage(Stage):
+    def __init__(self, titles, client, model_name="gpt-3.5-turbo-1106", n_recommendations=5, justify=False,
+                 k=DEFAULT_STAGE_SIZES['llm'], budget=DEFAULT_BUDGETS['llm']):
+        super().__init__('llm', k, budget)
+        self.titles = titles
+        self.client = client
+        self.model_name = model_name
+        self.n_recommendations = n_recommendations
+        self.justify = justify
+
+    def score(self, rows, watched_rows, watched_movies):
+        candidate_titles = [self.titles[row] for row in rows]
+        messages, candidate_ids = build_recommendation_messages(watched_movies, candidate_titles,
+                                                                self.n_recommendations, self.justify)
+        response = self.client.chat.completions.create(
+            messages=messages,
+            model=self.model_name,
+            temperature=0.1,
+            top_p=0.1,
+            max_tokens=max_response_tokens(self.n_recommendations, self.justify),
+            response_format={"type": "json_object"},
+            # The request gives up with the stage, instead of holding a worker thread
+            timeout=self.budget,
+        )
+        recommendations = parse_response(response, candidate_ids, watched_movies)
+
+        positions = {}
+        for position, title in enumerate(candidate_titles):
+            positions.setdefault(title, position)
+        scores = np.zeros(len(rows))
+        for recommendation in recommendations:
+            scores[positions[recommendation['title']]] = recommendation['score']
+        return scores
+
+
+class PipelineResult:
+    def __init__(self, titles, rows, scores, stage, reports, k):
+        self.rows = rows
+        self.scores = scores
+        self.stage = stage        # Name of the last completed stage, the one the ranking comes from
+        self.reports = reports    # One dict per stage: status, candidates in/out and elapsed seconds
+        self.recommendations = [{'title': titles[row], 'score': float(score)}
+                                for row, score in zip(rows[:k], scores[:k])]
+
+
+class RecommendationPipeline:
+    # - titles: movie titles, one per catalog row
+    # - stages: the stages, cheapest first. Give the first one no budget, there is no ranking before it.
+    def __init__(self, titles, title_index, stages, max_workers=DEFAULT_MAX_WORKERS):
+        self.titles = np.asarray(titles, dtype=object)
+        self.title_index = title_index
+        self.stages = stages
+        # A stage that missed its budget keeps its thread until it returns, its result is dropped
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pipeline-stage')
+
+    def _run_stage(self, stage, rows, watched_rows, watched_movies):
+        if stage.budget is None:
+            return stage.run(rows, watched_rows, watched_movies)
+        future = self._executor.submit(stage.run, rows, watched_rows, watched_movies)
+        try:
+            return future.result(timeout=stage.budget)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    # Function to get the k best recommendations of a watch history.
+    # on_stage(stage_name, recommendations) is called after each completed stage, with its k best.
+    # Returns a PipelineResult, ranked by the last stage that completed within its budget.
+    def recommend(self, watched_movies, k=5, on_stage=None):
+        watched_rows = np.asarray(lookup_titles(self.title_index, watched_movies), dtype=np.int64)
+        # Exclude the watched movies, and their duplicated titles
+        exclude = np.isin(self.titles, self.titles[watched_rows])
+        rows = np.flatnonzero(~exclude)
+        scores = np.zeros(len(rows))
+        completed = None
+
+        reports = []
+        for i, stage in enumerate(self.stages):
+            start_time = time.perf_counter()
+            try:
+                new_rows, new_scores = self._run_stage(stage, rows, watched_rows, watched_movies)
+                status = OK
+            except FutureTimeoutError:
+                status = TIMEOUT
+            except Exception as e:
+                print(f"Pipeline stage {stage.name} failed: ", e)
+                status = ERROR
+            elapsed = time.perf_counter() - start_time
+            reports.append({'stage': stage.name, 'status': status, 'n_in': len(rows),
+                            'n_out': len(new_rows) if status == OK else 0, 'elapsed': elapsed, 'budget': stage.budget})
+            if status != OK:
+                # Keep the previous ranking, the next stages are more expensive
+                reports.extend({'stage': next_stage.name, 'status': SKIPPED, 'n_in': 0, 'n_out': 0,
+                                'elapsed': 0.0, 'budget': next_stage.budget} for next_stage in self.stages[i + 1:])
+                break
+            rows, scores, completed = new_rows, new_scores, stage.name
+            if on_stage is not None:
+                on_stage(stage.name, PipelineResult(self.titles, rows, scores, completed, reports, k).recommendations)
+
+        return PipelineResult(self.titles, rows, scores, completed, reports, k)
+
+
+# Function to build the default pipeline of a catalog: popularity, TF-IDF content, then optionally
+# embeddings (matrix aligned with the metadata rows, or embed(rows) function) and the LLM re-rank.
+# The content features are the TF-IDF of the soup if the metadata has one (movie_data.py), else of the overviews.
+def build_pipeline(metadata, embeddings=None, llm_client=None, llm_model="gpt-3.5-turbo-1106",
+                   stage_sizes=None, budgets=None, max_workers=DEFAULT_MAX_WORKERS):
+    stage_sizes = {**DEFAULT_STAGE_SIZES, **(stage_sizes or {})}
+    budgets = {**DEFAULT_BUDGETS, **(budgets or {})}
+    if metadata['title'].isna().any():
+        # Stages index the metadata rows, a matrix of embeddings must stay aligned with them
+        raise ValueError("The metadata has movies without title, drop them (and their embeddings) first")
+
+    text = metadata['soup'] if 'soup' in metadata.columns else metadata['overview']
+    item_matrix = TfidfVectorizer(stop_words='english').fit_transform(text.fillna(''))
+    titles = metadata['title'].astype(str).tolist()
+
+    stages = [PopularityStage(popularity_prior(metadata), stage_sizes['popularity'], budgets['popularity']),
+              ContentStage(item_matrix, stage_sizes['content'], budgets['content'])]
+    if embeddings is not None:
+        stages.append(EmbeddingStage(embeddings, stage_sizes['embedding'], budgets['embedding']))
+    if llm_client is not None:
+        stages.append(LLMStage(titles, llm_client, llm_model, k=stage_sizes['llm'], budget=budgets['llm']))
+    return RecommendationPipeline(titles, build_title_index(metadata), stages, max_workers=max_workers)
@@ -0,0 +1,105 @@
+import json
+import re
+
+# Compact prompt format of the LLM recommenders.
+# Candidates are sent as "id|title" lines with short numeric ids, instead of a
+# JSON list of titles, under a short system message. The LLM answers with
+# [id, score] pairs (plus a one-sentence reason if justify=True), which are
+# mapped back to titles and validated on our side. This cuts both the input
+# and the output tokens, and so the latency, of each request.
+# A response cut by max_tokens keeps its complete items; a response without any
+# valid item raises InvalidRecommendationsError, so it is never cached or used
+# as a ranking.
+
+DEFAULT_N_RECOMMENDATIONS = 5
+RESPONSE_OVERHEAD_TOKENS = 48                   # {"r": [...]} and the JSON-mode whitespace around it
+TOKENS_PER_RECOMMENDATION = 16                  # [id, score], often pretty-printed on several lines
+TOKENS_PER_JUSTIFIED_RECOMMENDATION = 80        # [id, score, "reason"]
+
+# A complete [id, score] or [id, score, "reason"] item, to salvage a truncated or malformed response
+ITEM_PATTERN = re.compile(r'\[\s*(-?\d+)\s*,\s*(-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)\s*(?:,\s*("(?:[^"\\]|\\.)*")\s*)?\]')
+
+
+class InvalidRecommendationsError(ValueError):
+    pass
+
+SYSTEM_MSG = """You are a movie recommender system.
+Input: the movies the user watched, and the candidate movies as "id|title" lines.
+Output JSON: {{"r": [{item}, ...]}} with the {n} best candidates for the user, best first, score from 0 to 1.
+Rules: only ids from the candidates; never a watched movie; sequels of watched movies score higher."""
+ITEM_FORMAT = '[id, score]'
+JUSTIFIED_ITEM_FORMAT = '[id, score, "why it matches the user, 1 sentence"]'
+
+# Function to build the chat messages of a recommendation request.
+# Returns (messages, candidate_ids), candidate_ids maps each id to its title.
+def build_recommendation_messages(watched_movies, all_movies, n_recommendations=DEFAULT_N_RECOMMENDATIONS,
+                                  justify=False):
+    candidate_ids = dict(enumerate(all_movies))
+    system_msg = SYSTEM_MSG.format(item=JUSTIFIED_ITEM_FORMAT if justify else ITEM_FORMAT, n=n_recommendations)
+    candidates = "\n".join(f"{movie_id}|{title}" for movie_id, title in candidate_ids.items())
+    user_msg = f"Watched: {json.dumps(list(watched_movies))}\nCandidates:\n{candidates}"
+    messages = [{"role": "system", "content": system_msg},
+                {"role": "user", "content": user_msg}]
+    return messages, candidate_ids
+
+# Function to get the max_tokens of the response, so a runaway answer cannot add latency.
+# It leaves room for a pretty-printed answer, a truncated one loses recommendations.
+def max_response_tokens(n_recommendations=DEFAULT_N_RECOMMENDATIONS, justify=False):
+    per_item = TOKENS_PER_JUSTIFIED_RECOMMENDATION if justify else TOKENS_PER_RECOMMENDATION
+    return RESPONSE_OVERHEAD_TOKENS + n_recommendations * per_item
+
+# Function to get the complete items of a response that is not valid JSON, e.g. cut by max_tokens
+def salvage_items(content):
+    items = []
+    for match in ITEM_PATTERN.finditer(content or ''):
+        item = [match.group(1), match.group(2)]
+        if match.group(3) is not None:
+            try:
+                item.append(json.loads(match.group(3)))
+            except json.JSONDecodeError:
+                pass
+        items.append(item)
+    return items
+
+# Function to parse and validate the LLM response.
+# Unknown ids, duplicates and watched movies are dropped. Returns a list of
+# {'title', 'score'[, 'justification']} dicts ranked by score, best first.
+def parse_recommendations(content, candidate_ids, watched_movies=()):
+    try:
+        items = json.loads(content)['r']
+    except (json.JSONDecodeError, KeyError, TypeError) as e:
+        items = salvage_items(content)
+        print(f"Invalid LLM response, {len(items)} complete items kept: ", e, content)
+
+    watched = set(watched_movies)
+    recommendations, seen = [], set()
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, list) or len(item) < 2:
+            continue
+        try:
+            movie_id, score = int(item[0]), min(1.0, max(0.0, float(item[1])))
+        except (TypeError, ValueError):
+            continue
+        title = candidate_ids.get(movie_id)
+        if title is None or movie_id in seen or title in watched:
+            continue
+        seen.add(movie_id)
+        recommendation = {'title': title, 'score': score}
+        if len(item) > 2:
+            recommendation['justification'] = str(item[2])
+        recommendations.append(recommendation)
+    # Stable sort: ties keep the LLM order
+    return sorted(recommendations, key=lambda recommendation: -recommendation['score'])
+
+# Function to parse the response of a chat completion request, see parse_recommendations.
+# Raises InvalidRecommendationsError if no valid recommendation is left, e.g. the answer was cut by max_tokens
+# before its first item: callers must not cache it, nor rank with it.
+def parse_response(response, candidate_ids, watched_movies=()):
+    choice = response.choices[0]
+    recommendations = parse_recommendations(choice.message.content, candidate_ids, watched_movies)
+    if choice.finish_reason == 'length':
+        print(f"LLM response truncated by max_tokens, {len(recommendations)} recommendations kept")
+    if not recommendations:
+        raise InvalidRecommendationsError(f"No valid recommendation in the LLM response "
+                                          f"(finish_reason={choice.finish_reason})")
+    return recommendations
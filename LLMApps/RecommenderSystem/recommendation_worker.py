@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+
+# Process-wide background worker for the LLM recommendation requests.
+# Streamlit re-runs the app script at each interaction, but imported modules
+# are kept, so the worker lives here and survives the reruns: one asyncio
+# event loop in a daemon thread, and a job queue consumed by a fixed number of
+# workers, which is the concurrency limit of the LLM calls. There is one job
+# per key: a request already queued or running for the same history is reused
+# instead of being sent again. The app submits a job, renders the default
+# recommendations at once, and polls the job status until the results are ready.
+
+DEFAULT_CONCURRENCY = 4            # LLM requests running at the same time
+DEFAULT_JOB_RETENTION = 10 * 60    # seconds a finished job is kept for polling
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+
+class RecommendationJob:
+    def __init__(self, key, fn, args, kwargs):
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.status = PENDING
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.status in (DONE, FAILED)
+
+
+class RecommendationWorker:
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, job_retention=DEFAULT_JOB_RETENTION):
+        self.concurrency = concurrency
+        self.job_retention = job_retention
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        self._queue = None
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name='recommendation-worker', daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue()
+        for _ in range(self.concurrency):
+            self._loop.create_task(self._consume())
+        ready.set()
+        self._loop.run_forever()
+
+    async def _consume(self):
+        while True:
+            job = await self._queue.get()
+            job.status = RUNNING
+            try:
+                if asyncio.iscoroutinefunction(job.fn):
+                    result = await job.fn(*job.args, **job.kwargs)
+                else:
+                    # Blocking functions, e.g. with the sync OpenAI client, run in a thread but still count in the limit
+                    result = await asyncio.to_thread(job.fn, *job.args, **job.kwargs)
+                job.result = result
+                status = DONE
+            except Exception as e:
+                print("Recommendation job failed: ", e)
+                job.error = e
+                status = FAILED
+            # The status is set last, a job seen as done always has its result
+            job.finished = time.time()
+            job.status = status
+            self._queue.task_done()
+
+    # Function to queue fn(*args, **kwargs) under a key. Returns the job, the one in flight if the key already has one.
+    def submit(self, key, fn, *args, **kwargs):
+        with self._lock:
+            self._forget_finished()
+            job = self._jobs.get(key)
+            if job is not None and not job.done:
+                return job
+            job = RecommendationJob(key, fn, args, kwargs)
+            self._jobs[key] = job
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, job)
+        return job
+
+    # Function to get the last job of a key, None if there is none
+    def get_job(self, key):
+        with self._lock:
+            return self._jobs.get(key)
+
+    # Function to count the queued and running jobs
+    def pending_jobs(self):
+        with self._lock:
+            return sum(not job.done for job in self._jobs.values())
+
+    def _forget_finished(self):
+        now = time.time()
+        expired = [key for key, job in self._jobs.items() if job.done and now - job.finished > self.job_retention]
+        for key in expired:
+            del self._jobs[key]
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+# Function to get the worker of the process, created at the first call
+def get_worker(concurrency=DEFAULT_CONCURRENCY):
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = RecommendationWorker(concurrency)
+        return _worker
@@ -0,0 +1,51 @@
+import numpy as np
+import scipy.sparse as sp
+from sklearn.metrics.pairwise import linear_kernel
+from sklearn.preprocessing import normalize
+
+# Top-k similarity kernel for the content-based recommenders.
+# Works directly on the sparse TF-IDF/Count matrices: cosine similarity is the
+# dot product of L2-normalized rows, so a single (sparse) matmul scores a whole
+# batch of user profiles, and np.argpartition picks the top-k per user without
+# sorting the full catalog.
+
+# Function to L2-normalize the rows of a (sparse or dense) feature matrix.
+# TF-IDF rows are already normalized; Count matrices must go through this once.
+def l2_normalize_rows(matrix):
+    return normalize(matrix, norm='l2', axis=1, copy=True)
+
+# Function to get the k best columns of each row of a dense score matrix, best first
+def top_k_per_row(scores, k):
+    n_users, n_items = scores.shape
+    k = min(k, n_items)
+    if k <= 0:
+        return np.empty((n_users, 0), dtype=np.int64), np.empty((n_users, 0), dtype=scores.dtype)
+    if k < n_items:
+        indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        indices = np.tile(np.arange(n_items), (n_users, 1))
+    top_scores = np.take_along_axis(scores, indices, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+# Function to score a batch of user profiles against the catalog and return the top-k movies.
+# - user_profiles: (n_users x n_features) sparse or dense matrix, one row per user
+# - item_matrix: (n_items x n_features) matrix with L2-normalized rows (e.g. TF-IDF)
+# - exclude: optional boolean mask of movies to skip, shape (n_items,) shared by all users,
+#   or (n_users x n_items) per user (e.g. the movies each user already watched)
+# Returns (indices, scores) of shape (n_users x k). Excluded slots have score -inf.
+def top_k_similar(user_profiles, item_matrix, k=5, exclude=None):
+    if not sp.issparse(user_profiles):
+        user_profiles = np.atleast_2d(user_profiles)
+    user_profiles = l2_normalize_rows(user_profiles)
+
+    scores = linear_kernel(user_profiles, item_matrix, dense_output=True)
+    scores = np.asarray(scores, dtype=np.float64)
+
+    if exclude is not None:
+        exclude = np.asarray(exclude, dtype=bool)
+        if exclude.ndim == 1:
+            scores[:, exclude] = -np.inf
+        else:
+            scores[exclude] = -np.inf
+    return top_k_per_row(scores, k)
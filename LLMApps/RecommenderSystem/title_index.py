@@ -0,0 +1,71 @@
+import re
+
+import numpy as np
+
+# Title -> row index for the watched-movie lookups of the user-profile builders.
+# Built once per catalog, so each watched movie is a dict lookup instead of
+# scanning metadata['title']. Keys are case/whitespace folded, and duplicated
+# titles can be disambiguated with the release year, "Heat (1995)", or the
+# movie id, "#949".
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+YEAR_PATTERN = re.compile(r'^(.*?)\s*\((\d{4})\)$')
+
+# Function to normalize a title for lookup: case and whitespace folding
+def normalize_title(title):
+    return WHITESPACE_PATTERN.sub(' ', str(title)).strip().casefold()
+
+# Function to build the title index, mapping each key to the movie row offset in the feature matrix.
+# For duplicated titles the first row wins, the same movie that metadata.loc[...].iloc[0] returned.
+def build_title_index(metadata):
+    titles = metadata['title'].fillna('').astype(str).tolist()
+    if 'release_date' in metadata.columns:
+        years = metadata['release_date'].fillna('').astype(str).str[:4].tolist()
+    else:
+        years = [''] * len(titles)
+    if 'id' in metadata.columns:
+        ids = metadata['id'].astype(str).tolist()
+    else:
+        ids = [''] * len(titles)
+
+    title_index = {}
+    for row, (title, year, movie_id) in enumerate(zip(titles, years, ids)):
+        key = normalize_title(title)
+        if not key:
+            continue
+        title_index.setdefault(key, row)
+        if year.isdigit():
+            title_index.setdefault(f"{key} ({year})", row)
+        if movie_id:
+            title_index.setdefault(f"#{movie_id}", row)
+    return title_index
+
+# Function to find the row of one title, returns None if the movie is not in the catalog
+def lookup_title(title_index, title):
+    key = normalize_title(title)
+    if key in title_index:
+        return title_index[key]
+    # "Heat(1995)" -> "heat (1995)"
+    match = YEAR_PATTERN.match(key)
+    if match:
+        return title_index.get(f"{match.group(1)} ({match.group(2)})")
+    return None
+
+# Function to get the rows of the watched movies, skipping the titles not in the catalog
+def lookup_titles(title_index, titles):
+    rows = [lookup_title(title_index, title) for title in titles]
+    return np.array([row for row in rows if row is not None], dtype=np.int64)
+
+# Function to get the normalized titles of the watched movies found in the catalog, to exclude the search
+# results that carry their title only, e.g. the documents of a vector database of titles
+def watched_titles(title_index, titles, catalog_titles):
+    return {normalize_title(catalog_titles[row]) for row in lookup_titles(title_index, titles)}
+
+# Function to get the mask of the watched movies, to exclude them from the recommendations. Every row with
+# the title of a row the profile was built from is excluded, like in v3, so the duplicated rows of a watched
+# movie are not recommended back, and "the dark knight" or "Heat (1995)" is excluded like "The Dark Knight".
+def watched_mask(title_index, titles, catalog_titles):
+    watched = watched_titles(title_index, titles, catalog_titles)
+    if not watched:
+        return np.zeros(len(catalog_titles), dtype=bool)
+    return np.array([normalize_title(title) in watched for title in catalog_titles], dtype=bool)
@@ -0,0 +1,74 @@
+import numpy as np
+import scipy.sparse as sp
+
+from title_index import lookup_title
+
+# User profiles gathered from the precomputed catalog features.
+# The watched movies were already embedded when the catalog was built, so the
+# user profile is a (weighted) mean of their rows: no embedding call, and no
+# network round trip, at recommendation time.
+
+# Function to get recency weights for a watch history ordered from oldest to newest.
+# The weight halves every half_life movies back in the history. None means equal weights.
+def recency_weights(n_movies, half_life=None):
+    if not half_life:
+        return np.ones(n_movies)
+    age = np.arange(n_movies - 1, -1, -1)
+    return 0.5 ** (age / half_life)
+
+# Function to get the user profile as the weighted mean of the watched movies rows.
+# - ratings: optional list of user ratings, aligned with watched_movies, used as weights
+# - recency_half_life: optional recency decay, see recency_weights
+# Returns (user_profile, status) like the v3 calculate_user_features, status is False if no movie was found.
+def gather_user_profile(watched_movies, title_index, item_matrix, ratings=None, recency_half_life=None):
+    weights = recency_weights(len(watched_movies), recency_half_life)
+    if ratings is not None:
+        weights = weights * np.asarray(ratings, dtype=np.float64)
+
+    rows = [lookup_title(title_index, movie) for movie in watched_movies]
+    found = [i for i, row in enumerate(rows) if row is not None]
+    if len(found) == 0 or weights[found].sum() <= 0:
+        return None, False
+
+    watched_rows = np.array([rows[i] for i in found], dtype=np.int64)
+    weights = weights[found]
+    user_profile = weights @ np.asarray(item_matrix[watched_rows], dtype=np.float64) / weights.sum()
+    return user_profile, True
+
+# Function to get the ratings of a user as an array, None if the user has none: a missing field of a
+# JSONL row is read as NaN by pandas, a Parquet list as a numpy array
+def user_ratings(ratings):
+    if isinstance(ratings, (list, tuple, np.ndarray)):
+        return np.asarray(ratings, dtype=np.float64)
+    return None
+
+# Function to get the watch history weights of many users as one sparse (n_users x n_items) matrix.
+# Each row holds the gather_user_profile weights of a user on its watched movies rows, normalized to sum to 1.
+# Returns (weights, status), status[i] is False if no movie of user i was found (empty row).
+def history_weights(histories, title_index, n_items, ratings=None, recency_half_life=None):
+    users, items, values = [], [], []
+    status = np.zeros(len(histories), dtype=bool)
+    for user, watched_movies in enumerate(histories):
+        weights = recency_weights(len(watched_movies), recency_half_life)
+        user_weights = None if ratings is None else user_ratings(ratings[user])
+        if user_weights is not None:
+            weights = weights * user_weights
+        rows = [lookup_title(title_index, movie) for movie in watched_movies]
+        found = [i for i, row in enumerate(rows) if row is not None]
+        total = weights[found].sum()
+        if len(found) == 0 or total <= 0:
+            continue
+        status[user] = True
+        users.extend([user] * len(found))
+        items.extend(rows[i] for i in found)
+        values.extend(weights[found] / total)
+    weights = sp.csr_matrix((values, (users, items)), shape=(len(histories), n_items), dtype=np.float64)
+    return weights, status
+
+# Function to get the profiles of many users as one (n_users x n_features) matrix, the batch version of
+# gather_user_profile: one sparse matmul instead of a loop. Returns (user_profiles, weights, status),
+# see history_weights. The rows of users with status False are zeros.
+def gather_user_profiles(histories, title_index, item_matrix, ratings=None, recency_half_life=None):
+    weights, status = history_weights(histories, title_index, item_matrix.shape[0], ratings, recency_half_life)
+    user_profiles = np.asarray(weights @ item_matrix, dtype=np.float32)
+    return user_profiles, weights, status
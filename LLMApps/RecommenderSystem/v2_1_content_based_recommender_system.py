@@ -1,6 +1,9 @@
 import pandas as pd
+import numpy as np
+import scipy.sparse as sp
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from similarity import top_k_similar
+from title_index import build_title_index, lookup_titles, watched_mask
 import streamlit as st
 import json
 
@@ -12,26 +15,23 @@ def calculate_movies_features(metadata):
     return tfidf, tfidf_matrix
 
 # Function to calculate user profile features
-def calculate_user_features(watched_movies, metadata, tfidf):
-    watched_overviews = []
-    for movie in watched_movies:
-        if movie in metadata['title'].values:
-            watched_overviews.append(metadata.loc[metadata['title'] == movie, 'overview'].iloc[0])
-    watched_overviews_str = " ".join(watched_overviews)
-    user_profile = tfidf.transform([watched_overviews_str])
+def calculate_user_features(watched_movies, title_index, tfidf_matrix):
+    # Gather the watched movies rows from the precomputed TF-IDF matrix
+    watched_rows = lookup_titles(title_index, watched_movies)
+    user_profile = sp.csr_matrix(tfidf_matrix[watched_rows].sum(axis=0))
     return user_profile
 
 # Function to get recommendations
-def get_recommendations(user_profile, metadata, tfidf_matrix, watched_movies):
-    cosine_sim = cosine_similarity(user_profile, tfidf_matrix)
-    sim_scores = list(enumerate(cosine_sim[0]))
-    sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-
+def get_recommendations(user_profile, metadata, tfidf_matrix, watched_movies, title_index, k=5):
     # Exclude movies already watched
-    movie_indices = [i[0] for i in sim_scores if metadata['title'].iloc[i[0]] not in watched_movies]
+    watched = watched_mask(title_index, watched_movies, metadata['title'].to_numpy())
+
+    # TF-IDF rows are L2-normalized, so the sparse dot product is the cosine similarity
+    movie_indices, scores = top_k_similar(user_profile, tfidf_matrix, k=k, exclude=watched)
+    movie_indices = movie_indices[0][np.isfinite(scores[0])]
 
     # Get top 5 recommendations
-    top_recommendations = metadata['title'].iloc[movie_indices][:5]
+    top_recommendations = metadata['title'].iloc[movie_indices]
     return top_recommendations
 
 def main():
@@ -48,10 +48,12 @@ def main():
             st.session_state.tfidf = tfidf
             st.session_state.tfidf_matrix = tfidf_matrix
             st.session_state.metadata = metadata
+            st.session_state.title_index = build_title_index(metadata)
     else:
         tfidf = st.session_state.tfidf
         tfidf_matrix = st.session_state.tfidf_matrix
         metadata = st.session_state.metadata
+    title_index = st.session_state.title_index
     st.write("Sample movie features:")
     st.write(metadata[['title', 'overview']].head(10))
 
@@ -62,8 +64,8 @@ def main():
     # Calculate user profile and get recommendations
     if st.button("Get Recommendations"):
         with st.spinner("Calculating recommendations..."):
-            user_profile = calculate_user_features(watched_movies, metadata, tfidf)
-            recommendations = get_recommendations(user_profile, metadata, tfidf_matrix, watched_movies)
+            user_profile = calculate_user_features(watched_movies, title_index, tfidf_matrix)
+            recommendations = get_recommendations(user_profile, metadata, tfidf_matrix, watched_movies, title_index)
             st.write("Recommended Movies:")
             st.write(recommendations)
 
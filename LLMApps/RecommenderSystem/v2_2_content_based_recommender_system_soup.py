@@ -1,27 +1,12 @@
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
 from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from ast import literal_eval
+from similarity import top_k_similar
+from title_index import build_title_index, lookup_titles, watched_mask
 import streamlit as st
+from movie_data import load_movie_features
 import json
-# Function to convert all strings to lower case and strip names of spaces
-def normalize_data(x):
-    if isinstance(x, list):
-        return [str.lower(i.replace(" ", "")) for i in x]
-    else:
-        #Check if director exists. If not, return empty string
-        if isinstance(x, str):
-            return str.lower(x.replace(" ", ""))
-        else:
-            return ''
-        
-# Function to parse the stringified features into their corresponding python objects
-
-# Function to create a 'soup' of features
-def create_soup(features):
-    return ' '.join(features['keywords']) + ' ' + ' '.join(features['cast']) + ' ' + features['director'] + ' ' + ' '.join(features['genres'])
-
 # Function to calculate movie features
 def calculate_movie_features(metadata):
     '''
@@ -34,75 +19,27 @@ def calculate_movie_features(metadata):
     return tfidf_matrix, tfidf
 
 # Function to calculate user profile features
-def calculate_user_features(watched_movies, metadata, count):
-    watched_soups = [metadata.loc[metadata['title'] == movie, 'soup'].iloc[0] for movie in watched_movies if movie in metadata['title'].values]
-    watched_soups_str = " ".join(watched_soups)
-    user_profile = count.transform([watched_soups_str])
+def calculate_user_features(watched_movies, title_index, feature_matrix):
+    # Gather the watched movies rows from the precomputed feature matrix
+    watched_rows = lookup_titles(title_index, watched_movies)
+    user_profile = sp.csr_matrix(feature_matrix[watched_rows].sum(axis=0))
     return user_profile
 
 # Function to get recommendations
-def get_recommendations(user_profile, metadata, count_matrix):
-    cosine_sim = cosine_similarity(user_profile, count_matrix)
-    sim_scores = list(enumerate(cosine_sim[0]))
-    sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-    movie_indices = [i[0] for i in sim_scores[1:6]]  # Top 5 movies
+def get_recommendations(user_profile, metadata, count_matrix, watched_movies, title_index, k=5):
+    # Exclude movies already watched
+    watched = watched_mask(title_index, watched_movies, metadata['title'].to_numpy())
+
+    # The rows of the TF-IDF matrix are L2-normalized, so the sparse dot product is the cosine similarity.
+    # Use similarity.l2_normalize_rows once on the matrix if switching to CountVectorizer.
+    movie_indices, scores = top_k_similar(user_profile, count_matrix, k=k, exclude=watched)
+    movie_indices = movie_indices[0][np.isfinite(scores[0])]  # Top k movies
     return metadata['title'].iloc[movie_indices]
 
-# Get the director's name from the crew feature. If director is not listed, return NaN
-def get_director(x):
-    for i in x:
-        if i['job'] == 'Director':
-            return i['name']
-    return np.nan
-
-# Returns the list top 3 elements or entire list; whichever is more.
-def get_list(x):
-    if isinstance(x, list):
-        names = [i['name'] for i in x]
-        #Check if more than 3 elements exist. If yes, return only first three. If no, return entire list.
-        if len(names) > 3:
-            names = names[:3]
-        return names
-
-    #Return empty list in case of missing/malformed data
-    return []
+# Function to load the cleaned movie features (director, top-3 cast, keywords, genres and soup).
+# The CSVs are parsed once in parallel and cached as a Parquet snapshot in the data folder.
 def clean_data():
-    # Load Movies Metadata
-    metadata = pd.read_csv('.\imdb.data\movies_metadata.csv')
-    # Load keywords and credits
-    credits = pd.read_csv('.\imdb.data\credits.csv')
-    keywords = pd.read_csv('.\imdb.data\keywords.csv')
-
-    # Remove rows with bad IDs.
-    metadata = metadata.drop([19730, 29503, 35587])
-
-    # Convert IDs to int. Required for merging
-    keywords['id'] = keywords['id'].astype('int')
-    credits['id'] = credits['id'].astype('int')
-    metadata['id'] = metadata['id'].astype('int')
-
-    # Merge keywords and credits into your main metadata dataframe
-    metadata = metadata.merge(credits, on='id')
-    metadata = metadata.merge(keywords, on='id')
-    features = ['cast', 'crew', 'keywords', 'genres']
-    for feature in features:
-        metadata[feature] = metadata[feature].apply(literal_eval)
-        
-    features = ['cast', 'keywords', 'genres']
-    for feature in features:
-        metadata[feature] = metadata[feature].apply(get_list)
-    
-    # Define new director, cast, genres and keywords features that are in a suitable form.
-    metadata['director'] = metadata['crew'].apply(get_director)
-        
-
-
-    # Apply clean_data function to your features.
-    features = ['cast', 'keywords', 'director', 'genres']
-
-    for feature in features:
-        metadata[feature] = metadata[feature].apply(normalize_data)    
-    return metadata
+    return load_movie_features('.\imdb.data')
 
 def main():
     st.title("Content-Based Movie Recommender System with Additional Features")
@@ -113,12 +50,12 @@ def main():
             st.write(metadata[['title', 'cast', 'director', 'keywords', 'genres']].head(10)) 
 
         with st.spinner("Calculating movie features..."):    
-            # Create a 'soup' of features and calculate movie features
-            metadata['soup'] = metadata.apply(create_soup, axis=1)
+            # The 'soup' of features is part of the snapshot, calculate movie features
             feature_matrix, transform = calculate_movie_features(metadata)
             st.session_state.feature_matrix = feature_matrix
             st.session_state.transform = transform
             st.session_state.metadata = metadata
+            st.session_state.title_index = build_title_index(metadata)
     else:
         feature_matrix = st.session_state.feature_matrix
         transform = st.session_state.transform
@@ -133,8 +70,9 @@ def main():
     # Calculate user profile and get recommendations
     if st.button("Get Recommendations"):
         with st.spinner("Calculating recommendations..."):
-            user_profile = calculate_user_features(watched_movies, metadata, transform)
-            recommendations = get_recommendations(user_profile, metadata, feature_matrix)
+            user_profile = calculate_user_features(watched_movies, st.session_state.title_index, feature_matrix)
+            recommendations = get_recommendations(user_profile, metadata, feature_matrix, watched_movies,
+                                                  st.session_state.title_index)
             st.write("Recommended Movies:")
             st.write(recommendations)
 
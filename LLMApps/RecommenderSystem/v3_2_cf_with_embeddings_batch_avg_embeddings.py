@@ -1,61 +1,47 @@
 import pandas as pd
 import numpy as np
 import streamlit as st
+from popularity import get_simple_recommendations
+from title_index import build_title_index, watched_mask
+from user_profiles import gather_user_profile
 import json
-from openai import OpenAI
+from openai import AsyncOpenAI
 from sklearn.metrics.pairwise import cosine_similarity
 import time
+import os
+import sys
+# The embedding cache is shared by all the apps in LLMApps
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from embedding_cache import get_embedding_cache
+from embedding_pipeline import embed_texts, format_stats
 
-# Function to compute the weighted rating of each movie
-def weighted_rating(x, M, C):
-    v = x['vote_count']
-    R = x['vote_average']
-    return (v/(v+M) * R) + (M/(M+v) * C)
-
-# Function to get the top-5 movie recommendations
-def get_simple_recommendations(metadata):
-    C = metadata['vote_average'].mean()
-    M = metadata['vote_count'].quantile(0.90)
-
-    q_movies = metadata.copy().loc[metadata['vote_count'] >= M]
-    q_movies['score'] = q_movies.apply(weighted_rating, axis=1, args=(M, C))
-    q_movies = q_movies.sort_values('score', ascending=False)
-
-    return q_movies[['title', 'vote_count', 'vote_average', 'score']].head(5)
+# Recency decay of the user profile, in number of movies (None: all watched movies weigh the same)
+RECENCY_HALF_LIFE = None
 
 # Initialize OpenAI client
-client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+async_client = AsyncOpenAI(api_key=st.secrets["OPENAI_API_KEY"])
 
+# Function to embed many texts with concurrent, token-aware batches.
+# Only cache misses are sent to the API. Returns (embeddings, stats).
 def get_embedding(texts, model="text-embedding-ada-002"):
     texts = [text.replace("\n", " ") for text in texts]
-    embeddings = np.array([v.embedding for v in client.embeddings.create(input=texts, model=model).data])
-    return embeddings
-# Function to generate embeddings for movie overviews
+    return embed_texts(texts, async_client, model=model, cache=get_embedding_cache(model))
+
+# Function to generate embeddings for movie overviews, returns (embeddings, stats)
 def calculate_movies_features(metadata):
     metadata['overview'] = metadata['overview'].fillna('Invalid')
     movie_overviews = metadata['overview'].values.tolist()
-    embeddings = get_embedding(movie_overviews)
-    return np.array(embeddings)
-
-# Function to calculate user profile embeddings
-def calculate_user_features(watched_movies, metadata, emb_len):
-    watched_movies_features = []
-    for movie in watched_movies:
-        if movie in metadata['title'].values:
-            feature = metadata.loc[metadata['title'] == movie, 'overview'].iloc[0]
-            watched_movies_features.append(feature)
-    if len(watched_movies_features) == 0:        
-        #user_profile = np.zeros(emb_len)
-        return None, False
-    else:
-        watched_embeddings = get_embedding(watched_movies_features)
-        user_profile = np.mean(watched_embeddings, axis=0)
-    return user_profile, True
+    return get_embedding(movie_overviews)
+
+# Function to calculate user profile embeddings.
+# The watched movies embeddings are gathered from the cached movie_embeddings, so no embedding call is needed.
+def calculate_user_features(watched_movies, movie_embeddings, title_index, ratings=None):
+    return gather_user_profile(watched_movies, title_index, movie_embeddings,
+                               ratings=ratings, recency_half_life=RECENCY_HALF_LIFE)
 
 # Function to get recommendations using cosine similarity
-def get_recommendations(watched_movies, movie_embeddings, metadata):
-    emb_len = movie_embeddings.shape[1]
-    user_profile, status = calculate_user_features(watched_movies, metadata, emb_len)
+def get_recommendations(watched_movies, movie_embeddings, metadata, title_index, ratings=None):
+    user_profile, status = calculate_user_features(watched_movies, movie_embeddings, title_index, ratings)
     if status == False:
         st.write("Cannot find the movie titles entered, falling back to default recommendations")
         return get_simple_recommendations(metadata)
@@ -64,8 +50,10 @@ def get_recommendations(watched_movies, movie_embeddings, metadata):
     sim_scores = list(enumerate(cosine_sim[0]))
     sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
     
-    # Exclude movies already watched
-    movie_indices = [i[0] for i in sim_scores if metadata['title'].iloc[i[0]] not in watched_movies]
+    # Exclude movies already watched, and the duplicated rows of their titles
+    watched = watched_mask(title_index, watched_movies, metadata['title'].to_numpy())
+    sim_scores = [score for score in sim_scores if not watched[score[0]]]
+    movie_indices = [i[0] for i in sim_scores]
 
     # Get top 5 recommendations
     top_recommendations = metadata['title'].iloc[movie_indices][:5]
@@ -92,29 +80,36 @@ def main():
             # Limit for memory purposes
             metadata = metadata[:n_movies]
             st.session_state.metadata = metadata
+            st.session_state.title_index = build_title_index(metadata)
             end_time = time.time()
             time_spent = end_time-start_time
 
             st.write(f"Time to load the data is {time_spent} seconds")
         with st.spinner("Calculating movie embeddings..."):
             start_time = time.time()
-            st.session_state.movie_embeddings = calculate_movies_features(st.session_state.metadata)
+            st.session_state.movie_embeddings, stats = calculate_movies_features(st.session_state.metadata)
             end_time = time.time()
             time_spent = end_time-start_time
             st.write(f"Time to calculate embeddings {time_spent} seconds for {n_movies} movies")
+            st.write(f"Embedding throughput: {format_stats(stats)}")
 
     st.write("Sample metadata:")
     st.write(st.session_state.metadata[['title', 'overview']].head(10))
 
     # User input for watched movies
-    user_history_input = st.text_area("Enter watched movies as a JSON list:", '["Toy Story", "Jumanji"]')
+    user_history_input = st.text_area("Enter watched movies as a JSON list (or a JSON object of movie ratings):", '["Toy Story", "Jumanji"]')
     watched_movies = json.loads(user_history_input)
+    # Optional ratings, e.g. {"Toy Story": 5, "Jumanji": 3}, weigh the movies in the user profile
+    ratings = None
+    if isinstance(watched_movies, dict):
+        ratings = list(watched_movies.values())
+        watched_movies = list(watched_movies.keys())
 
     # Calculate user profile and get recommendations
     if st.button("Get Recommendations"):
         with st.spinner("Calculating recommendations..."):
             start_time = time.time()
-            recommendations = get_recommendations(watched_movies, st.session_state.movie_embeddings, st.session_state.metadata)
+            recommendations = get_recommendations(watched_movies, st.session_state.movie_embeddings, st.session_state.metadata, st.session_state.title_index, ratings)
             end_time = time.time()
             time_spent = end_time-start_time
             st.write(f"Time to get recommendations is {time_spent} seconds")
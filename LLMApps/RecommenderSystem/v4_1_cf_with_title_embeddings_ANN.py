@@ -1,15 +1,26 @@
 import pandas as pd
 import streamlit as st
 from langchain.embeddings import OpenAIEmbeddings
-from langchain.vectorstores import FAISS
 import json
 import time
+import os
+import sys
+# The embedding cache is shared by all the apps in LLMApps
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from embedding_cache import CachedEmbeddings
+from title_index import normalize_title
+from vector_store import load_or_build_vector_database
 
+# FAISS index type of the movie search, see ../ann_index.py and benchmark_ann.py ('flat' for exact search)
+ANN_INDEX_TYPE = 'hnsw'
 
-# Function to generate embeddings for movie overviews and create a FAISS vector database
+
+# Function to generate embeddings for movie titles and create a FAISS vector database.
+# The index is saved on disk and reloaded by the next sessions, it is rebuilt only when the titles change.
 def create_vector_database(metadata, embeddings_model=OpenAIEmbeddings()):
     texts = metadata['title'].tolist()
-    vec_db = FAISS.from_texts(texts, embeddings_model)
+    vec_db = load_or_build_vector_database(texts, embeddings_model, name='movie_titles',
+                                           index_type=ANN_INDEX_TYPE)
     return vec_db
 
 # Function to get recommendations based on user's watch history
@@ -23,8 +34,9 @@ def get_recommendations(watched_movies, vec_db, metadata, k=5):
     for movie, score in relevant_movies_with_scores:
         recommended_movies.append({'title': movie.page_content, 
                                    'score': score}) 
-    # Exclude wathced movies
-    recommended_movies = [movie for movie in recommended_movies if movie['title'] not in watched_movies]
+    # Exclude wathced movies: the watch history is free text, titles are matched case and whitespace folded
+    watched_text = normalize_title(watched_movies)
+    recommended_movies = [movie for movie in recommended_movies if normalize_title(movie['title']) not in watched_text]
             
     recommendations_df = pd.DataFrame(recommended_movies)
 
@@ -36,25 +48,25 @@ def get_recommendations(watched_movies, vec_db, metadata, k=5):
 def main():
     st.title("Collaborative Filtering Movie Recommender System with Embeddings and FAISS")
 
-    n_movies = 1000
     # Initialize embeddings model and create a FAISS vector database
     if 'vec_db' not in st.session_state:
         with st.spinner("Loading movie metadata..."):
             # Load Movies Metadata
-            metadata = pd.read_csv('.\imdb.data\movies_metadata.csv')
-            # Limit for memory purposes
-            metadata = metadata[:n_movies]
+            metadata = pd.read_csv('.\imdb.data\movies_metadata.csv', low_memory=False)
+            # The full catalog is served from the saved index, only movies without a title are skipped
+            metadata = metadata.dropna(subset=['title']).reset_index(drop=True)
             st.session_state.metadata = metadata
             
 
         with st.spinner("Creating vector database for movie embeddings..."):
-            embeddings_model = OpenAIEmbeddings()
+            # Identical texts are embedded once and reused across sessions
+            embeddings_model = CachedEmbeddings(OpenAIEmbeddings())
             start_time = time.time()
             st.session_state.vec_db = create_vector_database(st.session_state.metadata, embeddings_model)
             end_time = time.time()
 
             time_spent = end_time - start_time
-            st.write(f"Time spent to build vector database: {time_spent} seconds for {n_movies} movies")
+            st.write(f"Time spent to load or build vector database: {time_spent} seconds for {len(st.session_state.metadata)} movies")
     
             
     
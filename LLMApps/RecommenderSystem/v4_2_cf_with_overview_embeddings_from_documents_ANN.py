@@ -1,43 +1,34 @@
 import pandas as pd
 import streamlit as st
+from popularity import get_simple_recommendations
+from title_index import build_title_index, lookup_titles, watched_mask
 from langchain.embeddings import OpenAIEmbeddings
-from langchain.vectorstores import FAISS
-from langchain.schema import Document
 import json
 import time
-
-# Function to compute the weighted rating of each movie
-def weighted_rating(x, M, C):
-    v = x['vote_count']
-    R = x['vote_average']
-    return (v/(v+M) * R) + (M/(M+v) * C)
-
-# Function to get the top-5 movie recommendations
-def get_simple_recommendations(metadata):
-    C = metadata['vote_average'].mean()
-    M = metadata['vote_count'].quantile(0.90)
-
-    q_movies = metadata.copy().loc[metadata['vote_count'] >= M]
-    q_movies['score'] = q_movies.apply(weighted_rating, axis=1, args=(M, C))
-    q_movies = q_movies.sort_values('score', ascending=False)
-
-    return q_movies[['title', 'vote_count', 'vote_average', 'score']].head(5)
-
-
-# Function to generate embeddings for movie overviews and create a FAISS vector database
+import os
+import sys
+# The embedding cache is shared by all the apps in LLMApps
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from embedding_cache import CachedEmbeddings
+from vector_store import load_or_build_vector_database
+
+# FAISS index type of the movie search, see ../ann_index.py and benchmark_ann.py ('flat' for exact search)
+ANN_INDEX_TYPE = 'hnsw'
+
+# Function to generate embeddings for movie overviews and create a FAISS vector database.
+# The index is saved on disk and reloaded by the next sessions, it is rebuilt only when the overviews change.
 def create_vector_database(metadata, embeddings_model):
     metadata['overview'] = metadata['overview'].fillna('')
-    # Here we must add the movie title and and any extra info in the metadata field of the Document.
-    # That's why we use from_documents instead of from_texts
-    docs = [Document(page_content=overview, metadata=dict(index=i)) for i,overview in enumerate(metadata['overview'])]
-    vec_db = FAISS.from_documents(docs, embeddings_model)
+    # Here we must add the movie row index and any extra info in the metadata field of the Documents
+    metadatas = [dict(index=i) for i in range(len(metadata))]
+    vec_db = load_or_build_vector_database(metadata['overview'].tolist(), embeddings_model,
+                                           metadatas=metadatas, name='movie_overviews',
+                                           index_type=ANN_INDEX_TYPE)
     return vec_db
 
-def calculate_user_features(watched_movies, metadata):
-    watched_overviews = []
-    for movie in watched_movies:
-        if movie in metadata['title'].values:
-            watched_overviews.append(metadata.loc[metadata['title'] == movie, 'overview'].iloc[0])
+def calculate_user_features(watched_movies, metadata, title_index):
+    watched_rows = lookup_titles(title_index, watched_movies)
+    watched_overviews = metadata['overview'].to_numpy()[watched_rows].tolist()
     if len(watched_overviews) == 0:        
         return None, False
     else:
@@ -46,9 +37,9 @@ def calculate_user_features(watched_movies, metadata):
         return watched_overviews_str, True
 
 # Function to get recommendations based on user's watch history
-def get_recommendations(watched_movies, vec_db, metadata, k=5):
+def get_recommendations(watched_movies, vec_db, metadata, title_index, k=5):
     # Transform user's watch history into a single text of movie overviews:
-    user_features, status = calculate_user_features(watched_movies, st.session_state.metadata)
+    user_features, status = calculate_user_features(watched_movies, metadata, title_index)
     # The movie title the user watched might not be in the metadata, 
     # if this is the case, we fall back to the default recommendations
     if status == False:
@@ -61,11 +52,13 @@ def get_recommendations(watched_movies, vec_db, metadata, k=5):
     # Retrieve movie titles and scores
     recommended_movies = []
     for movie, score in relevant_movies_with_scores:
-        recommended_movies.append({'title':metadata['title'].iloc[movie.metadata['index']], 
+        recommended_movies.append({'index': movie.metadata['index'],
+                                'title':metadata['title'].iloc[movie.metadata['index']], 
                                 'overview': movie.page_content, 
                                 'score': score}) 
-    # Exclude wathced movies
-    recommended_movies = [movie for movie in recommended_movies if movie['title'] not in watched_movies]
+    # Exclude wathced movies, and the duplicated rows of their titles
+    watched = watched_mask(title_index, watched_movies, metadata['title'].to_numpy())
+    recommended_movies = [movie for movie in recommended_movies if not watched[movie['index']]]
             
     recommendations_df = pd.DataFrame(recommended_movies)
 
@@ -80,24 +73,23 @@ def main():
 
     # Initialize embeddings model and create a FAISS vector database
     if 'vec_db' not in st.session_state:
-        n_movies = 10000
         with st.spinner("Loading movie metadata..."):
             # Load Movies Metadata
-            metadata = pd.read_csv('.\imdb.data\movies_metadata.csv')
-            # Limit for memory purposes
-            #metadata = metadata[:n_movies]
+            metadata = pd.read_csv('.\imdb.data\movies_metadata.csv', low_memory=False)
             st.session_state.metadata = metadata
+            st.session_state.title_index = build_title_index(metadata)
             
 
         with st.spinner("Creating vector database for movie embeddings..."):
-            embeddings_model = OpenAIEmbeddings()
+            # Identical texts are embedded once and reused across sessions
+            embeddings_model = CachedEmbeddings(OpenAIEmbeddings())
 
             start_time = time.time()
             st.session_state.vec_db = create_vector_database(st.session_state.metadata, embeddings_model)
             end_time = time.time()
 
             time_spent = end_time - start_time
-            st.write(f"Time spent to build vector database: {time_spent} seconds for {n_movies} movies")
+            st.write(f"Time spent to load or build vector database: {time_spent} seconds for {len(st.session_state.metadata)} movies")
     
     st.write("Sample metadata:")
     st.write(st.session_state.metadata[['title', 'overview']].head())
@@ -112,7 +104,8 @@ def main():
             start_time = time.time()
             recommended_movies = get_recommendations(user_watched_movies, 
                                                      st.session_state.vec_db, 
-                                                     st.session_state.metadata)
+                                                     st.session_state.metadata,
+                                                     st.session_state.title_index)
             end_time = time.time()
             time_spent = end_time - start_time
             st.write(f"Time taken to obtain recommendations is {time_spent} seconds")
@@ -1,174 +1,115 @@
 import pandas as pd
 import streamlit as st
-from openai import OpenAI, AsyncOpenAI
+from popularity_index import load_popularity_index, get_popular_movies
+from candidates import build_candidate_retriever
+from recommendation_cache import RecommendationCache, recommendation_key, FRESH
+from recommendation_worker import get_worker, DONE, FAILED
+from openai import AsyncOpenAI
+from recommendation_prompt import build_recommendation_messages, max_response_tokens, parse_response
 import asyncio
+import time
 
 import json
-import os
-import datetime
 
 RECOMMENDATIONS_LIFETIME = 2  # minutes
-RECOMMENDATIONS_FILE = 'recommendations.txt'
+RECOMMENDATIONS_CACHE_DIR = 'recommendations_cache'
+LLM_MODEL = "gpt-3.5-turbo-1106"  # gpt-4-1106-preview and gpt-3.5-turbo-1106
+RECOMMENDATIONS_POLL_INTERVAL = 0.5  # seconds
+RECOMMENDATIONS_POLL_TIMEOUT = 60  # seconds, the page stops waiting, the job still fills the cache
+
+# Per-user recommendations, shared by all the sessions
+recommendations_cache = RecommendationCache(RECOMMENDATIONS_CACHE_DIR, ttl=RECOMMENDATIONS_LIFETIME * 60)
+# Background worker of the process, it survives the Streamlit reruns
+recommendation_worker = get_worker()
 
 # Initialize OpenAI client
 client = AsyncOpenAI(api_key=st.secrets["OPENAI_API_KEY"])
 
-# Function to compute the weighted rating of each movie
-def weighted_rating(x, M, C):
-    v = x['vote_count']
-    R = x['vote_average']
-    return (v/(v+M) * R) + (M/(M+v) * C)
-
-# Function to get the top-5 movie recommendations
-def get_simple_recommendations(metadata, k=1000):
-    C = metadata['vote_average'].mean()
-    M = metadata['vote_count'].quantile(0.90)
-
-    q_movies = metadata.copy().loc[metadata['vote_count'] >= M]
-    q_movies['score'] = q_movies.apply(weighted_rating, axis=1, args=(M, C))
-    q_movies = q_movies.sort_values('score', ascending=False)
-
-    return q_movies[['title', 'vote_count', 'vote_average', 'score']].head(k)
-
-
-
-async def get_llm_recommendations(watched_movies, all_movies, model_name="gpt-3.5-turbo-1106"):#gpt-4-1106-preview and gpt-3.5-turbo-1106
-    input_json = {
-        'user_watched_movies': watched_movies,
-        'all_movies': all_movies
-    }
-    print("Input to LLM: ", input_json)
-    system_msg = """
-       #Task:
-        Act as a movie recommender system.I will give you a json like that:
-        # Input:
-        {
-            'user_watched_movies': list of strings representing all the movies the user has watched,
-            'all_movies': list of strings representing all the movies available in the database from which we can recommend movies,
-        }
-
-        # Output:
-        I want you to return to me a json like that: 
-        {
-                'recommended_movies':[
-                    list of json objects, each object represents a recommended movie including the following fields:
-                    {   
-                        'title': string representing the title of the recommended movie,
-                        'score': string representing the score of the recommended movie, from 0 to 1, ranked based on relevance to the user,
-                        'justification': string representing the reason provided by the LLM why this movie matches the user. It will help debugging and improve the prompt. limit your justification of why you picked this movie to 2 sentences maximum,
-                    },
-                ]
-            }
-        # Example Input:
-        {
-            'user_watched_movies':['Movie X', 'Movie Y'],
-            'all_movies':['Movie 1', ..., 'Movie N'],
-        }
-
-        # Example Output:
-        I want you to return to me a json like that: 
-        {
-                'recommended_movies':[
-                    {
-                    'title': 'Movie Z',
-                    'score': '0.8',
-                    'justification': 'Reason provided by the LLM why this movie matches the user. It will help debugging and improve the prompt',
-                    },
-                    {
-                    'title': 'Movie P',
-                    'score': '0.6',
-                    'justification': 'Reason provided by the LLM why this movie matches the user. It will help debugging and improve the prompt',
-
-                    }
-                ]
-            }
-
-        #RULES:
-        - Be specific with your recommendations. 
-        - If the user is already watched a movie, don't recommend it, or give it score = 0
-        - Pick recommendations only from the given set of all available movies 'all_movies'.
-        - Movies that are sequels to movies the user has watched should be recommended with a higher score than other movies.
-        - Provide your answer in json format only with no extra unformatted text so that I can parse it in code. 
-        - Do not enclose your answer in ```json quotes
-        """
+async def get_llm_recommendations(watched_movies, all_movies, model_name=LLM_MODEL, justify=False):
+    messages, candidate_ids = build_recommendation_messages(watched_movies, all_movies, justify=justify)
+    print("Input to LLM: ", messages[1]['content'])
 
     response = await client.chat.completions.create(
-        messages=[{"role": "system", "content": system_msg},
-                  {"role": "user", "content": json.dumps(input_json)}],
+        messages=messages,
         model=model_name,
         temperature=0.1,
         top_p=0.1,
+        max_tokens=max_response_tokens(justify=justify),
         #Compatible with gpt-4-1106-preview and gpt-3.5-turbo-1106.
         response_format={"type": "json_object"},
     )
-    print("******", response)
-    recommendations = json.loads(response.choices[0].message.content)['recommended_movies']
+
+    # Ids are mapped back to titles, unknown ids and watched movies are dropped, ranked by score
+    recommendations = parse_response(response, candidate_ids, watched_movies)
     print("Recommendations from LLM: ", recommendations)
-    # Exclude wathced movies
-    recommendations = [movie for movie in recommendations if movie['title'] not in watched_movies]
-    
-    # Exclude movies with score < 0.5   
-    recommendations = [rec for rec in recommendations if float(rec['score']) > 0.5]   
-            
-    recommendations_df = pd.DataFrame(recommendations)
-
-    # Rank recommendations by score descendingly
-    recommendations_df = recommendations_df.sort_values(by='score', ascending=False)
-  
-    with open(RECOMMENDATIONS_FILE, 'w') as f:
-        json.dump(recommendations_df.to_json(orient='records'), f)
-
-# Check if recommendations are old and need to be updated
-def recommendations_need_update():
-    if not os.path.exists(RECOMMENDATIONS_FILE):
-        return True
-    last_modified = datetime.datetime.fromtimestamp(os.path.getmtime(RECOMMENDATIONS_FILE))
-    return (datetime.datetime.now() - last_modified).total_seconds() > RECOMMENDATIONS_LIFETIME * 60
-
-# Offline process to update recommendations
-def update_recommendations_process(watched_movies, all_movies):
-    recommendations = get_llm_recommendations(watched_movies, all_movies)
-    print("*******", recommendations)
-    with open(RECOMMENDATIONS_FILE, 'w') as f:
-        json.dump(recommendations, f)
-
-# Read recommendations from file
-def get_cached_recommendations():
-    if os.path.exists(RECOMMENDATIONS_FILE):
-        with open(RECOMMENDATIONS_FILE, 'r') as f:
-            return json.load(f)
-    return None
+
+    # Exclude movies with score < 0.5
+    recommendations = [rec for rec in recommendations if rec['score'] > 0.5]
+
+    return recommendations
+
+# Offline process to update the recommendations of a user, run in the event loop of the background worker.
+# An LLM response without any valid recommendation raises: the job fails and nothing is cached.
+async def update_recommendations_process(key, watched_movies, all_movies, justify=False):
+    recommendations = await get_llm_recommendations(watched_movies, all_movies, justify=justify)
+    recommendations_cache.put(key, recommendations)
+    return recommendations
+
+# Function to show recommendations in the page placeholder, replacing what it showed
+def display_recommendations(placeholder, title, recommendations, message=None):
+    with placeholder.container():
+        if message:
+            st.write(message)
+        st.write(title)
+        st.write(recommendations)
 
 async def main():
     st.title("LLM-based Movie Recommender System")
 
-    metadata = pd.read_csv('.\imdb.data\movies_metadata.csv')
-    default_recommendations = get_simple_recommendations(metadata, k=1000)
-    all_movies = default_recommendations['title'].tolist()
+    # Load the precomputed popularity index, it is rebuilt only if the CSV changed
+    if 'popularity_index' not in st.session_state:
+        st.session_state.popularity_index, _ = load_popularity_index('.\imdb.data\movies_metadata.csv')
+    default_recommendations = get_popular_movies(st.session_state.popularity_index, k=5)
+
+    # Build the candidate retriever once per session, from the catalog overviews and popularity
+    if 'candidate_retriever' not in st.session_state:
+        with st.spinner("Indexing the movie catalog..."):
+            metadata = pd.read_csv('.\imdb.data\movies_metadata.csv', low_memory=False)
+            st.session_state.candidate_retriever = build_candidate_retriever(metadata)
 
     user_history_input = st.text_area("Enter watched movies as a JSON list:", '["The Dark Knight", "Inception"]')
     watched_movies = json.loads(user_history_input)
+    # Only the movies most relevant to the history, merged with the most popular ones, go in the prompt
+    all_movies = st.session_state.candidate_retriever.get_candidates(watched_movies)
+
+    # Without justifications the LLM answers only ids and scores, much faster
+    justify = st.checkbox("Explain the recommendations (slower)")
 
     if st.button("Get Recommendations"):
-        if recommendations_need_update():
-            # Trigger the offline process
-            task = asyncio.create_task(get_llm_recommendations(watched_movies, all_movies))
-            st.write("Fetching new recommendations...")
-            #Delete old recommendations
-            if os.path.exists(RECOMMENDATIONS_FILE):
-                os.remove(RECOMMENDATIONS_FILE)
-            st.write("Default Recommended Movies:")
-            st.write(default_recommendations[:5])
-            await task
+        key = recommendation_key(watched_movies, LLM_MODEL, all_movies, justify)
+        cached_recommendations, status = recommendations_cache.get(key)
+        job = None
+        if status != FRESH:
+            # Queue the refresh, a request already in flight for the same history is reused
+            job = recommendation_worker.submit(key, update_recommendations_process, key, watched_movies, all_movies, justify)
+
+        # Render at once: cached recommendations, even stale, else the default ones
+        placeholder = st.empty()
+        message = "Fetching new recommendations..." if job is not None else None
+        if cached_recommendations is not None:
+            display_recommendations(placeholder, "Cached LLM Recommended Movies:", pd.DataFrame(cached_recommendations), message)
         else:
-            # Display cached recommendations
-            cached_recommendations = get_cached_recommendations()
-            if cached_recommendations:
-                st.write("Cached LLM Recommended Movies:")
-                st.write(pd.DataFrame(json.loads(cached_recommendations)))
-            else:
-                st.write("Default Recommended Movies:")
-                st.write(default_recommendations[:5])
+            display_recommendations(placeholder, "Default Recommended Movies:", default_recommendations[:5], message)
+
+        # Poll the job, the LLM recommendations replace the rendered ones when ready
+        start_time = time.time()
+        while job is not None and not job.done and time.time() - start_time < RECOMMENDATIONS_POLL_TIMEOUT:
+            await asyncio.sleep(RECOMMENDATIONS_POLL_INTERVAL)
+        if job is not None and job.status == DONE:
+            display_recommendations(placeholder, "LLM Recommended Movies:", pd.DataFrame(job.result))
+            st.write(f"LLM recommendations ready in {job.finished - job.submitted:.1f} seconds")
+        elif job is not None and job.status == FAILED:
+            st.write("Could not get LLM recommendations: ", str(job.error))
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,60 @@
+import pandas as pd
+import streamlit as st
+from movie_data import load_movie_features
+from recommendation_pipeline import build_pipeline
+from openai import OpenAI, AsyncOpenAI
+import json
+import time
+import os
+import sys
+# The embedding cache is shared by all the apps in LLMApps
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from embedding_cache import get_embedding_cache
+from embedding_pipeline import embed_texts
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+LLM_MODEL = "gpt-3.5-turbo-1106"  # gpt-4-1106-preview and gpt-3.5-turbo-1106
+
+# Initialize OpenAI client
+client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+
+# Function to embed the overviews of some catalog rows. Only the candidates of the embedding stage are
+# embedded, and only the cache misses are sent to the API.
+def embed_movies(overviews, rows):
+    texts = [overviews[row].replace("\n", " ") or 'Invalid' for row in rows]
+    # A new async client for each asyncio.run of the embedding pipeline
+    async_client = AsyncOpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+    embeddings, _ = embed_texts(texts, async_client, model=EMBEDDING_MODEL, cache=get_embedding_cache(EMBEDDING_MODEL))
+    return embeddings
+
+def main():
+    st.title("Hybrid Multi-Stage Movie Recommender System")
+
+    # Build the pipeline once per session: popularity -> content (soup TF-IDF) -> embeddings -> LLM re-rank
+    if 'pipeline' not in st.session_state:
+        with st.spinner("Indexing the movie catalog..."):
+            metadata = load_movie_features('.\imdb.data')
+            metadata = metadata[metadata['title'] != ''].reset_index(drop=True)
+            overviews = metadata['overview'].tolist()
+            st.session_state.pipeline = build_pipeline(metadata, embeddings=lambda rows: embed_movies(overviews, rows),
+                                                       llm_client=client, llm_model=LLM_MODEL)
+
+    user_history_input = st.text_area("Enter watched movies as a JSON list:", '["The Dark Knight", "Inception"]')
+    watched_movies = json.loads(user_history_input)
+
+    if st.button("Get Recommendations"):
+        # Each stage replaces the ranking of the previous one as soon as it completes
+        placeholder = st.empty()
+        start_time = time.time()
+
+        def show_stage(stage_name, recommendations):
+            with placeholder.container():
+                st.write(f"Recommended Movies after the {stage_name} stage ({time.time() - start_time:.2f} seconds):")
+                st.write(pd.DataFrame(recommendations))
+
+        result = st.session_state.pipeline.recommend(watched_movies, k=5, on_stage=show_stage)
+        st.write(f"Final ranking from the {result.stage} stage")
+        st.write(pd.DataFrame(result.reports))
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,6 @@
 import os
 import openai
 import streamlit as st
-from langchain.vectorstores import FAISS
 from langchain.embeddings import OpenAIEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.document_loaders import YoutubeLoader
@@ -10,6 +9,11 @@ from langchain.document_loaders import YoutubeLoader
 client = openai.OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
 
 from langchain.document_loaders import YoutubeLoader
+import sys
+# The embedding cache is shared by all the apps in LLMApps
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from embedding_cache import CachedEmbeddings
+from vector_store import load_or_build_vector_database
 def extract_text_from_youtube_url(url):    
     loader = YoutubeLoader.from_youtube_url(url)
     transcript = loader.load()
@@ -18,7 +22,8 @@ def extract_text_from_youtube_url(url):
     return raw_text
 
 def generate_embeddings():
-    embeddings_model = OpenAIEmbeddings(chunk_size=1000)
+    # Identical chunks are embedded once and reused across sessions
+    embeddings_model = CachedEmbeddings(OpenAIEmbeddings(chunk_size=1000))
     return embeddings_model
 
 def create_vector_database(raw_text):
@@ -28,7 +33,8 @@ def create_vector_database(raw_text):
     )
     texts = text_splitter.split_text(raw_text)
 
-    vec_db = FAISS.from_texts(texts, generate_embeddings())
+    # Saved on disk, a document already indexed is reloaded instead of rebuilt
+    vec_db = load_or_build_vector_database(texts, generate_embeddings(), name='youtube_assistant', keep_old_versions=True)
     return vec_db
 
 
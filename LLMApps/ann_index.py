@@ -0,0 +1,90 @@
+import math
+
+import faiss
+import numpy as np
+
+# Configurable FAISS index types for the vector stores.
+# LangChain builds an exact (flat) index, where every query scans all the
+# vectors: 6 KB per 1536-d float32 vector. The other types trade some recall
+# for faster queries (IVF, HNSW) and/or less memory (PQ, scalar quantization).
+# See RecommenderSystem/benchmark_ann.py for recall@k, latency and memory.
+#
+# index_type is one of INDEX_TYPES, or any faiss.index_factory string, e.g. "IVF256,SQ8".
+
+INDEX_TYPES = {
+    'flat': "exact search, float32",
+    'ivf_flat': "inverted lists over k-means cells, float32",
+    'ivf_pq': "inverted lists with product-quantized codes, 16 dimensions per byte",
+    'hnsw': "HNSW graph, float32",
+    'sq_fp16': "exact search, float16 scalar quantization",
+    'sq_int8': "exact search, int8 scalar quantization",
+}
+HNSW_M = 32                 # Graph links per vector
+DEFAULT_NPROBE = 16         # IVF cells visited per query
+DEFAULT_EF_SEARCH = 64      # HNSW candidate list size per query
+MIN_POINTS_PER_CELL = 39    # faiss k-means needs at least 39 training points per centroid
+PQ_CENTROIDS = 256          # 8-bit PQ codes
+
+# Function to get the number of IVF cells, ~4 sqrt(n), with enough training points per cell
+def default_nlist(n_vectors):
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // MIN_POINTS_PER_CELL))
+
+# Function to get the number of PQ sub-quantizers: ~16 dimensions each, dim must be a multiple
+def pq_subquantizers(dim):
+    m = max(1, dim // 16)
+    while dim % m != 0:
+        m -= 1
+    return m
+
+# Function to get the faiss.index_factory string of an index type
+def index_factory_string(index_type, dim, n_vectors):
+    if index_type == 'flat':
+        return "Flat"
+    if index_type == 'ivf_flat':
+        return f"IVF{default_nlist(n_vectors)},Flat"
+    if index_type == 'ivf_pq':
+        return f"IVF{default_nlist(n_vectors)},PQ{pq_subquantizers(dim)}x8"
+    if index_type == 'hnsw':
+        return f"HNSW{HNSW_M},Flat"
+    if index_type == 'sq_fp16':
+        return "SQfp16"
+    if index_type == 'sq_int8':
+        return "SQ8"
+    return index_type
+
+# Function to check there are enough vectors to train the index, small collections (e.g. one PDF) stay flat
+def can_train(index_type, n_vectors):
+    if index_type == 'ivf_flat':
+        return default_nlist(n_vectors) > 1
+    if index_type == 'ivf_pq':
+        return n_vectors >= PQ_CENTROIDS * MIN_POINTS_PER_CELL
+    return True
+
+# Function to set the query-time parameters: IVF cells visited, and HNSW candidate list size
+def set_search_params(index, nprobe=DEFAULT_NPROBE, ef_search=DEFAULT_EF_SEARCH):
+    try:
+        ivf = faiss.extract_index_ivf(index)
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    except RuntimeError:
+        pass
+    hnsw = getattr(faiss.downcast_index(index), 'hnsw', None)
+    if hnsw is not None:
+        hnsw.efSearch = ef_search
+
+# Function to build an index of the given type, rows keep their order (row i has id i)
+def build_index(vectors, index_type='flat', nprobe=DEFAULT_NPROBE, ef_search=DEFAULT_EF_SEARCH):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n_vectors, dim = vectors.shape
+    if not can_train(index_type, n_vectors):
+        print(f"Only {n_vectors} vectors to train a {index_type} index, using a flat index")
+        index_type = 'flat'
+    index = faiss.index_factory(dim, index_factory_string(index_type, dim, n_vectors))
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    set_search_params(index, nprobe, ef_search)
+    return index
+
+# Function to get the memory used by an index, its serialized size
+def index_memory_bytes(index):
+    return faiss.serialize_index(index).nbytes
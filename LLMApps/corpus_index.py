@@ -0,0 +1,181 @@
+import threading
+
+from document_store import get_document_store, settings_key
+from embedding_cache import CachedEmbeddings
+from lexical_index import DEFAULT_EMBED_TIMEOUT, HYBRID, hybrid_rank
+from pdf_ingestion import (DEFAULT_CHUNK_OVERLAP, DEFAULT_CHUNK_SIZE, LiveVectorIndex, PdfIngestion,
+                           start_ingestion)
+from vector_store import embeddings_model_name
+
+# Corpus-level RAG index over many documents, PDFs and YouTube transcripts.
+# Each document is its own namespace: a FAISS index of its chunks, in the
+# document store (document_store.py), memory-mapped on its first search. So:
+# - a search filtered on some documents only searches their indexes, the others
+#   are not scanned, nor even loaded
+# - adding a document indexes only its chunks, it is searchable while it is being
+#   indexed; removing one drops its namespace, nothing is rebuilt
+# - all the namespaces share the embeddings model, the distances of their results
+#   are comparable and merged into one top k
+# The results carry the metadata of their chunk (page, or video timestamp) and
+# of their document (doc_id, name, kind).
+# search also ranks the chunks by their terms, with the BM25 index of each document
+# (lexical_index.py). The BM25 scores of two documents use their own term statistics,
+# they are merged by score as an approximation, then fused with the vector ranking.
+
+
+class CorpusIndex:
+    # - embeddings_model: LangChain embeddings model, the same for all the documents
+    # - store: DocumentStore of the documents, the shared one by default
+    # - chunk_size, chunk_overlap: chunking of the documents, the store keeps an index per chunking
+    def __init__(self, embeddings_model, store=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 chunk_overlap=DEFAULT_CHUNK_OVERLAP):
+        if not isinstance(embeddings_model, CachedEmbeddings):
+            embeddings_model = CachedEmbeddings(embeddings_model)
+        self.embeddings_model = embeddings_model
+        self.store = store or get_document_store()
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.settings = settings_key(embeddings_model_name(embeddings_model), chunk_size, chunk_overlap)
+        # doc_id -> {'name', 'kind', 'index': LiveVectorIndex, None until loaded, 'ingestion'}
+        self._documents = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._documents
+
+    # Function to add the documents of the store indexed with the same settings, e.g. by other sessions.
+    # Their indexes are loaded on their first search.
+    def refresh(self):
+        with self._lock:
+            for doc_id, document in self.store.list_documents():
+                if doc_id not in self._documents and self.store.has_index(doc_id, self.settings):
+                    self._documents[doc_id] = {'name': document.get('name'), 'kind': document.get('kind'),
+                                               'index': None, 'ingestion': None}
+        return self
+
+    # Function to list the documents, [(doc_id, name, kind)]
+    def documents(self):
+        with self._lock:
+            return [(doc_id, entry['name'], entry['kind']) for doc_id, entry in self._documents.items()]
+
+    # Function to add a document from its ingestion (PdfIngestion, TranscriptIngestion), started here.
+    # Returns the started ingestion, the document is searchable while it is indexed.
+    def add(self, ingestion):
+        ingestion = start_ingestion(ingestion)
+        with self._lock:
+            self._documents[ingestion.doc_key] = {'name': ingestion.name, 'kind': ingestion.KIND,
+                                                  'index': ingestion.index, 'ingestion': ingestion}
+        return ingestion
+
+    # Function to add a PDF, e.g. add_pdf(uploaded_file.getvalue(), uploaded_file.name). Returns its ingestion.
+    def add_pdf(self, pdf_bytes, name=None, **kwargs):
+        return self.add(PdfIngestion(pdf_bytes, self.embeddings_model, name=name, chunk_size=self.chunk_size,
+                                     chunk_overlap=self.chunk_overlap, store=self.store, **kwargs))
+
+    # Function to add the transcript of a YouTube video. Returns its ingestion.
+    def add_youtube(self, url, **kwargs):
+        # youtube_transcript_api is only needed for the videos
+        from transcript_ingestion import TranscriptIngestion, load_transcript
+        return self.add(TranscriptIngestion(load_transcript(url), self.embeddings_model, name=url,
+                                            chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap,
+                                            store=self.store, **kwargs))
+
+    # Function to remove a document from the corpus, and from the store if delete.
+    # Its ingestion, if still running, is cancelled first so it does not save the document again.
+    def remove(self, doc_id, delete=False):
+        with self._lock:
+            entry = self._documents.pop(doc_id, None)
+        if entry is not None and entry['ingestion'] is not None:
+            entry['ingestion'].cancel()
+        if delete:
+            self.store.remove_document(doc_id)
+
+    # Function to get the ingestions of the documents still being indexed
+    def ingestions(self):
+        with self._lock:
+            return [entry['ingestion'] for entry in self._documents.values()
+                    if entry['ingestion'] is not None and not entry['ingestion'].done]
+
+    # Function to get the index of a document, loaded memory-mapped from the store on first use
+    def _index(self, doc_id):
+        with self._lock:
+            entry = self._documents.get(doc_id)
+            if entry is None:
+                return None
+            if entry['index'] is None:
+                vec_db = self.store.load_index(doc_id, self.settings, self.embeddings_model)
+                entry['index'] = LiveVectorIndex(self.embeddings_model, vec_db,
+                                                 self.store.load_lexical(doc_id, self.settings))
+            return entry['index']
+
+    # Function to get the documents to search, {doc_id: (name, kind)}: the corpus, or only the documents doc_ids
+    def _selection(self, doc_ids):
+        with self._lock:
+            doc_ids = list(self._documents) if doc_ids is None else [d for d in doc_ids if d in self._documents]
+            return {doc_id: (self._documents[doc_id]['name'], self._documents[doc_id]['kind'])
+                    for doc_id in doc_ids}
+
+    # Function to add the document fields to the metadata of its chunks
+    def _with_document(self, doc_id, doc, names):
+        name, kind = names[doc_id]
+        return type(doc)(page_content=doc.page_content,
+                         metadata={**doc.metadata, 'doc_id': doc_id, 'name': name, 'kind': kind})
+
+    # Function to search the chunks of the corpus, or only of the documents doc_ids.
+    # Returns the k nearest chunks as LangChain documents, with doc_id, name and kind in their metadata.
+    def similarity_search(self, query, k=4, doc_ids=None):
+        names = self._selection(doc_ids)
+        if not names:
+            return []
+
+        vector = self.embeddings_model.embed_query(query)
+        results = []
+        for doc_id in names:
+            index = self._index(doc_id)
+            if index is None:
+                continue
+            results.extend((distance, doc_id, doc) for doc, distance in
+                           index.similarity_search_with_score_by_vector(vector, k=k))
+        results.sort(key=lambda result: result[0])
+        return [self._with_document(doc_id, doc, names) for _, doc_id, doc in results[:k]]
+
+    # Function to search the chunks of the corpus, or only of the documents doc_ids, by mode: 'lexical',
+    # 'vector' or 'hybrid', see LiveVectorIndex.search. Returns the k best chunks, like similarity_search.
+    def search(self, query, k=4, doc_ids=None, mode=HYBRID, embed_timeout=DEFAULT_EMBED_TIMEOUT):
+        names = self._selection(doc_ids)
+        indexes = {doc_id: self._index(doc_id) for doc_id in names}
+        indexes = {doc_id: index for doc_id, index in indexes.items() if index is not None and len(index)}
+        if not indexes:
+            return []
+
+        # Items are (doc_id, row) in the indexes of the documents
+        def lexical_search(query, n):
+            results = [(score, doc_id, row) for doc_id, index in indexes.items()
+                       for row, score in index.lexical_search_rows(query, n)]
+            results.sort(key=lambda result: -result[0])
+            return [(doc_id, row) for _, doc_id, row in results[:n]]
+
+        def vector_search(vector, n):
+            results = [(distance, doc_id, row) for doc_id, index in indexes.items()
+                       for row, distance in index.vector_search_rows(vector, n)]
+            results.sort(key=lambda result: result[0])
+            return [(doc_id, row) for _, doc_id, row in results[:n]]
+
+        items = hybrid_rank(query, k, mode, self.embeddings_model, lexical_search, vector_search, embed_timeout)
+        return [self._with_document(doc_id, indexes[doc_id].documents([row])[0], names) for doc_id, row in items]
+
+
+_corpora = {}
+_corpora_lock = threading.Lock()
+
+# Function to get the process-wide corpus of an embeddings model, shared by the Streamlit sessions
+def get_corpus_index(embeddings_model, store=None, **kwargs):
+    store = store or get_document_store()
+    key = (embeddings_model_name(embeddings_model), store.root, tuple(sorted(kwargs.items())))
+    with _corpora_lock:
+        if key not in _corpora:
+            _corpora[key] = CorpusIndex(embeddings_model, store, **kwargs).refresh()
+        return _corpora[key]
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from lexical_index import BM25Index
+from vector_store import META_FILE, TEMP_PREFIX, load_vector_database, save_vector_database
+
+# Local document store of the ChatWithPDF apps, shared by the Streamlit sessions
+# and processes. Each document (a PDF, or a video transcript) is a folder named
+# after the hash of its content:
+#   <store>/<file hash>/document.json       name, kind and page count of the document
+#   <store>/<file hash>/pages.json          extracted text of each page, or transcript section
+#   <store>/<file hash>/<settings hash>/    one folder per embeddings model and chunking:
+#       chunks.json                         chunk boundaries, (page, start, end) in the page text
+#       embeddings.npy                      chunk embeddings, float32, in chunk order
+#       lexical.json                        BM25 index of the chunks (lexical_index.py)
+#       index.faiss, index.pkl              FAISS index, memory-mapped when loaded (vector_store.py)
+# An identical upload loads its index without extracting, splitting or embedding.
+# A near-identical one re-embeds only its new chunks, the others hit the shared
+# embedding cache (embedding_cache.py). Folders are written in a temporary folder
+# then renamed, so readers never see a partial document.
+#
+# The store folder can be set with the DOCUMENT_STORE_DIR environment variable.
+
+STORE_VERSION = 2
+DEFAULT_STORE_DIR = os.environ.get('DOCUMENT_STORE_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'practical_llms', 'documents'))
+DOCUMENT_FILE = 'document.json'
+PAGES_FILE = 'pages.json'
+CHUNKS_FILE = 'chunks.json'
+EMBEDDINGS_FILE = 'embeddings.npy'
+LEXICAL_FILE = 'lexical.json'
+
+# Function to get the key of a document: the hash of its file content
+def document_key(file_bytes):
+    return hashlib.sha256(file_bytes).hexdigest()[:16]
+
+# Function to get the key of the index settings: the chunks and embeddings change with any of them
+def settings_key(model, chunk_size, chunk_overlap):
+    settings = f"{STORE_VERSION}\0{model}\0{chunk_size}\0{chunk_overlap}"
+    return hashlib.sha256(settings.encode('utf-8')).hexdigest()[:16]
+
+# Function to get the (start, end) offsets of the chunks of a text. The chunks are in text order and
+# overlap the previous one by at most chunk_overlap chars, each one is searched from there.
+# A chunk changed by the splitter gets (-1, -1).
+def chunk_boundaries(text, chunks, chunk_overlap=0):
+    boundaries, position = [], 0
+    for chunk in chunks:
+        start = text.find(chunk, position)
+        if start < 0:
+            boundaries.append((-1, -1))
+            continue
+        end = start + len(chunk)
+        boundaries.append((start, end))
+        position = max(start + 1, end - chunk_overlap)
+    return boundaries
+
+
+class DocumentStore:
+    # - root: folder of the documents
+    def __init__(self, root=DEFAULT_STORE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def document_dir(self, doc_key):
+        return os.path.join(self.root, doc_key)
+
+    def index_dir(self, doc_key, settings):
+        return os.path.join(self.root, doc_key, settings)
+
+    def has_document(self, doc_key):
+        return self.load_document_meta(doc_key) is not None
+
+    # Function to check if the index of a document was saved with these settings
+    def has_index(self, doc_key, settings):
+        return os.path.exists(os.path.join(self.index_dir(doc_key, settings), META_FILE))
+
+    # Function to get the meta of a saved document, {'name', 'kind', 'n_pages', ...}, None if it is not stored
+    def load_document_meta(self, doc_key):
+        try:
+            with open(os.path.join(self.document_dir(doc_key), DOCUMENT_FILE), encoding='utf-8') as f:
+                document = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # A document saved by an older version is extracted again
+        return document if document.get('version') == STORE_VERSION else None
+
+    # Function to get a saved document with its pages, None if it is not stored
+    def load_document(self, doc_key):
+        document = self.load_document_meta(doc_key)
+        if document is None:
+            return None
+        with open(os.path.join(self.document_dir(doc_key), PAGES_FILE), encoding='utf-8') as f:
+            document['pages'] = json.load(f)
+        return document
+
+    # Function to save the extracted text of a document, its pages or sections.
+    # meta: more fields of the document, e.g. the timestamps of the sections of a video transcript
+    def save_document(self, doc_key, pages, name=None, kind='pdf', **meta):
+        document_dir = self.document_dir(doc_key)
+        os.makedirs(document_dir, exist_ok=True)
+        # The pages first: a document with its meta file is complete
+        for file_name, content in [(PAGES_FILE, pages),
+                                   (DOCUMENT_FILE, {'version': STORE_VERSION, 'name': name, 'kind': kind,
+                                                    'n_pages': len(pages), 'created': time.time(), **meta})]:
+            path = os.path.join(document_dir, file_name)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(content, f)
+            os.replace(tmp_path, path)
+
+    # Function to load the FAISS vector database of a document, memory-mapped
+    def load_index(self, doc_key, settings, embeddings_model):
+        return load_vector_database(self.index_dir(doc_key, settings), embeddings_model)
+
+    # Function to load the chunks of a document: (chunks, embeddings), chunks is a list of
+    # {'page', 'start', 'end'} and embeddings a memory-mapped float32 array
+    def load_chunks(self, doc_key, settings):
+        index_dir = self.index_dir(doc_key, settings)
+        with open(os.path.join(index_dir, CHUNKS_FILE), encoding='utf-8') as f:
+            chunks = json.load(f)
+        return chunks, np.load(os.path.join(index_dir, EMBEDDINGS_FILE), mmap_mode='r')
+
+    # Function to load the BM25 index of the chunks of a document, None if its index was saved without one
+    def load_lexical(self, doc_key, settings):
+        try:
+            with open(os.path.join(self.index_dir(doc_key, settings), LEXICAL_FILE), encoding='utf-8') as f:
+                return BM25Index.from_dict(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    # Function to save the chunks, their embeddings, their BM25 index and the FAISS index of a document
+    def save_index(self, doc_key, settings, vec_db, chunks, embeddings, meta, lexical=None):
+        def write_chunks(folder):
+            with open(os.path.join(folder, CHUNKS_FILE), 'w', encoding='utf-8') as f:
+                json.dump(chunks, f)
+            np.save(os.path.join(folder, EMBEDDINGS_FILE), np.asarray(embeddings, dtype=np.float32))
+            if lexical is not None:
+                with open(os.path.join(folder, LEXICAL_FILE), 'w', encoding='utf-8') as f:
+                    json.dump(lexical.to_dict(), f)
+        save_vector_database(vec_db, self.index_dir(doc_key, settings), {'version': STORE_VERSION, **meta},
+                             write_files=write_chunks)
+
+    # Function to list the stored documents, [(doc_key, document meta)]
+    def list_documents(self):
+        documents = []
+        for doc_key in sorted(os.listdir(self.root)):
+            document = None if doc_key.startswith(TEMP_PREFIX) else self.load_document_meta(doc_key)
+            if document is not None:
+                documents.append((doc_key, document))
+        return documents
+
+    # Function to remove a document, its text and all its indexes
+    def remove_document(self, doc_key):
+        document_dir = self.document_dir(doc_key)
+        if not os.path.exists(document_dir):
+            return
+        # Renamed first, so no reader sees a half-removed document
+        trash = tempfile.mkdtemp(prefix=TEMP_PREFIX, dir=self.root)
+        os.replace(document_dir, os.path.join(trash, doc_key))
+        shutil.rmtree(trash, ignore_errors=True)
+
+
+_stores = {}
+
+# Function to get the process-wide document store of a folder
+def get_document_store(root=DEFAULT_STORE_DIR):
+    if root not in _stores:
+        _stores[root] = DocumentStore(root)
+    return _stores[root]
@@ -0,0 +1,240 @@
+import atexit
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+try:
+    from langchain.embeddings.base import Embeddings
+except ImportError:
+    Embeddings = object
+
+# Persistent, content-addressed embedding cache shared by all the apps.
+# Vectors are keyed by (model, hash of the normalized text) and stored as
+# float32 rows of a memory-mapped file, one file per model. A small SQLite
+# index maps each key to its row and keeps the last access time for LRU
+# eviction. Only cache misses are sent to the embeddings provider.
+# The access times of the hits are buffered and written in batches, a lookup
+# does not write. An evicted slot is reused only SLOT_REUSE_DELAY seconds after,
+# and a lookup checks its keys still map to the slots it read, so a reader in
+# another process never returns the vector of another text.
+#
+# The cache folder can be set with the EMBEDDING_CACHE_DIR environment variable.
+
+DEFAULT_CACHE_DIR = os.environ.get('EMBEDDING_CACHE_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'practical_llms', 'embeddings'))
+DEFAULT_MAX_ENTRIES = 1000000  # 1M ada-002 vectors is ~6 GB on disk
+SQLITE_MAX_PARAMS = 900
+ACCESS_FLUSH_INTERVAL = 30     # Seconds between the writes of the buffered access times
+ACCESS_FLUSH_SIZE = 10000      # Buffered access times that trigger a write
+SLOT_REUSE_DELAY = 60          # Seconds before an evicted slot is reused, longer than any lookup
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Function to normalize a text before hashing: the same text with different whitespace is the same key
+def normalize_text(text):
+    return WHITESPACE_PATTERN.sub(' ', text).strip()
+
+# Function to get the cache key of a text for a given model
+def embedding_key(model, text):
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, model, cache_dir=DEFAULT_CACHE_DIR, max_entries=DEFAULT_MAX_ENTRIES):
+        self.model = model
+        self.max_entries = max_entries
+        model_dir = os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', model))
+        os.makedirs(model_dir, exist_ok=True)
+        self.vectors_path = os.path.join(model_dir, 'vectors.f32')
+        # check_same_thread=False: Streamlit reruns the script in different threads
+        self.db = sqlite3.connect(os.path.join(model_dir, 'index.sqlite'), timeout=60, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER, last_access REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS free_slots (slot INTEGER PRIMARY KEY, freed REAL DEFAULT 0)")
+        if 'freed' not in [column[1] for column in self.db.execute("PRAGMA table_info(free_slots)")]:
+            self.db.execute("ALTER TABLE free_slots ADD COLUMN freed REAL DEFAULT 0")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        self.db.commit()
+        self.vectors = None
+        self.lock = threading.RLock()
+        # key -> last access time of the hits not written yet
+        self._accessed = {}
+        self._accessed_flushed = time.time()
+        atexit.register(self.flush_access_times)
+
+    def _meta(self, name, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return default if row is None else row[0]
+
+    # Memory-map the vectors file, remapping it if other processes made it grow
+    def _vectors(self, min_slots, dim):
+        if self.vectors is None or len(self.vectors) < min_slots:
+            n_slots = os.path.getsize(self.vectors_path) // (dim * 4)
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(n_slots, dim))
+        return self.vectors
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    # Function to look up many texts at once.
+    # Returns (vectors, found): a float32 (n_texts x dim) array, and a boolean mask of the cache hits.
+    def get_many(self, texts):
+        with self.lock:
+            return self._get_many(texts)
+
+    # Function to get the slots of some keys, {key: slot} for the keys in the cache
+    def _slots(self, keys):
+        keys = list(set(keys))
+        slots = {}
+        for start in range(0, len(keys), SQLITE_MAX_PARAMS):
+            chunk = keys[start:start + SQLITE_MAX_PARAMS]
+            placeholders = ','.join('?' * len(chunk))
+            slots.update(self.db.execute(f"SELECT key, slot FROM entries WHERE key IN ({placeholders})", chunk))
+        return slots
+
+    def _get_many(self, texts):
+        keys = [embedding_key(self.model, text) for text in texts]
+        dim = self._meta('dim')
+        if dim is None:
+            return np.zeros((len(texts), 0), dtype=np.float32), np.zeros(len(texts), dtype=bool)
+
+        slots = self._slots(keys)
+        found = np.array([key in slots for key in keys], dtype=bool)
+        result = np.zeros((len(texts), dim), dtype=np.float32)
+        if found.any():
+            hit_slots = np.array([slots[key] for key in keys if key in slots], dtype=np.int64)
+            result[found] = self._vectors(hit_slots.max() + 1, dim)[hit_slots]
+            # A key evicted by another process while its slot was read is a miss
+            current = self._slots(slots)
+            moved = {key for key, slot in slots.items() if current.get(key) != slot}
+            if moved:
+                lost = np.array([key in moved for key in keys], dtype=bool)
+                found &= ~lost
+                result[lost] = 0
+            # The LRU access times of the hits are written in batches
+            now = time.time()
+            self._accessed.update((key, now) for key in slots if key not in moved)
+            if len(self._accessed) >= ACCESS_FLUSH_SIZE or now - self._accessed_flushed >= ACCESS_FLUSH_INTERVAL:
+                with self.db:
+                    self._flush_access_times()
+        return result, found
+
+    # Function to write the buffered access times, in the current transaction
+    def _flush_access_times(self):
+        accessed, self._accessed = self._accessed, {}
+        self._accessed_flushed = time.time()
+        self.db.executemany("UPDATE entries SET last_access = MAX(last_access, ?) WHERE key = ?",
+                            [(last_access, key) for key, last_access in accessed.items()])
+
+    # Function to write the buffered access times, e.g. before the process exits
+    def flush_access_times(self):
+        with self.lock, self.db:
+            self._flush_access_times()
+
+    # Function to store many vectors at once, evicting the least recently used entries beyond max_entries
+    def put_many(self, texts, vectors):
+        with self.lock:
+            self._put_many(texts, vectors)
+
+    def _put_many(self, texts, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if len(texts) == 0:
+            return
+        dim = vectors.shape[1]
+        now = time.time()
+        with self.db:
+            # Take the write lock first, so slot allocation is safe across processes
+            self.db.execute("BEGIN IMMEDIATE")
+            stored_dim = self._meta('dim')
+            if stored_dim is None:
+                self.db.execute("INSERT INTO meta (name, value) VALUES ('dim', ?)", (dim,))
+            elif stored_dim != dim:
+                raise ValueError(f"Embedding size {dim} does not match the cache size {stored_dim} for {self.model}")
+            n_slots = self._meta('n_slots', 0)
+
+            new_entries = {}
+            for text, vector in zip(texts, vectors):
+                key = embedding_key(self.model, text)
+                if key in new_entries or self.db.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone():
+                    continue
+                free = self.db.execute("SELECT slot FROM free_slots WHERE freed <= ? LIMIT 1",
+                                       (now - SLOT_REUSE_DELAY,)).fetchone()
+                if free is not None:
+                    slot = free[0]
+                    self.db.execute("DELETE FROM free_slots WHERE slot = ?", (slot,))
+                else:
+                    slot = n_slots
+                    n_slots += 1
+                new_entries[key] = (slot, vector)
+
+            # Write the vectors before the index rows are committed, readers never see a missing vector
+            mode = 'r+b' if os.path.exists(self.vectors_path) else 'w+b'
+            with open(self.vectors_path, mode) as f:
+                for slot, vector in sorted(new_entries.values(), key=lambda entry: entry[0]):
+                    f.seek(slot * dim * 4)
+                    f.write(vector.tobytes())
+            self.db.executemany("INSERT INTO entries (key, slot, last_access) VALUES (?, ?, ?)",
+                                [(key, slot, now) for key, (slot, _) in new_entries.items()])
+            self.db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('n_slots', ?)", (n_slots,))
+            # The eviction ranks the entries by their latest access times
+            self._flush_access_times()
+            self._evict(now)
+
+    # Function to evict the least recently used entries, their slots are reused by the puts SLOT_REUSE_DELAY seconds later
+    def _evict(self, now):
+        n_entries = self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        n_evict = n_entries - self.max_entries
+        if n_evict <= 0:
+            return
+        evicted = self.db.execute("SELECT key, slot FROM entries ORDER BY last_access LIMIT ?", (n_evict,)).fetchall()
+        self.db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+        self.db.executemany("INSERT OR IGNORE INTO free_slots (slot, freed) VALUES (?, ?)",
+                            [(slot, now) for _, slot in evicted])
+
+    # Function to get the embeddings of many texts, only the cache misses are sent to embed_fn.
+    # embed_fn takes a list of texts and returns their embeddings, in the same order.
+    def get_or_embed(self, texts, embed_fn):
+        texts = list(texts)
+        vectors, found = self.get_many(texts)
+        missing = np.flatnonzero(~found)
+        if len(missing) == 0:
+            return vectors
+
+        # Embed each distinct missing text once
+        missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+        missing_vectors = np.asarray(embed_fn(missing_texts), dtype=np.float32)
+        self.put_many(missing_texts, missing_vectors)
+
+        if vectors.shape[1] == 0:
+            vectors = np.zeros((len(texts), missing_vectors.shape[1]), dtype=np.float32)
+        position = {text: i for i, text in enumerate(missing_texts)}
+        vectors[missing] = missing_vectors[[position[texts[i]] for i in missing]]
+        return vectors
+
+
+_caches = {}
+
+# Function to get the process-wide cache of a model
+def get_embedding_cache(model, cache_dir=DEFAULT_CACHE_DIR):
+    if (model, cache_dir) not in _caches:
+        _caches[(model, cache_dir)] = EmbeddingCache(model, cache_dir)
+    return _caches[(model, cache_dir)]
+
+
+# LangChain embeddings wrapper, e.g. CachedEmbeddings(OpenAIEmbeddings()), usable with FAISS.from_texts
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings_model, cache=None):
+        self.embeddings_model = embeddings_model
+        self.model = getattr(embeddings_model, 'model', type(embeddings_model).__name__)
+        self.cache = cache or get_embedding_cache(self.model)
+
+    def embed_documents(self, texts):
+        return self.cache.get_or_embed(texts, self.embeddings_model.embed_documents).tolist()
+
+    def embed_query(self, text):
+        return self.cache.get_or_embed([text], lambda texts: [self.embeddings_model.embed_query(texts[0])])[0].tolist()
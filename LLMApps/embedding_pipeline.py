@@ -0,0 +1,157 @@
+import asyncio
+import random
+import time
+
+import numpy as np
+import tiktoken
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+# Batched, concurrent embedding pipeline for catalog/document builds.
+# Texts are packed in order into batches that respect both the provider's
+# per-request item limit and a token budget. N batches run concurrently with
+# AsyncOpenAI behind a semaphore, and each batch failing on a transient error
+# (rate limit, timeout, connection, 5xx) is retried on its own.
+# Results are streamed into a preallocated float32 matrix. A batch that still
+# fails after its retries leaves zero rows, its texts are listed in the stats,
+# and the other batches are kept.
+
+MAX_BATCH_ITEMS = 2048      # OpenAI embeddings: max inputs per request
+MAX_BATCH_TOKENS = 100000   # Token budget per request, stays under the per-request limit
+MAX_INPUT_TOKENS = 8191     # ada-002 context size, longer texts are truncated
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_RETRIES = 5
+# Transient errors, retried with backoff. Any other error (bad request, authentication) fails the batch at once.
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+# Function to get the tokenizer of an embeddings model
+def get_encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding('cl100k_base')
+
+# Function to count the tokens of each text, truncating the ones beyond max_input_tokens
+def prepare_texts(texts, model, max_input_tokens=MAX_INPUT_TOKENS):
+    encoding = get_encoding(model)
+    prepared, token_counts = [], []
+    for text, tokens in zip(texts, encoding.encode_batch(texts, disallowed_special=())):
+        if len(tokens) > max_input_tokens:
+            tokens = tokens[:max_input_tokens]
+            text = encoding.decode(tokens)
+        prepared.append(text)
+        token_counts.append(max(1, len(tokens)))
+    return prepared, token_counts
+
+# Function to pack consecutive texts into batches under both the item and the token budgets.
+# Returns a list of (start, end) ranges.
+def make_batches(token_counts, max_items=MAX_BATCH_ITEMS, max_tokens=MAX_BATCH_TOKENS):
+    batches = []
+    start, batch_tokens = 0, 0
+    for i, n_tokens in enumerate(token_counts):
+        if i > start and (i - start >= max_items or batch_tokens + n_tokens > max_tokens):
+            batches.append((start, i))
+            start, batch_tokens = i, 0
+        batch_tokens += n_tokens
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+    return batches
+
+# Function to embed one batch, retrying it with exponential backoff on RETRYABLE_ERRORS.
+# Returns the batch range with the vectors, so results can be written as they complete.
+# The vectors are None if the batch failed on another error, or after all its retries.
+async def embed_batch(client, texts, batch_range, model, semaphore, max_retries, stats):
+    for attempt in range(max_retries + 1):
+        async with semaphore:
+            try:
+                response = await client.embeddings.create(input=texts, model=model)
+                vectors = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+                return batch_range, vectors
+            except RETRYABLE_ERRORS as e:
+                if attempt == max_retries:
+                    print("Embedding batch failed after all its retries:", e)
+                    return batch_range, None
+                stats['n_retries'] += 1
+                print("Embedding batch failed, retrying:", e)
+            except Exception as e:
+                print("Embedding batch failed:", e)
+                return batch_range, None
+        await asyncio.sleep(min(60, 2 ** attempt) * (0.5 + random.random()))
+
+# Function to embed all texts with concurrent batches, see embed_texts
+async def embed_texts_async(texts, client, model="text-embedding-ada-002",
+                            max_items=MAX_BATCH_ITEMS, max_tokens=MAX_BATCH_TOKENS,
+                            concurrency=DEFAULT_CONCURRENCY, max_retries=DEFAULT_MAX_RETRIES,
+                            cache=None, progress=None):
+    start_time = time.perf_counter()
+    texts = list(texts)
+    stats = {'n_texts': len(texts), 'n_cached': 0, 'n_tokens': 0, 'n_batches': 0, 'n_retries': 0,
+             'n_failed': 0, 'failed': []}
+
+    # Only the cache misses are sent to the provider
+    embeddings = None
+    to_embed = np.arange(len(texts))
+    if cache is not None:
+        cached, found = cache.get_many(texts)
+        if found.any():
+            embeddings = cached
+            to_embed = np.flatnonzero(~found)
+            stats['n_cached'] = int(found.sum())
+
+    prepared, token_counts = prepare_texts([texts[i] for i in to_embed], model)
+    batches = make_batches(token_counts, max_items, max_tokens)
+    stats['n_batches'] = len(batches)
+    stats['n_tokens'] = int(sum(token_counts))
+
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [asyncio.ensure_future(embed_batch(client, prepared[start:end], (start, end), model,
+                                               semaphore, max_retries, stats))
+             for start, end in batches]
+    n_done, failed = 0, []
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            (start, end), vectors = await next_result
+            n_done += end - start
+            if vectors is None:
+                failed.extend(to_embed[start:end].tolist())
+                continue
+            vectors = np.asarray(vectors, dtype=np.float32)
+            if embeddings is None:
+                # Preallocate the output once the embedding size is known
+                embeddings = np.zeros((len(texts), vectors.shape[1]), dtype=np.float32)
+            embeddings[to_embed[start:end]] = vectors
+            if cache is not None:
+                cache.put_many([texts[i] for i in to_embed[start:end]], vectors)
+            if progress is not None:
+                progress(n_done, len(prepared))
+    finally:
+        # Interrupted: do not leave the other requests running
+        for task in tasks:
+            task.cancel()
+
+    if embeddings is None:
+        if failed:
+            # Not a single vector: there is no partial result to keep, and no embedding size
+            raise RuntimeError(f"All the {len(failed)} texts failed to embed")
+        embeddings = np.zeros((len(texts), 0), dtype=np.float32)
+    stats['failed'] = sorted(failed)
+    stats['n_failed'] = len(failed)
+    elapsed = time.perf_counter() - start_time
+    stats['elapsed'] = elapsed
+    stats['texts_per_second'] = len(texts) / elapsed if elapsed > 0 else float('inf')
+    stats['tokens_per_second'] = stats['n_tokens'] / elapsed if elapsed > 0 else float('inf')
+    return embeddings, stats
+
+# Function to embed all texts into a float32 (n_texts x dim) matrix, in the order of texts.
+# - client: an AsyncOpenAI client
+# - cache: optional embedding_cache.EmbeddingCache, only its misses are embedded
+# - progress: optional callback progress(n_done, n_total)
+# Returns (embeddings, stats), stats has the throughput: texts_per_second, tokens_per_second.
+# The texts of the batches that failed after their retries have zero rows, their indices are in stats['failed'].
+def embed_texts(texts, client, model="text-embedding-ada-002", **kwargs):
+    return asyncio.run(embed_texts_async(texts, client, model=model, **kwargs))
+
+# Function to format the pipeline stats for display
+def format_stats(stats):
+    return (f"{stats['n_texts']} texts ({stats['n_cached']} cached) in {stats['elapsed']:.1f} s, "
+            f"{stats['n_batches']} batches, {stats['n_retries']} retries, {stats['n_failed']} failed: "
+            f"{stats['texts_per_second']:.1f} texts/s, {stats['tokens_per_second']:.0f} tokens/s")
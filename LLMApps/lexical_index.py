@@ -0,0 +1,153 @@
+import math
+import re
+from array import array
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+# Lexical retrieval for the RAG apps, next to the vector search of the FAISS indexes.
+# Embeddings miss the exact identifiers, part numbers and error codes of a manual
+# ("PX-2200", "E_042"), and every vector search costs an embeddings round trip.
+# - BM25Index: a BM25 inverted index of the chunks, built while they are chunked
+#   (pdf_ingestion.py) and saved next to their FAISS index (document_store.py).
+#   Its rows are the rows of the FAISS index, so both rank the same chunks
+# - reciprocal_rank_fusion: merges the lexical and the vector rankings by rank,
+#   their scores (BM25, L2 distance) are not comparable
+# - hybrid_rank: runs a search in one of SEARCH_MODES. The query is embedded in
+#   the background while the lexical index is searched; in hybrid mode, if the
+#   embeddings service does not answer within embed_timeout seconds, the lexical
+#   ranking is returned alone (lexical fast path)
+
+HYBRID, VECTOR, LEXICAL = 'hybrid', 'vector', 'lexical'
+SEARCH_MODES = [HYBRID, VECTOR, LEXICAL]
+BM25_K1 = 1.2                  # Term frequency saturation
+BM25_B = 0.75                  # Chunk length normalization
+RRF_K = 60                     # Rank smoothing of the reciprocal rank fusion
+N_CANDIDATES = 20              # Results of each ranking fused into the top k
+DEFAULT_EMBED_TIMEOUT = 2.0    # Seconds a hybrid search waits for the query embedding
+QUERY_EMBEDDING_WORKERS = 4
+
+# Words and identifiers: "PX-2200", "3.5mm" or "e_042" are kept whole
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+(?:[-_./][a-z0-9]+)*')
+SEPARATOR_PATTERN = re.compile(r'[-_./]')
+
+# Function to split a text in lowercase terms. An identifier gives its parts too, so a query
+# for "PX-2200" ranks the exact identifier first, and a query for "2200" still finds it.
+def tokenize(text):
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        terms.append(token)
+        parts = SEPARATOR_PATTERN.split(token)
+        if len(parts) > 1:
+            terms.extend(part for part in parts if part)
+    return terms
+
+
+class BM25Index:
+    # - k1, b: BM25 parameters
+    def __init__(self, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        # term -> (rows, term frequencies), rows in increasing order
+        self.postings = {}
+        self.lengths = array('f')
+        self.total_length = 0.0
+
+    def __len__(self):
+        return len(self.lengths)
+
+    # Function to append chunks, their rows follow the rows already indexed
+    def add_texts(self, texts):
+        for text in texts:
+            row = len(self.lengths)
+            terms = tokenize(text)
+            for term, count in Counter(terms).items():
+                if term not in self.postings:
+                    self.postings[term] = (array('i'), array('f'))
+                rows, frequencies = self.postings[term]
+                rows.append(row)
+                frequencies.append(count)
+            self.lengths.append(len(terms))
+            self.total_length += len(terms)
+
+    # Function to search the chunks. Returns the k best [(row, score)], only the chunks with a query term.
+    def search(self, query, k=4):
+        n_rows = len(self.lengths)
+        if n_rows == 0:
+            return []
+        lengths = np.array(self.lengths, dtype=np.float32)
+        norms = self.k1 * (1 - self.b + self.b * lengths / max(self.total_length / n_rows, 1e-9))
+        scores = np.zeros(n_rows, dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            rows, frequencies = self.postings[term]
+            rows = np.array(rows, dtype=np.int64)
+            frequencies = np.array(frequencies, dtype=np.float32)
+            idf = math.log(1 + (n_rows - len(rows) + 0.5) / (len(rows) + 0.5))
+            scores[rows] += idf * frequencies * (self.k1 + 1) / (frequencies + norms[rows])
+
+        matches = np.flatnonzero(scores)
+        if len(matches) > k:
+            matches = matches[np.argpartition(-scores[matches], k - 1)[:k]]
+        matches = matches[np.argsort(-scores[matches], kind='stable')]
+        return [(int(row), float(scores[row])) for row in matches]
+
+    # Function to get the index as JSON-serializable data, see from_dict
+    def to_dict(self):
+        return {'k1': self.k1, 'b': self.b, 'lengths': self.lengths.tolist(),
+                'postings': {term: [rows.tolist(), frequencies.tolist()]
+                             for term, (rows, frequencies) in self.postings.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        index = cls(data['k1'], data['b'])
+        index.lengths = array('f', data['lengths'])
+        index.total_length = float(sum(index.lengths))
+        index.postings = {term: (array('i', rows), array('f', frequencies))
+                          for term, (rows, frequencies) in data['postings'].items()}
+        return index
+
+    @classmethod
+    def from_texts(cls, texts, **kwargs):
+        index = cls(**kwargs)
+        index.add_texts(texts)
+        return index
+
+
+# Function to fuse rankings of the same items by reciprocal rank: each item scores the sum of
+# 1 / (rrf_k + rank) over the rankings it is in. Returns the items, best first.
+def reciprocal_rank_fusion(rankings, rrf_k=RRF_K):
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(scores, key=lambda item: -scores[item])
+
+
+# Query embeddings run in this pool, a search that stops waiting for one does not block on it.
+# A late embedding still lands in the embedding cache, the same query is then fast.
+_query_executor = ThreadPoolExecutor(max_workers=QUERY_EMBEDDING_WORKERS, thread_name_prefix='query-embedding')
+
+# Function to rank the items of an index for a query, in one of SEARCH_MODES. Returns the k best items.
+# - lexical_search(query, n): the n best items of the lexical index, best first
+# - vector_search(vector, n): the n nearest items of the query embedding, nearest first
+# - embed_timeout: seconds a hybrid search waits for the query embedding before answering from the
+#   lexical ranking alone, None to always wait. A vector search always waits.
+def hybrid_rank(query, k, mode, embeddings_model, lexical_search, vector_search,
+                embed_timeout=DEFAULT_EMBED_TIMEOUT):
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode {mode!r}, expected one of {SEARCH_MODES}")
+    n_candidates = max(k, N_CANDIDATES)
+    # The query is embedded while the lexical index is searched
+    future = None if mode == LEXICAL else _query_executor.submit(embeddings_model.embed_query, query)
+    rankings = [] if mode == VECTOR else [lexical_search(query, n_candidates)]
+    if future is not None:
+        try:
+            vector = future.result(timeout=None if mode == VECTOR else embed_timeout)
+            rankings.append(vector_search(vector, n_candidates))
+        except FutureTimeoutError:
+            pass
+    return reciprocal_rank_fusion(rankings)[:k]
@@ -0,0 +1,364 @@
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PyPDF2 import PdfReader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.vectorstores import FAISS
+
+from document_store import chunk_boundaries, document_key, get_document_store, settings_key
+from embedding_cache import CachedEmbeddings
+from lexical_index import DEFAULT_EMBED_TIMEOUT, HYBRID, BM25Index, hybrid_rank
+from pdf_page_cache import file_hash, get_page_cache, page_fingerprint
+from vector_store import META_FILE, embeddings_model_name
+
+# Streaming ingestion of a PDF into a live vector index, for the ChatWithPDF apps.
+# extract_text_from_pdf concatenated all the pages with raw_text += text, then
+# the whole text was split and embedded before the first answer. Here:
+# - the pages are extracted in a process pool (page.extract_text is pure Python),
+#   and streamed in page order. Pages already extracted come from the page cache
+#   (pdf_page_cache.py), so an edited PDF only extracts its changed pages again
+# - each page is split in chunks as it arrives, its chunks keep their page number
+# - the chunks are embedded in batches and appended to a LiveVectorIndex, that
+#   the chat queries while the rest of the PDF is still being indexed. The chunks
+#   also go in a BM25 index of the same rows, for the lexical and hybrid searches
+#   (lexical_index.py)
+# - the ingestion runs in a background thread and reports its progress
+# The extracted pages, the chunks, their embeddings and the finished index are saved
+# in the document store (document_store.py), keyed by the hash of the PDF content:
+# uploading the same PDF again, from any session, loads its index.
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_CHUNK_OVERLAP = 100
+DEFAULT_BATCH_SIZE = 32        # Chunks per embeddings request and index append
+PAGES_PER_TASK = 4             # Pages per process pool task, small so the first pages arrive early
+MIN_PAGES_FOR_POOL = 16        # Fewer pages to extract are extracted in process, a pool costs more than it saves
+
+PENDING, RUNNING, DONE, FAILED, CANCELLED = 'pending', 'running', 'done', 'failed', 'cancelled'
+
+
+# Reader of each worker process, opened once from the PDF bytes
+_reader = None
+
+def init_worker(pdf_bytes):
+    global _reader
+    _reader = PdfReader(io.BytesIO(pdf_bytes))
+
+def extract_page(page_number):
+    return _reader.pages[page_number].extract_text() or ''
+
+# Function to count the pages of a PDF
+def count_pages(pdf_bytes):
+    return len(PdfReader(io.BytesIO(pdf_bytes)).pages)
+
+# Function to extract the text of some pages of a PDF, in process for a few pages, else in a process pool.
+# Yields (page_number, text) in the order of page_numbers.
+def extract_page_texts(pdf_bytes, reader, page_numbers, n_workers=None):
+    n_workers = n_workers or os.cpu_count() or 1
+    if n_workers == 1 or len(page_numbers) < MIN_PAGES_FOR_POOL:
+        for page_number in page_numbers:
+            yield page_number, reader.pages[page_number].extract_text() or ''
+        return
+
+    # Consecutive page ranges per task, streamed back in order
+    executor = ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker, initargs=(pdf_bytes,))
+    finished = False
+    try:
+        yield from zip(page_numbers, executor.map(extract_page, page_numbers, chunksize=PAGES_PER_TASK))
+        finished = True
+    finally:
+        # A caller that stops early (generator closed) does not wait for the pages left: they are cancelled
+        executor.shutdown(wait=finished, cancel_futures=not finished)
+
+# Function to extract the text of the pages of a PDF, yielded in page order as (page_number, text).
+# page_number starts at 0, pages without text give ''. The pages already extracted, from this file
+# or an earlier version of it, are read from the page cache (see pdf_page_cache.py), pass
+# page_cache=False to extract them all.
+def extract_pages(pdf_bytes, n_workers=None, page_cache=None):
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    n_pages = len(reader.pages)
+    if page_cache is False:
+        yield from extract_page_texts(pdf_bytes, reader, list(range(n_pages)), n_workers)
+        return
+
+    page_cache = get_page_cache() if page_cache is None else page_cache
+    pdf_hash = file_hash(pdf_bytes)
+    keys = page_cache.file_page_keys(pdf_hash)
+    if keys is None or len(keys) != n_pages:
+        keys = [page_fingerprint(page) for page in reader.pages]
+        page_cache.put_file(pdf_hash, keys)
+    cached = page_cache.get_many(keys)
+    missing = [page_number for page_number, key in enumerate(keys) if key not in cached]
+    extracted = extract_page_texts(pdf_bytes, reader, missing, n_workers)
+    missing = set(missing)
+    try:
+        for page_number, key in enumerate(keys):
+            if page_number in missing:
+                _, text = next(extracted)
+                page_cache.put_many([key], [text])
+                yield page_number, text
+            else:
+                yield page_number, cached[key]
+    finally:
+        # The caller stopped early: cancels the pages left to extract, see extract_page_texts
+        extracted.close()
+
+# Function to extract the whole text of a PDF, the pages joined once instead of concatenated one by one
+def extract_text(pdf_bytes, n_workers=None, page_cache=None):
+    return ''.join(text for _, text in extract_pages(pdf_bytes, n_workers, page_cache))
+
+
+class LiveVectorIndex:
+    # - embeddings_model: LangChain embeddings model, embeds the queries
+    # - vec_db: FAISS vector database already built, e.g. loaded from disk, None until the first chunks are added
+    # - lexical: BM25Index of the chunks of vec_db, in the same rows, rebuilt from its docstore if not given
+    def __init__(self, embeddings_model, vec_db=None, lexical=None):
+        self.embeddings_model = embeddings_model
+        self.vec_db = vec_db
+        self._lock = threading.Lock()
+        if lexical is None:
+            lexical = BM25Index.from_texts(doc.page_content for doc in self.documents(range(len(self))))
+        self.lexical = lexical
+
+    def __len__(self):
+        return 0 if self.vec_db is None else self.vec_db.index.ntotal
+
+    # Function to append embedded chunks to the index, and to its lexical index
+    def add_embeddings(self, texts, vectors, metadatas=None):
+        text_embeddings = list(zip(texts, vectors))
+        with self._lock:
+            if self.vec_db is None:
+                self.vec_db = FAISS.from_embeddings(text_embeddings, self.embeddings_model, metadatas=metadatas)
+            else:
+                self.vec_db.add_embeddings(text_embeddings, metadatas=metadatas)
+            self.lexical.add_texts(texts)
+
+    # Function to get the chunks of some rows of the FAISS index, as LangChain documents
+    def documents(self, rows):
+        with self._lock:
+            return [self.vec_db.docstore.search(self.vec_db.index_to_docstore_id[row]) for row in rows]
+
+    # Function to search the chunks indexed so far with an embedded query. Returns [(document, distance)].
+    def similarity_search_with_score_by_vector(self, vector, k=4):
+        if self.vec_db is None:
+            return []
+        with self._lock:
+            return self.vec_db.similarity_search_with_score_by_vector(vector, k=k)
+
+    # Function to search the chunks indexed so far. The query is embedded outside the lock,
+    # so a search only waits for an index append, not for an embeddings request.
+    def similarity_search(self, query, k=4):
+        if self.vec_db is None:
+            return []
+        vector = self.embeddings_model.embed_query(query)
+        with self._lock:
+            return self.vec_db.similarity_search_by_vector(vector, k=k)
+
+    # Function to get the rows of the k nearest chunks of an embedded query, [(row, distance)] nearest first
+    def vector_search_rows(self, vector, k=4):
+        if self.vec_db is None:
+            return []
+        with self._lock:
+            distances, rows = self.vec_db.index.search(np.asarray([vector], dtype=np.float32), k)
+        return [(int(row), float(distance)) for row, distance in zip(rows[0], distances[0]) if row >= 0]
+
+    # Function to get the rows of the k best chunks for the terms of a query, [(row, BM25 score)] best first
+    def lexical_search_rows(self, query, k=4):
+        with self._lock:
+            return self.lexical.search(query, k)
+
+    # Function to search the chunks indexed so far, by mode: 'lexical' (BM25, no embeddings request),
+    # 'vector' (the nearest embeddings) or 'hybrid' (both, fused by rank). A hybrid search answers from
+    # the lexical ranking alone if the query is not embedded within embed_timeout seconds (see lexical_index.py).
+    def search(self, query, k=4, mode=HYBRID, embed_timeout=DEFAULT_EMBED_TIMEOUT):
+        if self.vec_db is None:
+            return []
+        rows = hybrid_rank(query, k, mode, self.embeddings_model,
+                           lambda query, n: [row for row, _ in self.lexical_search_rows(query, n)],
+                           lambda vector, n: [row for row, _ in self.vector_search_rows(vector, n)],
+                           embed_timeout)
+        return self.documents(rows)
+
+
+class PdfIngestion:
+    KIND = 'pdf'
+
+    # - pdf_bytes: content of the PDF, e.g. uploaded_file.getvalue()
+    # - embeddings_model: LangChain embeddings model, wrapped in CachedEmbeddings if it is not, so a
+    #   near-identical PDF only embeds its new chunks
+    # - name: file name of the PDF, kept in the document store
+    # - batch_size: chunks embedded and appended to the index at once
+    # - n_workers: processes extracting the pages
+    # - store: DocumentStore of the PDFs, the shared one by default
+    def __init__(self, pdf_bytes, embeddings_model, name=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 chunk_overlap=DEFAULT_CHUNK_OVERLAP, batch_size=DEFAULT_BATCH_SIZE, n_workers=None, store=None):
+        if not isinstance(embeddings_model, CachedEmbeddings):
+            embeddings_model = CachedEmbeddings(embeddings_model)
+        self.pdf_bytes = pdf_bytes
+        self.embeddings_model = embeddings_model
+        self.name = name
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.batch_size = batch_size
+        self.n_workers = n_workers
+        self.store = store or get_document_store()
+        self.doc_key = document_key(pdf_bytes)
+        self.settings = settings_key(embeddings_model_name(embeddings_model), chunk_size, chunk_overlap)
+        self.key = f"{self.doc_key}/{self.settings}"
+        self.index = LiveVectorIndex(embeddings_model)
+        self.status = PENDING
+        self.error = None
+        self.cancelled = False
+        # Held while the results are saved, see cancel
+        self._save_lock = threading.Lock()
+        self.n_pages = None
+        self.pages_done = 0
+        self.started = time.time()
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    # Fraction of the pages read
+    @property
+    def progress(self):
+        if self.status == DONE:
+            return 1.0
+        return self.pages_done / self.n_pages if self.n_pages else 0.0
+
+    # Function to describe the progress, e.g. for the app sidebar
+    def describe(self):
+        if self.status == FAILED:
+            return f"Indexing failed: {self.error}"
+        if self.status == CANCELLED:
+            return "Indexing cancelled"
+        n_pages = '?' if self.n_pages is None else self.n_pages
+        elapsed = (self.finished or time.time()) - self.started
+        return f"{self.pages_done}/{n_pages} pages read, {len(self.index)} chunks indexed ({elapsed:.1f} s)"
+
+    # Function to load the saved index of the same PDF, with the same settings. Returns False if there is none.
+    def load(self):
+        if not self.store.has_index(self.doc_key, self.settings):
+            return False
+        meta_path = os.path.join(self.store.index_dir(self.doc_key, self.settings), META_FILE)
+        with open(meta_path, encoding='utf-8') as f:
+            self.n_pages = self.pages_done = json.load(f).get('n_pages')
+        self.index = LiveVectorIndex(self.embeddings_model,
+                                     self.store.load_index(self.doc_key, self.settings, self.embeddings_model),
+                                     self.store.load_lexical(self.doc_key, self.settings))
+        self.status, self.finished = DONE, time.time()
+        self.pdf_bytes = None
+        return True
+
+    # Function to embed a batch of chunks and append it to the live index. Returns the embeddings.
+    def flush(self, texts, metadatas):
+        if not texts:
+            return []
+        vectors = self.embeddings_model.embed_documents(texts)
+        self.index.add_embeddings(texts, vectors, metadatas)
+        return vectors
+
+    # Function to get the metadata of the chunks of a page
+    def page_metadata(self, page_number):
+        return {'page': page_number + 1}
+
+    # Function to get more fields saved with the document in the store
+    def document_meta(self):
+        return {}
+
+    # Function to get the pages of the PDF, (page_number, text): from the document store if the same
+    # file was already extracted (e.g. with other settings), else extracted. Returns (pages, stored).
+    def pages(self):
+        document = self.store.load_document(self.doc_key)
+        if document is not None:
+            self.n_pages = document['n_pages']
+            return enumerate(document['pages']), True
+        self.n_pages = count_pages(self.pdf_bytes)
+        return extract_pages(self.pdf_bytes, self.n_workers), False
+
+    # Function to stop the ingestion, e.g. when its document is removed: it stops reading the pages
+    # and saves nothing. Returns after a save already started, so the caller can then delete the document.
+    def cancel(self):
+        with self._save_lock:
+            self.cancelled = True
+        with _ingestions_lock:
+            if _ingestions.get(self.key) is self:
+                del _ingestions[self.key]
+
+    def run(self):
+        self.status = RUNNING
+        try:
+            splitter = RecursiveCharacterTextSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+            pages, stored = self.pages()
+            page_texts, chunks, vectors = [], [], []
+            texts, metadatas = [], []
+            for page_number, text in pages:
+                if self.cancelled:
+                    break
+                page_texts.append(text)
+                page_chunks = splitter.split_text(text) if text else []
+                metadata = self.page_metadata(page_number)
+                chunks.extend({**metadata, 'start': start, 'end': end}
+                              for start, end in chunk_boundaries(text, page_chunks, self.chunk_overlap))
+                texts.extend(page_chunks)
+                metadatas.extend(dict(metadata) for _ in page_chunks)
+                if len(texts) >= self.batch_size:
+                    vectors.extend(self.flush(texts, metadatas))
+                    texts, metadatas = [], []
+                self.pages_done = page_number + 1
+            if not self.cancelled:
+                vectors.extend(self.flush(texts, metadatas))
+
+            with self._save_lock:
+                # A cancelled document may already be deleted from the store, it must not be saved again
+                if self.cancelled:
+                    self.status = CANCELLED
+                    return
+                if not stored:
+                    self.store.save_document(self.doc_key, page_texts, self.name, self.KIND, **self.document_meta())
+                if len(self.index):
+                    self.store.save_index(self.doc_key, self.settings, self.index.vec_db, chunks, vectors,
+                                          {'source_hash': self.key,
+                                           'model': embeddings_model_name(self.embeddings_model),
+                                           'index_type': 'flat', 'chunk_size': self.chunk_size,
+                                           'chunk_overlap': self.chunk_overlap, 'n_pages': self.n_pages,
+                                           'n_texts': len(self.index), 'created': time.time()},
+                                          lexical=self.index.lexical)
+                self.status = DONE
+        except Exception as e:
+            self.error = e
+            self.status = FAILED
+        finally:
+            self.finished = time.time()
+            self.pdf_bytes = None
+            with _ingestions_lock:
+                if _ingestions.get(self.key) is self:
+                    del _ingestions[self.key]
+
+
+# Ingestions running in this process, by document and settings key
+_ingestions = {}
+_ingestions_lock = threading.Lock()
+
+# Function to start the streaming ingestion of a PDF. Returns the PdfIngestion, its index answers
+# queries from the pages indexed so far. A PDF already in the document store is loaded instead,
+# and a PDF being indexed by another session returns that session's ingestion.
+def start_pdf_ingestion(pdf_bytes, embeddings_model, **kwargs):
+    return start_ingestion(PdfIngestion(pdf_bytes, embeddings_model, **kwargs))
+
+# Function to start an ingestion, or return the one of the same document already running
+def start_ingestion(ingestion):
+    with _ingestions_lock:
+        running = _ingestions.get(ingestion.key)
+        if running is not None:
+            return running
+        if ingestion.load():
+            return ingestion
+        _ingestions[ingestion.key] = ingestion
+    threading.Thread(target=ingestion.run, daemon=True).start()
+    return ingestion
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import PyPDF2
+from PyPDF2.generic import IndirectObject
+
+# Persistent cache of the text extracted from PDF pages, shared by the apps.
+# page.extract_text interprets the whole content stream of the page in pure
+# Python, a 500-page manual takes minutes. Each page text is keyed by the
+# fingerprint of what the extraction reads: the content stream, the fonts and
+# their encodings and ToUnicode maps, the form XObjects with their own fonts,
+# and the rotation. The objects are hashed by content, not by object number.
+# A PDF is also mapped from its file hash to its page fingerprints:
+# - the same file again: all its pages are read from the cache, without parsing them
+# - an edited file: the pages are fingerprinted (decompression only), and only
+#   the changed pages are extracted again
+# Pages and files are evicted least recently used first.
+#
+# The cache folder can be set with the PDF_PAGE_CACHE_DIR environment variable.
+
+PAGE_CACHE_VERSION = 2
+DEFAULT_CACHE_DIR = os.environ.get('PDF_PAGE_CACHE_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'practical_llms', 'pdf_pages'))
+DEFAULT_MAX_PAGES = 200000     # ~1 GB of text at 5 KB per page
+DEFAULT_MAX_FILES = 10000
+SQLITE_MAX_PARAMS = 900
+RESOURCE_KEYS = ['/Font', '/XObject']
+# Not read by the text extraction: the page tree, the stream encoding (the data is hashed decoded)
+# and the embedded font programs
+SKIPPED_KEYS = {'/Parent', '/Length', '/Filter', '/DecodeParms', '/FontDescriptor'}
+
+# Function to get the hash of a PDF file content
+def file_hash(pdf_bytes):
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+def resolve(obj):
+    return obj.get_object() if hasattr(obj, 'get_object') else obj
+
+# Function to add a PDF object to a fingerprint by its content. The indirect objects are resolved, so
+# the fingerprint does not depend on the object numbers nor on the reader. The keys the extraction does
+# not read are skipped, the streams are hashed decoded, and the resources only by their fonts and XObjects.
+def hash_object(digest, obj, seen=frozenset()):
+    if isinstance(obj, IndirectObject):
+        ref = (obj.idnum, obj.generation)
+        if ref in seen:
+            digest.update(b'\0cycle')
+            return
+        seen = seen | {ref}
+        obj = obj.get_object()
+    if isinstance(obj, dict):
+        # Images draw no text
+        if obj.get('/Subtype') == '/Image':
+            digest.update(b'\0image')
+            return
+        digest.update(b'\0<<')
+        # dict.items keeps the indirect objects unresolved, for the cycle check
+        for key, value in sorted(dict.items(obj), key=lambda item: item[0]):
+            if key in SKIPPED_KEYS:
+                continue
+            digest.update(f"\0{key}".encode('utf-8'))
+            if key == '/Resources':
+                value = resolve(value) or {}
+                value = {name: dict.__getitem__(value, name) for name in RESOURCE_KEYS if name in value}
+            hash_object(digest, value, seen)
+        digest.update(b'\0>>')
+        if hasattr(obj, 'get_data'):
+            digest.update(b'\0stream\0')
+            digest.update(obj.get_data())
+    elif isinstance(obj, list):
+        digest.update(b'\0[')
+        for item in obj:
+            hash_object(digest, item, seen)
+        digest.update(b'\0]')
+    else:
+        digest.update(f"\0{type(obj).__name__}\0{obj}".encode('utf-8'))
+
+# Function to get the fingerprint of a page: two pages with the same fingerprint give the same text
+def page_fingerprint(page):
+    digest = hashlib.sha256(f"{PAGE_CACHE_VERSION}\0{PyPDF2.__version__}\0{page.get('/Rotate', 0)}\0".encode('utf-8'))
+    contents = page.get_contents()
+    if contents is not None:
+        digest.update(contents.get_data())
+    # The fonts, with their encoding and ToUnicode map, and the form XObjects, with their own fonts
+    hash_object(digest, {'/Resources': dict.get(page, '/Resources')})
+    return digest.hexdigest()
+
+
+class PageTextCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_pages=DEFAULT_MAX_PAGES, max_files=DEFAULT_MAX_FILES):
+        self.max_pages = max_pages
+        self.max_files = max_files
+        os.makedirs(cache_dir, exist_ok=True)
+        # check_same_thread=False: the apps extract the pages in a background thread
+        self.db = sqlite3.connect(os.path.join(cache_dir, 'pages.sqlite'), timeout=60, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, text TEXT, last_access REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS pages_last_access ON pages (last_access)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (hash TEXT PRIMARY KEY, page_keys TEXT, last_access REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_last_access ON files (last_access)")
+        self.db.commit()
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    # Function to get the page fingerprints of a file already seen, None for a new file
+    def file_page_keys(self, pdf_hash):
+        with self.lock:
+            row = self.db.execute("SELECT page_keys FROM files WHERE hash = ?", (pdf_hash,)).fetchone()
+            if row is None:
+                return None
+            with self.db:
+                self.db.execute("UPDATE files SET last_access = ? WHERE hash = ?", (time.time(), pdf_hash))
+            return json.loads(row[0])
+
+    # Function to save the page fingerprints of a file
+    def put_file(self, pdf_hash, page_keys):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO files (hash, page_keys, last_access) VALUES (?, ?, ?)",
+                            (pdf_hash, json.dumps(page_keys), time.time()))
+            n_evict = self.db.execute("SELECT COUNT(*) FROM files").fetchone()[0] - self.max_files
+            if n_evict > 0:
+                self.db.execute("DELETE FROM files WHERE hash IN "
+                                "(SELECT hash FROM files ORDER BY last_access LIMIT ?)", (n_evict,))
+
+    # Function to look up the texts of many pages at once. Returns {key: text} for the cache hits.
+    def get_many(self, keys):
+        with self.lock:
+            texts = {}
+            unique_keys = list(set(keys))
+            for start in range(0, len(unique_keys), SQLITE_MAX_PARAMS):
+                chunk = unique_keys[start:start + SQLITE_MAX_PARAMS]
+                placeholders = ','.join('?' * len(chunk))
+                texts.update(self.db.execute(f"SELECT key, text FROM pages WHERE key IN ({placeholders})", chunk))
+            if texts:
+                # Refresh the LRU access time of the hits
+                now = time.time()
+                with self.db:
+                    self.db.executemany("UPDATE pages SET last_access = ? WHERE key = ?", [(now, key) for key in texts])
+            return texts
+
+    # Function to store the texts of pages, evicting the least recently used pages beyond max_pages
+    def put_many(self, keys, texts):
+        with self.lock, self.db:
+            now = time.time()
+            self.db.executemany("INSERT OR REPLACE INTO pages (key, text, last_access) VALUES (?, ?, ?)",
+                                [(key, text, now) for key, text in zip(keys, texts)])
+            n_evict = self.db.execute("SELECT COUNT(*) FROM pages").fetchone()[0] - self.max_pages
+            if n_evict > 0:
+                self.db.execute("DELETE FROM pages WHERE key IN "
+                                "(SELECT key FROM pages ORDER BY last_access LIMIT ?)", (n_evict,))
+
+
+_caches = {}
+
+# Function to get the process-wide page cache of a folder
+def get_page_cache(cache_dir=DEFAULT_CACHE_DIR):
+    if cache_dir not in _caches:
+        _caches[cache_dir] = PageTextCache(cache_dir)
+    return _caches[cache_dir]
@@ -0,0 +1,55 @@
+import json
+
+from langchain.document_loaders import YoutubeLoader
+from youtube_transcript_api import YouTubeTranscriptApi
+
+from pdf_ingestion import PdfIngestion, start_ingestion
+
+# Ingestion of a YouTube transcript into the document store, like a PDF
+# (pdf_ingestion.py): the transcript segments are grouped in sections of
+# window seconds that play the role of the pages, and each chunk keeps the
+# timestamp of its section, so an answer can cite where it is in the video.
+
+DEFAULT_WINDOW = 60   # Seconds of transcript per section
+
+# Function to get the transcript of a YouTube video, [{'text', 'start', 'duration'}]
+def load_transcript(url):
+    return YouTubeTranscriptApi.get_transcript(YoutubeLoader.extract_video_id(url))
+
+# Function to group the transcript segments in sections of window seconds. Returns (texts, start timestamps).
+def transcript_sections(segments, window=DEFAULT_WINDOW):
+    texts, timestamps = [], []
+    for segment in segments:
+        section = int(segment['start'] // window)
+        if not timestamps or section != int(timestamps[-1] // window):
+            texts.append([])
+            timestamps.append(float(segment['start']))
+        texts[-1].append(segment['text'])
+    return [' '.join(section) for section in texts], timestamps
+
+
+class TranscriptIngestion(PdfIngestion):
+    KIND = 'youtube'
+
+    # - segments: transcript of the video, as given by load_transcript
+    # - name: URL of the video
+    # - window: seconds of transcript per section
+    def __init__(self, segments, embeddings_model, name=None, window=DEFAULT_WINDOW, **kwargs):
+        self.sections, self.timestamps = transcript_sections(segments, window)
+        content = json.dumps({'window': window, 'segments': segments}, sort_keys=True).encode('utf-8')
+        super().__init__(content, embeddings_model, name=name, **kwargs)
+
+    def page_metadata(self, page_number):
+        return {'timestamp': self.timestamps[page_number]}
+
+    def document_meta(self):
+        return {'timestamps': self.timestamps}
+
+    def pages(self):
+        self.n_pages = len(self.sections)
+        return enumerate(self.sections), self.store.has_document(self.doc_key)
+
+
+# Function to start the ingestion of the transcript of a YouTube video. Returns the TranscriptIngestion.
+def start_transcript_ingestion(url, embeddings_model, **kwargs):
+    return start_ingestion(TranscriptIngestion(load_transcript(url), embeddings_model, name=url, **kwargs))
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+import faiss
+from langchain.vectorstores import FAISS
+
+from ann_index import build_index
+
+# Persistent FAISS vector stores shared by the recommenders and the RAG apps.
+# Each index is saved in a versioned directory named after the hash of its
+# source data (texts, metadatas and embeddings model), and memory-mapped when
+# loaded. A new Streamlit session reuses the saved index, which is rebuilt only
+# when the source data changes. The index type (flat, IVF, HNSW, PQ, ...) is
+# chosen with index_type, see ann_index.py.
+#
+# The index folder can be set with the VECTOR_INDEX_DIR environment variable.
+
+INDEX_VERSION = 1
+DEFAULT_INDEX_DIR = os.environ.get('VECTOR_INDEX_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'practical_llms', 'faiss'))
+META_FILE = 'index_meta.json'
+TEMP_PREFIX = '.tmp-'
+
+# Function to get the model name of a LangChain embeddings model
+def embeddings_model_name(embeddings_model):
+    return getattr(embeddings_model, 'model', type(embeddings_model).__name__)
+
+# Function to hash the source data of an index: any change in the texts, the metadatas, the model
+# or the index type gives a new index
+def source_hash(texts, metadatas=None, model='', index_type='flat'):
+    digest = hashlib.sha256(f"{INDEX_VERSION}\0{model}\0{index_type}\0".encode('utf-8'))
+    for text in texts:
+        digest.update(text.encode('utf-8'))
+        digest.update(b'\0')
+    if metadatas is not None:
+        digest.update(json.dumps(metadatas, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+# Function to read a FAISS index memory-mapped, falling back to a full read for the index types that cannot be mapped
+def read_faiss_index(path):
+    try:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        return faiss.read_index(path)
+
+# Function to load a vector database saved with FAISS.save_local, with its index memory-mapped
+def load_vector_database(path, embeddings_model):
+    index = read_faiss_index(os.path.join(path, 'index.faiss'))
+    with open(os.path.join(path, 'index.pkl'), 'rb') as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings_model.embed_query, index, docstore, index_to_docstore_id)
+
+# Function to save a vector database in its versioned directory.
+# The files are written in a temporary directory first, then renamed, so readers never see a partial index.
+# write_files(directory) can write more files next to the index, e.g. the chunks of a document.
+def save_vector_database(vec_db, path, meta, write_files=None):
+    base_dir = os.path.dirname(path)
+    os.makedirs(base_dir, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix=TEMP_PREFIX, dir=base_dir)
+    try:
+        vec_db.save_local(temp_dir)
+        if write_files is not None:
+            write_files(temp_dir)
+        with open(os.path.join(temp_dir, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(temp_dir, path)
+    except OSError:
+        # Another process saved the same version first, keep theirs
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        if not os.path.exists(os.path.join(path, META_FILE)):
+            raise
+
+# Function to remove the older versions of an index
+def remove_old_versions(base_dir, current_version):
+    for version in os.listdir(base_dir):
+        if version != current_version and not version.startswith(TEMP_PREFIX):
+            shutil.rmtree(os.path.join(base_dir, version), ignore_errors=True)
+
+# Function to load the saved vector database of the texts, or build and save it if the source data changed.
+# - name: index name, e.g. 'movie_titles', its versions are stored in index_dir/name/<source hash>
+# - index_type: one of ann_index.INDEX_TYPES, e.g. 'hnsw' or 'ivf_pq', or a faiss.index_factory string
+# - keep_old_versions: keep the indexes of other source data, e.g. one per uploaded PDF
+def load_or_build_vector_database(texts, embeddings_model, metadatas=None, name='default', index_type='flat',
+                                  index_dir=DEFAULT_INDEX_DIR, keep_old_versions=False):
+    model = embeddings_model_name(embeddings_model)
+    key = source_hash(texts, metadatas, model, index_type)
+    base_dir = os.path.join(index_dir, name)
+    path = os.path.join(base_dir, key[:16])
+
+    if os.path.exists(os.path.join(path, META_FILE)):
+        return load_vector_database(path, embeddings_model)
+
+    vec_db = FAISS.from_texts(texts, embeddings_model, metadatas=metadatas)
+    if index_type != 'flat':
+        # LangChain builds a flat index: its vectors are re-indexed in the same order, so the docstore ids still match
+        vec_db.index = build_index(vec_db.index.reconstruct_n(0, vec_db.index.ntotal), index_type)
+    save_vector_database(vec_db, path, {'version': INDEX_VERSION, 'source_hash': key, 'model': model,
+                                        'index_type': index_type,
+                                        'n_texts': len(texts), 'created': time.time()})
+    if not keep_old_versions:
+        remove_old_versions(base_dir, key[:16])
+    return vec_db